@@ -0,0 +1,200 @@
+"""
+Generates synthetic input corpora of PDF, DOCX, PPTX and TXT documents.
+
+The text is pseudo-English built from a fixed vocabulary and a seeded random
+generator, so equal parameters always produce byte-identical corpora.
+
+Usage:
+    python -m benchmarks.corpus OUTPUT_DIR --documents 8 --pages 10
+"""
+import argparse
+import os
+import random
+import zipfile
+from typing import List, Sequence
+from xml.sax.saxutils import escape
+
+VOCABULARY = (
+    "cell membrane protein enzyme energy glucose oxygen carbon molecule atom "
+    "nucleus chromosome gene mutation evolution species population ecosystem "
+    "photosynthesis respiration mitochondria chloroplast reaction catalyst "
+    "temperature pressure volume density force mass acceleration velocity "
+    "momentum gravity electron proton neutron charge current voltage circuit "
+    "resistance magnet wave frequency light sound spectrum equation theory "
+    "experiment hypothesis variable result analysis model structure function "
+    "process system layer boundary surface signal pathway transport diffusion "
+    "osmosis solution acid base salt bond compound element metal crystal"
+).split()
+FILLER = "the a of in and to is by which that with from its this".split()
+FORMATS = ("pdf", "docx", "pptx", "txt")
+PARAGRAPHS_PER_PAGE = 3
+
+
+def sentence(rng: random.Random) -> str:
+    words = [
+        rng.choice(VOCABULARY) if rng.random() < 0.6 else rng.choice(FILLER)
+        for _ in range(rng.randint(8, 20))
+    ]
+    return " ".join(words).capitalize() + "."
+
+
+def paragraph(rng: random.Random) -> str:
+    return " ".join(sentence(rng) for _ in range(rng.randint(3, 6)))
+
+
+def page_texts(rng: random.Random, pages: int) -> List[List[str]]:
+    return [
+        [paragraph(rng) for _ in range(PARAGRAPHS_PER_PAGE)] for _ in range(pages)
+    ]
+
+
+def write_txt(path: str, pages: Sequence[Sequence[str]]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join("\n\n".join(page) for page in pages))
+
+
+def write_pdf(path: str, pages: Sequence[Sequence[str]], line_chars: int = 90):
+    """
+    Writes a minimal PDF with one page per entry, set in Helvetica.
+    """
+    def pdf_string(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font_id = 3 + 2 * len(pages)
+    for i, paragraphs in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        lines = []
+        for text in paragraphs:
+            words, line = text.split(), ""
+            for word in words:
+                if line and len(line) + len(word) + 1 > line_chars:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}".strip()
+            lines.extend([line, ""])
+        operators = "".join(f"({pdf_string(line)}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {operators}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(output))
+        output += f"{i + 1} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    ).encode()
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+
+def write_docx(path: str, pages: Sequence[Sequence[str]]):
+    """
+    Writes a minimal DOCX package with one paragraph per text and a page
+    break between pages.
+    """
+    body = []
+    for i, paragraphs in enumerate(pages):
+        if i:
+            body.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+        body.extend(f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>" for text in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{''.join(body)}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", DOCX_RELS)
+        docx.writestr("word/document.xml", document)
+
+
+def write_pptx(path: str, pages: Sequence[Sequence[str]]):
+    """
+    Writes a PPTX presentation with one text box per text, one slide per page.
+    """
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    presentation = Presentation()
+    layout = presentation.slide_layouts[6]
+    for paragraphs in pages:
+        slide = presentation.slides.add_slide(layout)
+        for i, text in enumerate(paragraphs):
+            textbox = slide.shapes.add_textbox(Inches(0.5), Inches(0.5 + 2.2 * i), Inches(9), Inches(2))
+            textbox.text_frame.word_wrap = True
+            textbox.text_frame.text = text
+    presentation.save(path)
+
+
+WRITERS = {"pdf": write_pdf, "docx": write_docx, "pptx": write_pptx, "txt": write_txt}
+
+
+def generate_corpus(
+    output_dir: str,
+    documents: int = 8,
+    pages: int = 10,
+    formats: Sequence[str] = FORMATS,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Writes a synthetic corpus, cycling through the formats.
+
+    Args:
+        output_dir (str): The directory to write the documents to.
+        documents (int): The number of documents.
+        pages (int): The number of pages (slides for PPTX) per document.
+        formats (Sequence[str]): The document formats to cycle through.
+        seed (int): The random seed.
+
+    Returns:
+        List[str]: The paths of the written documents.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(documents):
+        fmt = formats[i % len(formats)]
+        path = os.path.join(output_dir, f"document_{i:04d}.{fmt}")
+        WRITERS[fmt](path, page_texts(rng, pages))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic input corpus.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.output_dir, args.documents, args.pages, args.formats, args.seed)
+    print(f"Generated {len(paths)} documents in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
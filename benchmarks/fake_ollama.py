@@ -0,0 +1,219 @@
+"""
+A local stand-in for Ollama's /api/generate endpoint, for benchmarks.
+
+Each request waits `latency` seconds (prompt evaluation), then produces a
+deterministic flashcard JSON document derived from the prompt at
+`tokens_per_second`, either at once or as a stream of NDJSON fragments. The
+final message carries Ollama's timing fields (eval_count, eval_duration, ...).
+
+Like Ollama with OLLAMA_NUM_PARALLEL, at most `parallel` requests are
+processed at once and the others queue; a fraction `error_rate` of the
+requests fails with 503.
+
+Usage:
+    python -m benchmarks.fake_ollama --port 11435 --latency 0.1 --tokens-per-second 400
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scripts.chunking import estimate_tokens
+
+# Characters per streamed fragment, about one token
+FRAGMENT_SIZE = 4
+# Fragments are written in batches at most this often, in seconds
+STREAM_INTERVAL = 0.02
+
+_WORD = re.compile(r"[A-Za-z]{4,}")
+
+
+def make_flashcards(prompt: str, cards: int = 5) -> str:
+    """
+    Returns a flashcard JSON document for a prompt, the same for equal prompts.
+    """
+    words = _WORD.findall(prompt) or ["topic"]
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    flashcards = []
+    for i in range(cards):
+        topic = words[(seed + i * 7) % len(words)]
+        detail = " ".join(words[(seed + i * 7 + j) % len(words)] for j in range(1, 9))
+        flashcards.append({
+            "question": f"What does the text say about {topic}?",
+            "answer": f"It relates {topic} to {detail}.",
+        })
+    return json.dumps({"flashcards": flashcards})
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "llama3:latest"}]})
+        else:
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, 404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        settings = self.server.settings
+        started = time.perf_counter()
+        if random.random() < settings["error_rate"]:
+            self._send_json({"error": "server overloaded"}, 503)
+            return
+        slots = self.server.slots
+        if slots:
+            slots.acquire()
+        try:
+            self._generate(request, settings, started)
+        finally:
+            if slots:
+                slots.release()
+
+    def _generate(self, request, settings, started):
+        prompt = request.get("prompt", "")
+        response = make_flashcards(prompt, settings["cards"])
+        eval_count = estimate_tokens(response)
+        prompt_eval_count = estimate_tokens(prompt)
+
+        time.sleep(settings["latency"])
+        prompt_done = time.perf_counter()
+        rate = settings["tokens_per_second"]
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            fragments = [
+                response[i : i + FRAGMENT_SIZE]
+                for i in range(0, len(response), FRAGMENT_SIZE)
+            ]
+            per_batch = max(1, int(rate * STREAM_INTERVAL)) if rate else len(fragments)
+            for start in range(0, len(fragments), per_batch):
+                lines = "".join(
+                    json.dumps({"model": request.get("model"), "response": fragment, "done": False}) + "\n"
+                    for fragment in fragments[start : start + per_batch]
+                )
+                self._write_chunk(lines.encode("utf-8"))
+                if rate:
+                    time.sleep(len(fragments[start : start + per_batch]) / rate)
+            final = {"model": request.get("model"), "response": "", "done": True}
+        else:
+            if rate:
+                time.sleep(eval_count / rate)
+            final = {"model": request.get("model"), "response": response, "done": True}
+
+        finished = time.perf_counter()
+        final.update({
+            "total_duration": int((finished - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": int((prompt_done - started) * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int((finished - prompt_done) * 1e9),
+        })
+        if request.get("stream"):
+            self._write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+            self._write_chunk(b"")
+        else:
+            self._send_json(final)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def serve(
+    port=0,
+    latency=0.1,
+    tokens_per_second=400.0,
+    cards=5,
+    host="127.0.0.1",
+    parallel=0,
+    error_rate=0.0,
+):
+    """
+    Starts the server in a background thread.
+
+    Args:
+        port (int): The port to listen on; 0 picks a free one.
+        latency (float): Seconds before the first token of each response.
+        tokens_per_second (float): Generation speed; 0 means instantaneous.
+        cards (int): The number of flashcards per response.
+        host (str): The interface to listen on.
+        parallel (int): The number of requests processed at once; 0 means unlimited.
+        error_rate (float): The fraction of requests answered with 503.
+
+    Returns:
+        ThreadingHTTPServer: The running server; its URL is
+            f"http://{host}:{server.server_address[1]}/api/generate".
+    """
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.settings = {
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "cards": cards,
+        "error_rate": error_rate,
+    }
+    server.slots = threading.BoundedSemaphore(parallel) if parallel else None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama /api/generate server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--cards", type=int, default=5)
+    parser.add_argument("--parallel", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(
+        args.port,
+        args.latency,
+        args.tokens_per_second,
+        args.cards,
+        args.host,
+        args.parallel,
+        args.error_rate,
+    )
+    # The benchmark runner reads the port from this line
+    print(f"Listening on {args.host}:{server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""
+Per-stage benchmarks of the flashcard pipeline.
+
+Generates a synthetic corpus, starts the fake Ollama server and runs each
+stage (CLI startup, extraction, text normalization, chunking, cache
+operations, generation and rendering) in its own subprocess, so that peak RSS is measured per stage. Reports
+throughput and per-item latency percentiles, and saves the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--documents 8] [--pages 10] [--output results.json]
+    python -m benchmarks.run --compare BASELINE.json CURRENT.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+STAGES = ("startup", "extraction", "normalization", "chunking", "cache", "generation", "rendering")
+# Relative change above which --compare reports a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def timed(iterable, samples):
+    """
+    Yields the items of an iterable, appending to `samples` the time elapsed
+    since the previous item was yielded: the time the consumer took to process
+    it plus the time the producer took to produce the next one.
+    """
+    last = time.perf_counter()
+    for item in iterable:
+        now = time.perf_counter()
+        samples.append(now - last)
+        last = now
+        yield item
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(samples, seconds, **extra):
+    """
+    Returns the throughput and latency percentiles of a stage.
+    """
+    if len(samples) >= 2:
+        percentiles = statistics.quantiles(samples, n=100, method="inclusive")
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = samples[0] if samples else 0.0
+    return {
+        "items": len(samples),
+        "seconds": round(seconds, 4),
+        "throughput": round(len(samples) / seconds, 3) if seconds else 0.0,
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        **extra,
+    }
+
+
+def _extract_corpus(corpus_dir):
+    from scripts.extract_text import extract_text_from_file, list_input_files
+
+    return [extract_text_from_file(path) for path in list_input_files(corpus_dir)]
+
+
+def _chunks(corpus_dir, model):
+    from scripts.chunking import iter_chunks, token_budget_for
+    from scripts.extract_text import clean_text
+
+    budget = token_budget_for(model)
+    return [
+        chunk
+        for texts in _extract_corpus(corpus_dir)
+        for chunk in iter_chunks(texts, budget, clean=clean_text)
+    ]
+
+
+def bench_startup(args, workdir):
+    """
+    Times fresh interpreters printing the CLI's help, which imports the CLI
+    but none of the stages. `interpreter_ms` is the time of an interpreter
+    that imports nothing, for reference.
+    """
+    def run(command):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - started
+
+    interpreter = min(run([sys.executable, "-c", "pass"]) for _ in range(3))
+    command = [sys.executable, os.path.join(PROJECT_ROOT, "flashcard_generator.py"), "--help"]
+    samples = []
+    started = time.perf_counter()
+    for _ in range(args.startup_runs):
+        samples.append(run(command))
+    seconds = time.perf_counter() - started
+    return summarize(samples, seconds, unit="runs", interpreter_ms=round(interpreter * 1000, 3))
+
+
+def bench_extraction(args, workdir):
+    from scripts.extract_text import extract_text_from_file, list_input_files
+
+    files = list_input_files(args.corpus_dir)
+    samples = []
+    started = time.perf_counter()
+    for path in files:
+        item_started = time.perf_counter()
+        extract_text_from_file(path)
+        samples.append(time.perf_counter() - item_started)
+    seconds = time.perf_counter() - started
+    size = sum(os.path.getsize(path) for path in files)
+    return summarize(samples, seconds, unit="documents", megabytes=round(size / 2**20, 3))
+
+
+def _legacy_clean_text(text):
+    # clean_text() before scripts.normalize, kept as the baseline
+    text = re.sub(r"\s+", " ", text)
+    text = "".join([char if ord(char) < 128 else " " for char in text])
+    return text.strip()
+
+
+def bench_normalization(args, workdir):
+    """
+    Normalizes pages of mixed-script text with ligatures, hyphenation and
+    control characters, then times the previous ASCII-only clean_text() on
+    the same pages (`legacy_seconds`).
+    """
+    from benchmarks.corpus import paragraph
+    from scripts.normalize import normalize_text
+
+    rng = random.Random(0)
+    extras = ("ef\ufb01cient", "cata-\nlyst", "caf\u00e9", "\u0394G = \u2211 x\u00b2", "\u4e2d\u6587", "\x00", "\u00a0")
+    pages, size = [], 0
+    while size < args.normalize_megabytes * 2**20:
+        words = "\n".join(paragraph(rng) for _ in range(3)).split(" ")
+        for _ in range(len(words) // 20):
+            words.insert(rng.randrange(len(words)), rng.choice(extras))
+        pages.append(" ".join(words))
+        size += len(pages[-1])
+
+    samples = []
+    started = time.perf_counter()
+    for page in pages:
+        item_started = time.perf_counter()
+        normalize_text(page)
+        samples.append(time.perf_counter() - item_started)
+    seconds = time.perf_counter() - started
+    legacy_started = time.perf_counter()
+    for page in pages:
+        _legacy_clean_text(page)
+    legacy_seconds = time.perf_counter() - legacy_started
+    return summarize(
+        samples,
+        seconds,
+        unit="pages",
+        megabytes=round(size / 2**20, 3),
+        legacy_seconds=round(legacy_seconds, 4),
+        speedup=round(legacy_seconds / seconds, 2) if seconds else 0.0,
+    )
+
+
+def bench_chunking(args, workdir):
+    from scripts.chunking import iter_chunks, token_budget_for
+    from scripts.extract_text import clean_text
+
+    documents = _extract_corpus(args.corpus_dir)
+    budget = token_budget_for(args.model)
+    samples, chunks = [], 0
+    started = time.perf_counter()
+    for texts in documents:
+        item_started = time.perf_counter()
+        chunks += len(list(iter_chunks(texts, budget, clean=clean_text)))
+        samples.append(time.perf_counter() - item_started)
+    seconds = time.perf_counter() - started
+    return summarize(samples, seconds, unit="documents", chunks=chunks)
+
+
+def bench_cache(args, workdir):
+    from scripts.caching import CacheStore, cache_key
+
+    files_dir = os.path.join(workdir, "cache_files")
+    os.makedirs(files_dir, exist_ok=True)
+    keys = []
+    for i in range(args.cache_entries):
+        path = os.path.join(files_dir, f"{i}.json")
+        with open(path, "w") as f:
+            f.write("{}")
+        keys.append((cache_key(f"chunk {i}", model=args.model), path))
+
+    store = CacheStore(os.path.join(workdir, "bench_cache.db"))
+    samples = []
+    started = time.perf_counter()
+    for key, path in keys:
+        item_started = time.perf_counter()
+        store.add(key, path)
+        samples.append(time.perf_counter() - item_started)
+    store.release()
+    random.Random(0).shuffle(keys)
+    for key, _ in keys:
+        item_started = time.perf_counter()
+        store.get(key)
+        samples.append(time.perf_counter() - item_started)
+    store.flush()
+    seconds = time.perf_counter() - started
+    store.close()
+    return summarize(samples, seconds, unit="operations")
+
+
+def bench_generation(args, workdir):
+    from scripts import caching, streams
+    from scripts.generate_flashcards import agenerate
+
+    chunks = _chunks(args.corpus_dir, args.model)
+    store = caching.CacheStore(os.path.join(workdir, "generation_cache.db"))
+    output_path = os.path.join(workdir, "generation_json")
+    os.makedirs(output_path, exist_ok=True)
+    results = agenerate(
+        chunks, output_path, store, args.model, args.concurrency, args.stream
+    )
+    samples = []
+    started = time.perf_counter()
+    for _ in timed(streams.iterate_async(results), samples):
+        pass
+    seconds = time.perf_counter() - started
+    store.close()
+    return summarize(samples, seconds, unit="chunks", concurrency=args.concurrency)
+
+
+def bench_rendering(args, workdir):
+    from benchmarks.corpus import sentence
+    from scripts.assets import optimize_assets
+    from scripts.create_presentation import create_from_flashcards, load_conf
+
+    rng = random.Random(0)
+    cards = [
+        {"question": sentence(rng)[:-1] + "?", "answer": [sentence(rng) for _ in range(2)]}
+        for _ in range(args.cards)
+    ]
+    optimize_assets(load_conf(), args.quality)
+    samples = []
+    started = time.perf_counter()
+    create_from_flashcards(
+        workdir, "bench.pptx", timed(cards, samples), "Benchmark", args.quality, progress=False
+    )
+    seconds = time.perf_counter() - started
+    return summarize(
+        samples,
+        seconds,
+        unit="cards",
+        megabytes=round(os.path.getsize(os.path.join(workdir, "bench.pptx")) / 2**20, 3),
+    )
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "extraction": bench_extraction,
+    "normalization": bench_normalization,
+    "chunking": bench_chunking,
+    "cache": bench_cache,
+    "generation": bench_generation,
+    "rendering": bench_rendering,
+}
+
+
+def run_stage(args):
+    """
+    Runs one stage in this process and prints its results as JSON.
+    """
+    result = BENCHMARKS[args.stage](args, args.workdir)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(args):
+    from benchmarks.corpus import generate_corpus
+
+    workdir = tempfile.mkdtemp(prefix="flashcard-bench-")
+    corpus_dir = os.path.join(workdir, "corpus")
+    generate_corpus(corpus_dir, args.documents, args.pages, seed=args.seed)
+
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_ollama", "--port", "0",
+            "--latency", str(args.latency),
+            "--tokens-per-second", str(args.tokens_per_second),
+        ],
+        cwd=PROJECT_ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    port = server.stdout.readline().rsplit(":", 1)[1].strip()
+    env = dict(os.environ, OLLAMA_API_URL=f"http://127.0.0.1:{port}/api/generate")
+
+    stage_args = [
+        "--corpus-dir", corpus_dir,
+        "--model", args.model,
+        "--concurrency", str(args.concurrency),
+        "--cards", str(args.cards),
+        "--cache-entries", str(args.cache_entries),
+        "--quality", args.quality,
+        "--startup-runs", str(args.startup_runs),
+        "--normalize-megabytes", str(args.normalize_megabytes),
+    ] + (["--stream"] if args.stream else [])
+
+    results = {}
+    try:
+        for stage in args.stages:
+            print(f"Running {stage} benchmark...", file=sys.stderr)
+            stage_dir = os.path.join(workdir, stage)
+            os.makedirs(stage_dir)
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", "--stage", stage,
+                 "--workdir", stage_dir] + stage_args,
+                cwd=PROJECT_ROOT, env=env, capture_output=True, text=True,
+            )
+            if process.returncode != 0:
+                sys.stderr.write(process.stderr)
+                raise SystemExit(f"The {stage} benchmark failed.")
+            results[stage] = json.loads(process.stdout.strip().splitlines()[-1])
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            name: getattr(args, name)
+            for name in (
+                "documents", "pages", "seed", "model", "concurrency", "stream",
+                "latency", "tokens_per_second", "cards", "cache_entries", "quality",
+                "startup_runs", "normalize_megabytes",
+            )
+        },
+        "stages": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'unknown'}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"Results saved to {output}")
+
+
+def print_report(report):
+    print(f"{'stage':<12}{'items':>8}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>10}")
+    for stage, result in report["stages"].items():
+        print(
+            f"{stage:<12}{result['items']:>8}{result['throughput']:>12.2f}"
+            f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            f"{result['peak_rss_mb']:>10.1f}"
+        )
+
+
+def compare(baseline_path, current_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints the relative change of each stage's metrics between two result
+    files.
+
+    Returns:
+        bool: True if any metric regressed by more than the threshold.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f"{baseline.get('commit')} -> {current.get('commit')}")
+    # Metric -> whether higher values are better
+    metrics = {"throughput": True, "p95_ms": False, "peak_rss_mb": False}
+    regressed = False
+    for stage, result in current["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base:
+            continue
+        changes = []
+        for metric, higher_is_better in metrics.items():
+            if not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            flag = " REGRESSION" if worse > threshold else ""
+            regressed = regressed or bool(flag)
+            changes.append(f"{metric} {base[metric]} -> {result[metric]} ({change:+.1%}){flag}")
+        print(f"{stage:<12}" + "; ".join(changes))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmarks of the flashcard pipeline.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--documents", type=int, default=8, help="Number of synthetic documents.")
+    parser.add_argument("--pages", type=int, default=10, help="Pages (or slides) per document.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake server latency in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Fake server generation speed.")
+    parser.add_argument("--cards", type=int, default=200, help="Flashcards rendered by the rendering stage.")
+    parser.add_argument("--cache-entries", type=int, default=2000, help="Entries written and read by the cache stage.")
+    parser.add_argument("--quality", default="high", help="Image quality profile of the rendering stage.")
+    parser.add_argument("--startup-runs", type=int, default=10, help="CLI starts timed by the startup stage.")
+    parser.add_argument(
+        "--normalize-megabytes", type=float, default=8, help="Text normalized by the normalization stage, in MB."
+    )
+    parser.add_argument("-o", "--output", help="Path of the JSON results file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two results files.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    # Internal: run a single stage in this process
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, threshold=args.threshold) else 0)
+    elif args.stage:
+        run_stage(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,250 @@
 #!/usr/bin/env python3
 import argparse
-from scripts.extract_text import extract
-from scripts.generate_flashcards import generate
-from scripts.create_presentation import create
+import json
+import os
+# The stages (python-pptx, pypdf, httpx, ...) are imported when they run, so
+# that --help, argument errors and cached runs start quickly; keep the imports
+# here limited to modules that only need the standard library.
+from scripts.exporters import DEFAULT_FORMAT, EXPORTERS, export, output_file_name
+from scripts.flashcards import list_json_files, load_flashcards
+from scripts.chunking import token_budget_for
+from scripts.assets import DEFAULT_PROFILE, PROFILES
+from scripts import metrics
+from scripts.profiling import STAGES, StageProfiler
+
+
+def parse_option(value):
+    """Parses a KEY=VALUE model option, decoding VALUE as JSON when possible."""
+    key, sep, raw = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {value!r}.")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def parse_backend(value):
+    """Parses a URL[,weight=W][,concurrency=N] backend."""
+    url, *settings = value.split(",")
+    backend = {"url": url}
+    for setting in settings:
+        key, _, raw = setting.partition("=")
+        try:
+            if key == "weight":
+                backend["weight"] = float(raw)
+            elif key == "concurrency":
+                backend["concurrency"] = int(raw)
+            else:
+                raise ValueError
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid backend setting {setting!r}.")
+    return backend
+
+
+def parse_hedge(value):
+    """Parses a hedge delay in seconds or "auto"."""
+    if value == "auto":
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected seconds or 'auto', got {value!r}.")
+
+
+def add_generation_arguments(parser):
+    """Adds the extraction, generation and export options shared by the entry points."""
+    parser.add_argument(
+        "-m", "--model", help="Specify the AI model to use.", default="llama3"
+    )
+    parser.add_argument(
+        "--option",
+        help="Ollama generation option as KEY=VALUE, e.g. temperature=0.2. Can be repeated.",
+        type=parse_option,
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of processes used to extract text and render shards in parallel.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        help="Estimated number of tokens per chunk sent to the model "
+        "(default: derived from the model's context size).",
+        type=int,
+    )
+    parser.add_argument(
+        "--overlap-tokens",
+        help="Number of tokens repeated between consecutive chunks.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="Number of chunks sent to the AI model in parallel.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--adaptive",
+        help="Adapt the number of requests in flight, up to --concurrency, to the "
+        "latency and errors of the model server.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Seconds without data from the model before a request is retried.",
+        type=float,
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries of a request that timed out or failed with a transient error.",
+        type=int,
+    )
+    parser.add_argument(
+        "--backend",
+        help="Ollama server to send requests to, as URL[,weight=W][,concurrency=N]. "
+        "Repeat to balance the requests over several servers.",
+        type=parse_backend,
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--backends",
+        help="JSON file listing the Ollama servers to balance the requests over.",
+    )
+    parser.add_argument(
+        "--hedge",
+        help="Also send a request that has not answered after SECONDS to a second "
+        "server; without SECONDS, the 95th percentile of recent latencies is used.",
+        type=parse_hedge,
+        nargs="?",
+        const="auto",
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        help="Stream model responses and parse flashcards as they are generated.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Size budget of the flashcard cache in megabytes.",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        help="Evict cached flashcards that have not been used for this many days.",
+        type=int,
+    )
+    parser.add_argument(
+        "--similarity",
+        help="Reuse the cached flashcards of a near-identical chunk when the estimated "
+        "similarity is at least this value (0 disables).",
+        type=float,
+        default=0.9,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format: a PowerPoint presentation, an Anki package, CSV, TSV "
+        "or a static HTML page.",
+        choices=list(EXPORTERS),
+        default=DEFAULT_FORMAT,
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        help="Image quality profile of the presentation. Profiles other than "
+        "'original' are lossy: they embed downscaled, recompressed backgrounds.",
+        choices=list(PROFILES),
+        default=DEFAULT_PROFILE,
+    )
+    parser.add_argument(
+        "--shard-size",
+        help="Render the presentation as parts of this many flashcards, in parallel.",
+        type=int,
+    )
+    parser.add_argument(
+        "--merge",
+        help="Merge the rendered parts into a single presentation.",
+        action="store_true",
+    )
+    replay_group = parser.add_mutually_exclusive_group()
+    replay_group.add_argument(
+        "--record",
+        help="Record the model's responses to this archive, bypassing the flashcard cache.",
+        metavar="ARCHIVE",
+    )
+    replay_group.add_argument(
+        "--replay",
+        help="Serve the model's responses from an archive written by --record, "
+        "without contacting the model.",
+        metavar="ARCHIVE",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        help="Speed-up factor of replayed responses (0 replays them instantly).",
+        type=float,
+        default=1.0,
+    )
+
+
+def generation_options(args) -> dict:
+    """Returns the `generate_flashcards.generate()` arguments of parsed options."""
+    generate_options = dict(
+        model=args.model,
+        concurrency=args.concurrency,
+        stream=args.stream,
+        cache_max_bytes=args.cache_size * 1024 * 1024,
+        cache_max_age=args.cache_max_age * 86400 if args.cache_max_age else None,
+        options=dict(args.option),
+        similarity_threshold=args.similarity,
+        adaptive=args.adaptive,
+        backends=args.backend or None,
+        hedge=args.hedge,
+    )
+    if args.timeout is not None:
+        generate_options["timeout"] = args.timeout
+    if args.retries is not None:
+        generate_options["retries"] = args.retries
+    if args.backends:
+        from scripts.ollama_client import load_backends
+
+        conf = load_backends(args.backends)
+        generate_options["backends"] = args.backend + conf["backends"]
+        if args.hedge is None:
+            generate_options["hedge"] = conf["hedge"]
+    if args.record:
+        from scripts.replay import RecordingTransport
+
+        generate_options.update(transport=RecordingTransport(args.record), refresh=True)
+    elif args.replay:
+        from scripts.replay import ReplayTransport
+
+        generate_options.update(
+            transport=ReplayTransport(args.replay, args.replay_speed), refresh=True
+        )
+    return generate_options
+
+
+def export_options(args) -> dict:
+    """Returns the format-specific export options of parsed options."""
+    if args.format != "pptx":
+        return {}
+    return dict(
+        quality=args.quality,
+        shard_size=args.shard_size,
+        workers=args.workers,
+        merge=args.merge,
+    )
 
 
 def main():
@@ -13,7 +255,9 @@ def main():
     parser.add_argument(
         "-i",
         "--input",
-        help="Path to the input file or directory containing [.pptx, .pdf, .txt, .docx] files.",
+        help="Path to the input file or directory containing [.pptx, .pdf, .txt, .docx] files. "
+        "With --watch, can be repeated to build one deck per input.",
+        action="append",
         required=True,
     )
     parser.add_argument(
@@ -22,24 +266,75 @@ def main():
     parser.add_argument(
         "-n",
         "--name",
-        help="Name of the output PowerPoint presentation file (without extension).",
+        help="Name of the output file (without extension).",
         required=True,
     )
     parser.add_argument(
         "-t", "--title", help="Title of the output presentation.", required=True
     )
+    add_generation_arguments(parser)
     parser.add_argument(
-        "-m", "--model", help="Specify the AI model to use.", default="llama3"
+        "--rescan",
+        help="Re-extract every input document, ignoring the manifest of unchanged files.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-p",
+        "--pipeline",
+        help="Stream chunks and flashcards between the stages in memory instead of "
+        "through intermediate files.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch",
+        help="Keep running: build the deck, then rebuild it whenever documents are "
+        "added to, modified in or removed from the input.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="Seconds between two scans of the inputs in watch mode.",
+        type=float,
+    )
+    parser.add_argument(
+        "--debounce",
+        help="Seconds an input must stay unchanged before its deck is rebuilt in watch mode.",
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write timings, token throughput and cache statistics to this file: "
+        "Prometheus text format if it ends with .prom, a JSON report otherwise.",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the given stages (default: all) with stack sampling and "
+        "tracemalloc, writing per-stage profiles and a hotspot summary.",
+        nargs="*",
+        choices=STAGES,
+        metavar="STAGE",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="Directory of the profiles (default: <output>/profiles).",
     )
     parser.add_argument("-d", "--debug", help="Enable debug mode.", action="store_true")
 
     args = parser.parse_args()
+    if len(args.input) > 1 and not args.watch:
+        parser.error("several inputs (-i) require --watch")
 
-    input_path = args.input
+    input_path = args.input[0]
     output_path = args.output
-    name = args.name + ".pptx"
+    name = output_file_name(args.name, args.format)
     title = args.title
     model = args.model
+    options = dict(args.option)
+    workers = args.workers
+    token_budget = args.chunk_tokens or token_budget_for(model, options.get("num_ctx"))
+    concurrency = args.concurrency
+    stream = args.stream
     debug = args.debug
 
     if debug:
@@ -48,19 +343,110 @@ def main():
         print(f"Presentation Name: {name}")
         print(f"Title: {title}")
         print(f"Model: {model}")
+        print(f"Options: {options}")
+        print(f"Workers: {workers}")
+        print(f"Chunk Tokens: {token_budget}")
+        print(f"Concurrency: {concurrency}")
+        print(f"Streaming: {stream}")
         print("Debug mode enabled.")
 
-    # Step 1: Extract text from the input files
-    extract(input_path)
+    generate_options = generation_options(args)
+    render_options = export_options(args)
+
+    profiler = StageProfiler(
+        STAGES if args.profile == [] else args.profile or [],
+        args.profile_dir or os.path.join(output_path, "profiles"),
+    )
+
+    try:
+        if args.watch:
+            import asyncio
+            from scripts.pipeline import Deck
+            from scripts.watch import Daemon
+
+            decks = [Deck(input_path, os.path.join(output_path, name), title)]
+            if len(args.input) > 1:
+                decks = [
+                    Deck(
+                        path,
+                        os.path.join(output_path, output_file_name(f"{args.name}-{base}", args.format)),
+                        f"{title}: {base}",
+                    )
+                    for path in args.input
+                    for base in [os.path.basename(os.path.normpath(path))]
+                ]
+            watch_options = dict(interval=args.watch_interval, debounce=args.debounce)
+            daemon = Daemon(
+                decks,
+                token_budget,
+                overlap_tokens=args.overlap_tokens,
+                workers=workers,
+                export_format=args.format,
+                render_options=render_options,
+                **{key: value for key, value in watch_options.items() if value is not None},
+                **generate_options,
+            )
+            try:
+                asyncio.run(daemon.run())
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                print("Stopped watching.")
+            return
+
+        if args.pipeline:
+            from scripts.pipeline import run_pipeline
+
+            with profiler.stage("pipeline"), metrics.timer("stage_seconds_total", stage="pipeline"):
+                run_pipeline(
+                    input_path,
+                    output_path,
+                    name,
+                    title,
+                    token_budget,
+                    overlap_tokens=args.overlap_tokens,
+                    workers=workers,
+                    incremental=not args.rescan,
+                    quality=args.quality,
+                    shard_size=args.shard_size,
+                    merge=args.merge,
+                    export_format=args.format,
+                    **generate_options,
+                )
+            return
+
+        # Step 1: Extract text from the input files
+        with profiler.stage("extract"), metrics.timer("stage_seconds_total", stage="extract"):
+            from scripts.extract_text import extract
+
+            extract(
+                input_path,
+                workers=workers,
+                incremental=not args.rescan,
+                token_budget=token_budget,
+                overlap_tokens=args.overlap_tokens,
+            )
+
+        # Step 2: Generate flashcards from the extracted text
+        with profiler.stage("generate"), metrics.timer("stage_seconds_total", stage="generate"):
+            from scripts.generate_flashcards import generate
 
-    # Step 2: Generate flashcards from the extracted text
-    file_paths = generate(debug=debug, model=model)
+            file_paths = generate(debug=debug, **generate_options)
 
-    # Step 3: Create a PowerPoint presentation from the generated flashcards
-    if file_paths:
-        create(output_path, name, file_paths, title)
-    else:
-        print("No flashcards generated.")
+        # Step 3: Create a PowerPoint presentation (or another format) from the generated flashcards
+        if file_paths:
+            with profiler.stage("export"), metrics.timer("stage_seconds_total", stage="export"):
+                export(
+                    args.format,
+                    os.path.join(output_path, name),
+                    load_flashcards(list_json_files(file_paths)),
+                    title,
+                    **render_options,
+                )
+        else:
+            print("No flashcards generated.")
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+            print(f"Metrics written: {args.metrics}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import os
+from flashcard_generator import add_generation_arguments, export_options, generation_options
+from scripts import metrics
+from scripts.chunking import token_budget_for
+from scripts.extract_text import PROJECT_ROOT
+from scripts.pipeline import WarmPipeline
+from scripts.service import (
+    DEFAULT_JOB_WORKERS,
+    DEFAULT_PORT,
+    MAX_QUEUED_JOBS,
+    MAX_UPLOAD_BYTES,
+    JobService,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="HTTP service that queues uploaded documents and turns them into flashcard decks."
+    )
+    parser.add_argument("--host", help="Interface to listen on.", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on.", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--jobs-dir",
+        help="Directory of the job queue, the uploads, their extraction manifest and "
+        "the generated decks.",
+        default=os.path.join(PROJECT_ROOT, "jobs"),
+    )
+    parser.add_argument(
+        "--job-workers",
+        help="Number of jobs processed at once. They share --concurrency requests to the model.",
+        type=int,
+        default=DEFAULT_JOB_WORKERS,
+    )
+    parser.add_argument(
+        "--max-queued",
+        help="Number of waiting jobs beyond which uploads are refused with 503.",
+        type=int,
+        default=MAX_QUEUED_JOBS,
+    )
+    parser.add_argument(
+        "--max-upload",
+        help="Maximum size of an uploaded document in megabytes.",
+        type=int,
+        default=MAX_UPLOAD_BYTES // (1024 * 1024),
+    )
+    add_generation_arguments(parser)
+    parser.add_argument(
+        "--metrics",
+        help="Write timings, token throughput and cache statistics to this file when "
+        "the service stops (they are also served at /metrics).",
+        metavar="PATH",
+    )
+    args = parser.parse_args()
+
+    options = dict(args.option)
+    pipeline = WarmPipeline(
+        args.chunk_tokens or token_budget_for(args.model, options.get("num_ctx")),
+        overlap_tokens=args.overlap_tokens,
+        workers=args.workers,
+        export_format=args.format,
+        render_options=export_options(args),
+        manifest_path=os.path.join(args.jobs_dir, "manifest.db"),
+        **generation_options(args),
+    )
+    service = JobService(
+        pipeline,
+        args.jobs_dir,
+        job_workers=args.job_workers,
+        max_queued=args.max_queued,
+        max_upload_bytes=args.max_upload * 1024 * 1024,
+    )
+    try:
+        asyncio.run(service.run(args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Service stopped.")
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+            print(f"Metrics written: {args.metrics}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+from typing import Dict, Tuple
+
+from scripts.manifest import hash_file
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
+ASSET_CACHE_DIR = os.path.join(PROJECT_ROOT, "asset_cache")
+
+# Quality profiles: the width of the whole slide in pixels that images are
+# resampled for, and how they are re-encoded. "colors" quantizes images with
+# transparency to a palette (the bundled backgrounds are flat illustrations);
+# "jpeg_quality" re-encodes opaque images as JPEG.
+PROFILES = {
+    "original": None,
+    "high": {"slide_px": 3840, "colors": 256, "jpeg_quality": 90},
+    "medium": {"slide_px": 1920, "colors": 256, "jpeg_quality": 85},
+    "low": {"slide_px": 1280, "colors": 128, "jpeg_quality": 70},
+}
+DEFAULT_PROFILE = "original"
+
+
+def target_sizes(conf) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the largest extent, in EMU, at which each configured image is placed.
+    """
+    images = [*conf["bgs"], conf["flash_card"], conf["header"], conf["footer"]]
+    sizes = {}
+    for image in images:
+        width, height = sizes.get(image["img_path"], (0, 0))
+        sizes[image["img_path"]] = (
+            max(width, image["width"]),
+            max(height, image["height"]),
+        )
+    return sizes
+
+
+def _has_alpha(image: "Image.Image") -> bool:
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        return image.convert("RGBA").getchannel("A").getextrema()[0] < 255
+    return False
+
+
+def derive_image(image: "Image.Image", size: Tuple[int, int], profile: dict, output_path: str):
+    """
+    Resamples an image to a pixel size and re-encodes it for a profile, as
+    JPEG if the output path says so and as PNG otherwise.
+
+    Args:
+        image (Image.Image): The source image.
+        size (Tuple[int, int]): The target (width, height) in pixels.
+        profile (dict): The quality profile.
+        output_path (str): The path of the derived image.
+    """
+    from PIL import Image
+
+    jpeg = output_path.endswith(".jpg")
+    image = image.convert("RGB" if jpeg else "RGBA")
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    tmp_path = output_path + ".tmp"
+    if jpeg:
+        image.save(tmp_path, "JPEG", quality=profile["jpeg_quality"], optimize=True)
+    else:
+        if profile["colors"]:
+            image = image.quantize(profile["colors"], method=Image.Quantize.FASTOCTREE)
+        image.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, output_path)
+
+
+def optimized_image_path(
+    img_path: str, extent: Tuple[int, int], slide_width: int, profile_name: str = DEFAULT_PROFILE
+) -> str:
+    """
+    Returns the path of the variant of an image suited to a quality profile,
+    deriving it on first use.
+
+    Derived images are cached in `asset_cache/`, keyed by the source's content
+    hash, the target pixel size and the profile, so they are only recomputed
+    when the image, its placement in `static/conf.json` or the profile change.
+    A derivative that is not smaller than its source is replaced by a copy of
+    the source.
+
+    Args:
+        img_path (str): The image path, relative to the project root.
+        extent (Tuple[int, int]): The (width, height) the image is placed at, in EMU.
+        slide_width (int): The slide width, in EMU.
+        profile_name (str): One of PROFILES. Defaults to "original".
+
+    Returns:
+        str: The image path to embed, relative to the project root or absolute.
+    """
+    profile = PROFILES[profile_name]
+    if profile is None:
+        return img_path
+    # Imported here so that loading the profiles does not load Pillow
+    from PIL import Image
+
+    source = os.path.join(PROJECT_ROOT, img_path)
+    scale = profile["slide_px"] / slide_width
+    with Image.open(source) as image:
+        # Never upscale
+        size = (
+            min(image.width, max(1, round(extent[0] * scale))),
+            min(image.height, max(1, round(extent[1] * scale))),
+        )
+        stem = os.path.splitext(os.path.basename(img_path))[0]
+        key = f"{hash_file(source)[:16]}-{size[0]}x{size[1]}-{profile_name}"
+        base_path = os.path.join(ASSET_CACHE_DIR, f"{stem}-{key}")
+        source_ext = os.path.splitext(img_path)[1].lower()
+        for ext in dict.fromkeys((".png", ".jpg", source_ext)):
+            if os.path.exists(base_path + ext):
+                return base_path + ext
+
+        jpeg = profile["jpeg_quality"] and not _has_alpha(image)
+        output_path = base_path + (".jpg" if jpeg else ".png")
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        derive_image(image, size, profile, output_path)
+
+    if os.path.getsize(output_path) >= os.path.getsize(source):
+        os.remove(output_path)
+        output_path = base_path + source_ext
+        shutil.copyfile(source, output_path + ".tmp")
+        os.replace(output_path + ".tmp", output_path)
+    return output_path
+
+
+def optimize_assets(conf, profile_name: str = DEFAULT_PROFILE) -> Dict[str, str]:
+    """
+    Maps each image of a configuration to the variant to embed for a profile.
+
+    Args:
+        conf (dict): The presentation configuration (`static/conf.json`).
+        profile_name (str): One of PROFILES. Defaults to "original".
+
+    Returns:
+        Dict[str, str]: Configured image path -> path of the image to embed.
+    """
+    return {
+        img_path: optimized_image_path(img_path, extent, conf["slide_width"], profile_name)
+        for img_path, extent in target_sizes(conf).items()
+    }
@@ -1,61 +1,20 @@
-
+import contextvars
 import hashlib
+import json
 import sqlite3
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
+from scripts import metrics
 
-CACHE_LIMIT = 10
-
-
-def init_cache_db(cache_db_path: str):
-    """
-    Initializes the cache database by creating a table if it doesn't exist.
-
-    Args:
-        cache_db_path (str): The path to the cache database file.
-
-    Returns:
-        None
-    """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS cache (
-            hash TEXT PRIMARY KEY,
-            file_path TEXT,
-            file_size INTEGER,
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-
-# Function to get the file path from the cache database
-import sqlite3
-
-def get_file_path_from_cache(cache_db_path: str, hash: str):
-    """
-    Retrieves the file path associated with the given hash from the cache database.
-
-    Args:
-        cache_db_path (str): The path to the cache database.
-        hash (str): The hash value to search for in the cache.
 
-    Returns:
-        str: The file path associated with the given hash, or None if no matching hash is found.
-    """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT file_path FROM cache WHERE hash = ?
-    ''', (hash,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
+# Default byte budget for the flashcard files referenced by the cache
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Default number of entries kept in the in-process tier
+DEFAULT_MEMORY_SIZE = 4096
 
-import hashlib
 
 def generate_sha256(file: str) -> str:
     """
@@ -71,154 +30,392 @@ def generate_sha256(file: str) -> str:
     sha.update(file.encode('utf-8'))
     return sha.hexdigest()
 
-# add the file path to the cache database queue
-def add_file_path_to_cache(cache_db_path: str, hash: str, file_path: str):
-    file_size = os.path.getsize(file_path)
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO cache (hash, file_path, file_size) VALUES (?, ?, ?)
-    ''', (hash, file_path, file_size))
-    conn.commit()
-    conn.close()
-    size = get_cache_size(cache_db_path) 
-    if size > CACHE_LIMIT:
-        delete_oldest_entry(cache_db_path)
-
-# get cache
-def get_cache(cache_db_path: str):
+
+def cache_key(text: str, **params) -> str:
     """
-    Retrieves all the data from the cache table in the specified SQLite database.
+    Generate the cache key of a chunk: the SHA256 hash value of its text and of
+    every parameter that influences the generated flashcards.
 
     Args:
-        cache_db_path (str): The path to the SQLite database file.
+        text (str): The chunk text.
+        **params: JSON-serializable parameters such as the model name, the prompt
+            version and the generation options.
 
     Returns:
-        list: A list of tuples representing the rows retrieved from the cache table.
+        str: The SHA256 hash value of the text and parameters.
     """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT * FROM cache
-    ''')
-    result = c.fetchall()
-    conn.close()
-    return result
-
-# check database size
-import sqlite3
+    return generate_sha256(json.dumps({"text": text, **params}, sort_keys=True))
 
-def get_cache_size(cache_db_path: str) -> int:
+
+class MemoryLRU:
+    """
+    Bounded in-process LRU mapping, used as the first cache tier.
     """
-    Retrieves the number of records in the cache table of the specified database.
 
-    Args:
-        cache_db_path (str): The path to the cache database.
+    def __init__(self, maxsize: int = DEFAULT_MEMORY_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
 
-    Returns:
-        int: The number of records in the cache table.
-    """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT COUNT(*) FROM cache
-    ''')
-    result = c.fetchone()
-    conn.close()
-    return result[0]
-
-# delete the oldest entry in the cache database
-import sqlite3
+    def get(self, key):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return None
+        return self._data[key]
 
-def delete_oldest_entry(cache_db_path: str):
-    """
-    Deletes the oldest entry from the cache table in the specified SQLite database.
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
 
-    Args:
-        cache_db_path (str): The path to the SQLite database file.
+    def pop(self, key):
+        self._data.pop(key, None)
 
-    Returns:
-        None
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheStore:
+    """
+    SQLite-backed cache mapping chunk hashes to generated flashcard files.
+
+    The store keeps a single connection in WAL mode for its whole lifetime and
+    is safe to share between threads. Entries are evicted least recently used
+    first once the referenced files exceed `max_bytes`, or once they have not
+    been used for `max_age` seconds. Every entry added or looked up through
+    the store is pinned for the lifetime of the run, so eviction never removes
+    a file the current run still needs; call `release()` to unpin them. Runs
+    that share a store concurrently each pin their entries in their own scope
+    (see `pins()`), which is released when the run ends.
+
+    The most recently used `memory_size` entries are also kept in a
+    `MemoryLRU` in front of the database, so repeated lookups of hot keys
+    never reach SQLite.
     """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT * FROM cache WHERE updated_at = (SELECT MIN(updated_at) FROM cache)
-    ''')
-    one = c.fetchone()
-    c.execute('''
-        DELETE FROM cache WHERE hash = ?
-              ''', (one[0],))
-              
-    conn.commit()
-    conn.close()
-
-    file_path = one[1]
-    os.remove(file_path)
-    
-# update the file path in the cache database
-import sqlite3
 
-def update_file_path_in_cache(cache_db_path: str, hash: str, file_path: str):
+    def __init__(
+        self,
+        cache_db_path: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: int = None,
+        memory_size: int = DEFAULT_MEMORY_SIZE,
+    ):
+        self.cache_db_path = cache_db_path
+        self.memory = MemoryLRU(memory_size)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self._batch_depth = 0
+        self._pinned = set()
+        self._scopes = []
+        # The pin scope of the current run, inherited by the tasks it starts
+        self._scope = contextvars.ContextVar(f"cache_pins_{id(self)}", default=None)
+        self._touched = {}
+        # callbacks receiving the list of hashes removed by delete()
+        self.on_delete = []
+        self.conn = sqlite3.connect(cache_db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS cache (
+                hash TEXT PRIMARY KEY,
+                file_path TEXT,
+                file_size INTEGER,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS cache_updated_at ON cache (updated_at);
+        ''')
+        self._total_bytes = self.conn.execute(
+            'SELECT COALESCE(SUM(file_size), 0) FROM cache'
+        ).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups every write made inside the block into a single transaction.
+        """
+        with self.lock:
+            if self._batch_depth == 0:
+                self.conn.execute('BEGIN')
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self.conn.execute('ROLLBACK')
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.conn.execute('COMMIT')
+
+    def get(self, hash: str):
+        """
+        Retrieves the file path associated with the given hash and pins the entry.
+
+        Args:
+            hash (str): The hash value to search for in the cache.
+
+        Returns:
+            str: The file path associated with the given hash, or None if no matching hash is found.
+        """
+        with self.lock:
+            file_path = self.memory.get(hash)
+            tier = 'memory'
+            if file_path is None:
+                tier = 'db'
+                result = self.conn.execute(
+                    'SELECT file_path FROM cache WHERE hash = ?', (hash,)
+                ).fetchone()
+                if not result:
+                    metrics.inc('cache_lookups_total', result='miss', tier=tier)
+                    return None
+                file_path = result[0]
+                self.memory.put(hash, file_path)
+            metrics.inc('cache_lookups_total', result='hit', tier=tier)
+            self._pin(hash)
+            return file_path
+
+    def get_file_size(self, hash: str):
+        with self.lock:
+            result = self.conn.execute(
+                'SELECT file_size FROM cache WHERE hash = ?', (hash,)
+            ).fetchone()
+            return result[0] if result else None
+
+    def add(self, hash: str, file_path: str):
+        """
+        Adds (or replaces) an entry, pins it, and evicts older entries if the
+        cache is over budget.
+
+        Args:
+            hash (str): The hash value identifying the entry.
+            file_path (str): The path of the generated flashcard file.
+        """
+        file_size = os.path.getsize(file_path)
+        with self.lock, self.batch():
+            previous = self.get_file_size(hash) or 0
+            self.conn.execute('''
+                INSERT OR REPLACE INTO cache (hash, file_path, file_size) VALUES (?, ?, ?)
+            ''', (hash, file_path, file_size))
+            self._touched.pop(hash, None)
+            self._pin(hash)
+            self.memory.put(hash, file_path)
+            self._total_bytes += file_size - previous
+            if self._total_bytes > self.max_bytes:
+                self.evict()
+
+    def update(self, hash: str, file_path: str):
+        """
+        Updates the file path of an entry and marks it as recently used.
+
+        The write is deferred and applied with the next batch of writes (see `flush()`).
+
+        Args:
+            hash (str): The hash value to identify the record in the cache.
+            file_path (str): The new file path to be updated in the cache.
+        """
+        with self.lock:
+            self._touched[hash] = file_path
+            self._pin(hash)
+            self.memory.put(hash, file_path)
+
+    def flush(self):
+        """
+        Writes all deferred updates in a single transaction.
+        """
+        with self.lock:
+            if not self._touched:
+                return
+            touched, self._touched = self._touched, {}
+            with self.batch():
+                self.conn.executemany('''
+                    UPDATE cache SET file_path = ?, updated_at = CURRENT_TIMESTAMP WHERE hash = ?
+                ''', [(file_path, hash) for hash, file_path in touched.items()])
+
+    def entries(self):
+        """
+        Returns every entry as (hash, file_path, file_size, updated_at) tuples.
+        """
+        with self.lock:
+            self.flush()
+            return self.conn.execute(
+                'SELECT hash, file_path, file_size, updated_at FROM cache'
+            ).fetchall()
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _pin(self, hash: str):
+        scope = self._scope.get()
+        (self._pinned if scope is None else scope).add(hash)
+
+    def _is_pinned(self, hash: str) -> bool:
+        return hash in self._pinned or any(hash in scope for scope in self._scopes)
+
+    @contextmanager
+    def pins(self):
+        """
+        Pins the entries used inside the block, including by the tasks it
+        starts, in a scope of their own, and unpins them when the block exits.
+        """
+        scope = set()
+        with self.lock:
+            self._scopes.append(scope)
+        token = self._scope.set(scope)
+        try:
+            yield scope
+        finally:
+            self._scope.reset(token)
+            with self.lock:
+                self._scopes.remove(scope)
+
+    def release(self):
+        """
+        Unpins every entry used so far outside of `pins()`, e.g. once a run has
+        finished.
+        """
+        with self.lock:
+            self._pinned.clear()
+
+    def delete(self, rows):
+        """
+        Deletes the given (hash, file_path, file_size) rows and removes their
+        files unless another entry still refers to them.
+        """
+        with self.lock:
+            with self.batch():
+                self.conn.executemany(
+                    'DELETE FROM cache WHERE hash = ?', [(row[0],) for row in rows]
+                )
+                self._total_bytes -= sum(row[2] or 0 for row in rows)
+                for hash, *_ in rows:
+                    self._touched.pop(hash, None)
+                    self.memory.pop(hash)
+                for callback in self.on_delete:
+                    callback([row[0] for row in rows])
+            metrics.inc('cache_evictions_total', len(rows))
+            for file_path in {row[1] for row in rows}:
+                referenced = self.conn.execute(
+                    'SELECT 1 FROM cache WHERE file_path = ? LIMIT 1', (file_path,)
+                ).fetchone()
+                if not referenced and os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def _oldest(self, limit: int = -1):
+        return self.conn.execute('''
+            SELECT hash, file_path, file_size FROM cache ORDER BY updated_at, rowid LIMIT ?
+        ''', (limit,))
+
+    def evict(self) -> int:
+        """
+        Evicts unpinned entries older than `max_age`, then the least recently
+        used unpinned entries until the cache fits in `max_bytes`.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        with self.lock:
+            self.flush()
+            victims = []
+            if self.max_age is not None:
+                victims.extend(
+                    row for row in self.conn.execute('''
+                        SELECT hash, file_path, file_size FROM cache
+                        WHERE updated_at < datetime('now', ?)
+                    ''', (f'-{int(self.max_age)} seconds',))
+                    if not self._is_pinned(row[0])
+                )
+            excess = self._total_bytes - sum(row[2] or 0 for row in victims) - self.max_bytes
+            if excess > 0:
+                chosen = {row[0] for row in victims}
+                for row in self._oldest().fetchall():
+                    if excess <= 0:
+                        break
+                    if self._is_pinned(row[0]) or row[0] in chosen:
+                        continue
+                    victims.append(row)
+                    excess -= row[2] or 0
+            if victims:
+                self.delete(victims)
+            return len(victims)
+
+    def delete_oldest(self):
+        """
+        Deletes the least recently used entry, pinned or not.
+        """
+        with self.lock:
+            self.flush()
+            rows = self._oldest(1).fetchall()
+            if rows:
+                self.delete(rows)
+
+
+# The functions below are kept for callers of the previous module API. Each one
+# opens a short-lived store; long-running code should hold a CacheStore instead.
+
+def init_cache_db(cache_db_path: str):
     """
-    Updates the file path in the cache database for a given hash.
+    Initializes the cache database by creating a table if it doesn't exist.
 
     Args:
-        cache_db_path (str): The path to the cache database.
-        hash (str): The hash value to identify the record in the cache.
-        file_path (str): The new file path to be updated in the cache.
+        cache_db_path (str): The path to the cache database file.
 
     Returns:
         None
     """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE cache SET file_path = ?, updated_at = CURRENT_TIMESTAMP WHERE hash = ?
-    ''', (file_path, hash))
-    conn.commit()
-    conn.close()
-
-# Function to get the file path from the cache database
+    CacheStore(cache_db_path).close()
+
+
 def get_file_path_from_cache(cache_db_path: str, hash: str):
-    """
-    Retrieves the file path associated with the given hash from the cache database.
+    with CacheStore(cache_db_path) as store:
+        return store.get(hash)
 
-    Args:
-        cache_db_path (str): The path to the cache database.
-        hash (str): The hash value to search for in the cache.
 
-    Returns:
-        str: The file path associated with the given hash, or None if no matching hash is found.
-    """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT file_path FROM cache WHERE hash = ?
-    ''', (hash,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-# Function to get the file size from the cache database
-import sqlite3
+def add_file_path_to_cache(cache_db_path: str, hash: str, file_path: str):
+    with CacheStore(cache_db_path) as store:
+        store.add(hash, file_path)
 
-def get_file_size_from_cache(cache_db_path: str, hash: str):
-    """
-    Retrieves the file size from the cache database based on the given hash.
 
-    Args:
-        cache_db_path (str): The path to the cache database.
-        hash (str): The hash value used to retrieve the file size.
+def get_cache(cache_db_path: str):
+    with CacheStore(cache_db_path) as store:
+        return store.entries()
 
-    Returns:
-        int or None: The file size if found, None otherwise.
-    """
-    conn = sqlite3.connect(cache_db_path)
-    c = conn.cursor()
-    c.execute('''
-        SELECT file_size FROM cache WHERE hash = ?
-    ''', (hash,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
\ No newline at end of file
+
+def get_cache_size(cache_db_path: str) -> int:
+    with CacheStore(cache_db_path) as store:
+        return store.size()
+
+
+def delete_oldest_entry(cache_db_path: str):
+    with CacheStore(cache_db_path) as store:
+        store.delete_oldest()
+
+
+def update_file_path_in_cache(cache_db_path: str, hash: str, file_path: str):
+    with CacheStore(cache_db_path) as store:
+        store.update(hash, file_path)
+
+
+def get_file_size_from_cache(cache_db_path: str, hash: str):
+    with CacheStore(cache_db_path) as store:
+        return store.get_file_size(hash)
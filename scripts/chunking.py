@@ -0,0 +1,144 @@
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# Rough number of characters per token for English text with Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+# Context window sizes of common Ollama model families, in tokens
+MODEL_CONTEXT = {
+    "llama2": 4096,
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "mistral": 32768,
+    "mixtral": 32768,
+    "gemma": 8192,
+    "gemma2": 8192,
+    "phi3": 4096,
+    "qwen2": 32768,
+}
+# Ollama's default num_ctx, used for unknown models
+DEFAULT_CONTEXT = 2048
+# Tokens taken by the instructions appended to every chunk
+PROMPT_TOKENS = 200
+# Larger chunks yield fewer, vaguer flashcards per token of input
+MAX_CHUNK_TOKENS = 1500
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def token_budget_for(model: Optional[str] = None, num_ctx: Optional[int] = None) -> int:
+    """
+    Returns the number of input tokens per chunk for a model, leaving half of
+    the context window (after the prompt) for the generated flashcards.
+
+    Args:
+        model (str, optional): The model name, e.g. "llama3" or "llama3:8b".
+        num_ctx (int, optional): The context size passed to Ollama, if overridden.
+
+    Returns:
+        int: The token budget of a chunk.
+    """
+    context = num_ctx or MODEL_CONTEXT.get((model or "").split(":")[0], DEFAULT_CONTEXT)
+    return max(64, min(MAX_CHUNK_TOKENS, (context - PROMPT_TOKENS) // 2))
+
+
+def _split_words(text: str, budget: int) -> Iterator[str]:
+    limit = budget * CHARS_PER_TOKEN
+    start = 0
+    while len(text) - start > limit:
+        end = text.rfind(" ", start, start + limit)
+        if end <= start:
+            end = start + limit
+        yield text[start:end]
+        start = end + 1 if text[end : end + 1] == " " else end
+    if start < len(text):
+        yield text[start:]
+
+
+def split_units(
+    texts: Iterable[str], budget: int, clean: Callable[[str], str] = str.strip
+) -> Iterator[Tuple[str, str]]:
+    """
+    Splits page/slide/document texts into units no larger than the budget,
+    preferring paragraph, then sentence, then word boundaries.
+
+    Args:
+        texts (Iterable[str]): The extracted texts, one per page, slide or document.
+        budget (int): The maximum number of tokens of a unit.
+        clean (Callable[[str], str]): Normalizes the text of each paragraph.
+
+    Yields:
+        Tuple[str, str]: (separator, text) pairs, where the separator is the text
+            that joins the unit to the previous one in the same chunk.
+    """
+    for text in texts:
+        separator = "\n\n"
+        for paragraph in _PARAGRAPH.split(text):
+            paragraph = clean(paragraph)
+            if not paragraph:
+                continue
+            if estimate_tokens(paragraph) <= budget:
+                yield separator, paragraph
+                separator = "\n\n"
+                continue
+            for sentence in _SENTENCE.split(paragraph):
+                if estimate_tokens(sentence) <= budget:
+                    yield separator, sentence
+                else:
+                    for piece in _split_words(sentence, budget):
+                        yield separator, piece
+                        separator = " "
+                separator = " "
+            separator = "\n\n"
+
+
+def iter_chunks(
+    texts: Iterable[str],
+    budget: int,
+    overlap: int = 0,
+    clean: Callable[[str], str] = str.strip,
+) -> Iterator[str]:
+    """
+    Packs texts into chunks of at most `budget` estimated tokens in a single
+    pass, never cutting through a sentence unless the sentence alone exceeds
+    the budget.
+
+    Args:
+        texts (Iterable[str]): The extracted texts, one per page, slide or document.
+            Consumed lazily.
+        budget (int): The maximum number of tokens per chunk.
+        overlap (int): Number of tokens of trailing units repeated at the start of
+            the next chunk. Capped at half the budget, and reduced (down to no
+            overlap) where the next unit would not fit otherwise. Defaults to 0.
+        clean (Callable[[str], str]): Normalizes the text of each paragraph.
+
+    Yields:
+        str: The chunks, in document order.
+    """
+    overlap = min(overlap, budget // 2)
+    current: List[Tuple[str, str]] = []
+    current_tokens = 0
+    for separator, unit in split_units(texts, budget, clean):
+        tokens = estimate_tokens(unit) + 1
+        if current and current_tokens + tokens > budget:
+            yield "".join(sep + text for sep, text in current).lstrip()
+            carry: List[Tuple[str, str]] = []
+            carry_tokens = 0
+            # The carried units and the next one must fit in the budget together
+            carry_limit = min(overlap, budget - tokens)
+            for item in reversed(current):
+                item_tokens = estimate_tokens(item[1]) + 1
+                if carry_tokens + item_tokens > carry_limit:
+                    break
+                carry.append(item)
+                carry_tokens += item_tokens
+            carry.reverse()
+            current, current_tokens = carry, carry_tokens
+        current.append((separator, unit))
+        current_tokens += tokens
+    if current:
+        yield "".join(sep + text for sep, text in current).lstrip()
@@ -1,37 +1,113 @@
+import io
 import os
 import json
+import copy
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from pptx import Presentation
 from pptx.dml.color import RGBColor
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
 from pptx.util import Pt
 import random
 from tqdm import tqdm
+from scripts import metrics
+from scripts.assets import DEFAULT_PROFILE, optimize_assets
+from scripts.flashcards import card_fields, list_json_files, load_flashcards
+from scripts.text_fitting import fit_text
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 current_dir = os.getcwd()
 
 
-def add_flashcard(question, answer, output_slide, slide_layout, conf):
+@functools.lru_cache(maxsize=None)
+def load_image(img_path):
+    """
+    Reads an image referenced by the configuration, once per process.
+
+    Args:
+        img_path (str): The image path, relative to the project root.
+
+    Returns:
+        bytes: The image file contents.
+    """
+    with open(os.path.join(PROJECT_ROOT, img_path), "rb") as f:
+        return f.read()
+
+
+class SlideImages:
+    """
+    The image parts of one presentation.
+
+    Each image is added to the package once and every slide showing it only
+    gets a relationship to that shared part, so the per-slide cost of a
+    picture no longer includes re-reading, re-hashing and re-measuring the
+    image file, nor searching the package for an identical part.
+
+    With a configuration, the embedded images are the variants derived for
+    the quality profile by `assets.optimize_assets()`.
+    """
+
+    def __init__(self, presentation, conf=None, quality=DEFAULT_PROFILE):
+        self._package = presentation.part.package
+        self._parts = {}
+        self._paths = optimize_assets(conf, quality) if conf else {}
+        for img_path in self._paths.values():
+            load_image(img_path)
+
+    def image_part(self, img_path):
+        # Parts are created on first use: python-pptx names a new image part
+        # after the parts reachable from the slides, so it must be related to
+        # a slide before the next one is created.
+        image_part = self._parts.get(img_path)
+        if image_part is None:
+            image_part = self._package.get_or_add_image_part(
+                io.BytesIO(load_image(self._paths.get(img_path, img_path)))
+            )
+            self._parts[img_path] = image_part
+        return image_part
+
+    def add_picture(self, slide, image):
+        """
+        Adds a picture described by a configuration entry (img_path, left, top,
+        width and height) to a slide.
+        """
+        img_path = image["img_path"]
+        rId = slide.part.relate_to(self.image_part(img_path), RT.IMAGE)
+        _add_pic(slide, rId, os.path.basename(img_path), image)
+
+
+def _add_pic(slide, rId, description, image):
+    """
+    Adds a picture of an image part already related to the slide as `rId`.
+    """
+    # The public `shapes.add_picture()` takes an image file and re-reads,
+    # re-hashes and re-measures it for every slide, so the picture element is
+    # added with the shape tree API that `add_picture()` itself uses. These
+    # are private python-pptx APIs: check them when upgrading from the
+    # version pinned in requirements.txt.
+    shape_id = slide.shapes._next_shape_id
+    slide.shapes._spTree.add_pic(
+        shape_id,
+        "Picture %d" % (shape_id - 1),
+        description,
+        rId,
+        image["left"],
+        image["top"],
+        image["width"],
+        image["height"],
+    )
+
+
+def add_flashcard(question, answer, output_slide, slide_layout, conf, images=None):
+    images = images or SlideImages(output_slide)
     new_slide = output_slide.slides.add_slide(slide_layout)
     fill = new_slide.background.fill
     fill.solid()
     fill.fore_color.rgb = RGBColor(223, 223, 223)
 
-    flash_card = conf["flash_card"]
-
-    bg = random.choice(conf["bgs"])
-    bg_img_path = os.path.join(PROJECT_ROOT, bg["img_path"])
-    new_slide.shapes.add_picture(
-        bg_img_path, bg["left"], bg["top"], bg["width"], bg["height"]
-    )
-
-    flash_card_img_path = os.path.join(PROJECT_ROOT, flash_card["img_path"])
-    new_slide.shapes.add_picture(
-        flash_card_img_path,
-        flash_card["left"],
-        flash_card["top"],
-        flash_card["width"],
-        flash_card["height"],
-    )
+    images.add_picture(new_slide, random.choice(conf["bgs"]))
+    images.add_picture(new_slide, conf["flash_card"])
 
     for name, text_shape in conf["texts"].items():
         new_textbox = new_slide.shapes.add_textbox(
@@ -66,7 +142,8 @@ def add_flashcard(question, answer, output_slide, slide_layout, conf):
             if len(question) > 158:
                 new_paragraph.font.size = Pt(36)
 
-        new_text_frame.fit_text(
+        fit_text(
+            new_text_frame,
             font_family=text_shape["font"],
             max_size=text_shape["max_size"],
             font_file=os.path.join(PROJECT_ROOT, text_shape["font_file"]),
@@ -77,19 +154,12 @@ def add_flashcard(question, answer, output_slide, slide_layout, conf):
         new_text_frame.auto_size = text_shape["auto_size"]
 
 
-def add_header_slide(title, conf, slide_layout, output_slide):
+def add_header_slide(title, conf, slide_layout, output_slide, images=None):
+    images = images or SlideImages(output_slide)
     new_slide = output_slide.slides.add_slide(slide_layout)
 
     header = conf["header"]
-
-    header_img_path = os.path.join(PROJECT_ROOT, header["img_path"])
-    new_slide.shapes.add_picture(
-        header_img_path,
-        header["left"],
-        header["top"],
-        header["width"],
-        header["height"],
-    )
+    images.add_picture(new_slide, header)
 
     title_ = header["title"]
 
@@ -109,41 +179,57 @@ def add_header_slide(title, conf, slide_layout, output_slide):
     new_text_frame.word_wrap = True
 
 
-def add_footer_slide(conf, slide_layout, output_slide):
+def add_footer_slide(conf, slide_layout, output_slide, images=None):
+    images = images or SlideImages(output_slide)
     new_slide = output_slide.slides.add_slide(slide_layout)
 
-    footer = conf["footer"]
+    images.add_picture(new_slide, conf["footer"])
 
-    footer_img_path = os.path.join(PROJECT_ROOT, footer["img_path"])
-    new_slide.shapes.add_picture(
-        footer_img_path,
-        footer["left"],
-        footer["top"],
-        footer["width"],
-        footer["height"],
-    )
 
+def add_card(flashcard, output_pptx, slide_layout, conf, images=None):
+    fields = card_fields(flashcard)
+    if fields is None:
+        print(
+            "Each dictionary in the JSON file must contain 'question' and 'answer' keys."
+        )
+        return
+    question, answer = fields
+    add_flashcard(question, answer, output_pptx, slide_layout, conf, images)
+
+
+def load_conf():
+    conf_path = os.path.join(PROJECT_ROOT, "static/conf.json")
+    with open(conf_path, "r") as f:
+        return json.load(f)
 
-def create(output_path, output_pptx_name, json_path, title="Flashcards"):
+
+def create_from_flashcards(
+    output_path,
+    output_pptx_name,
+    flashcards,
+    title="Flashcards",
+    quality=DEFAULT_PROFILE,
+    progress=True,
+):
     """
-    Creates a PowerPoint presentation with flashcards based on the provided JSON data.
+    Creates a PowerPoint presentation from an iterable of flashcards.
+
+    The flashcards are consumed lazily, so they can be streamed straight from
+    the generation stage.
 
     Args:
         output_path (str): The path where the output presentation will be saved.
         output_pptx_name (str): The name of the output PowerPoint presentation file.
-        json_path (str or list): The path(s) to the JSON file(s) containing flashcard data.
-            If a single string is provided, it is treated as the path to a single JSON file.
-            If a list of strings is provided, each string is treated as the path to a JSON file.
-        conf_path (str, optional): The path to the configuration JSON file. Defaults to "static/conf.json".
+        flashcards (Iterable[dict]): The flashcards, in deck order.
         title (str, optional): The title of the presentation. Defaults to "Flashcards".
+        quality (str, optional): The image quality profile, one of `assets.PROFILES`.
+            Defaults to "original".
+        progress (bool, optional): Show a progress bar. Defaults to True.
 
     Returns:
-        None
+        str: The path of the saved presentation.
     """
-    conf_path = os.path.join(PROJECT_ROOT,"static/conf.json")
-
-    with open(conf_path, "r") as f:
-        conf = json.load(f)
+    conf = load_conf()
     output_pptx = Presentation()
     output_pptx.slide_height, output_pptx.slide_width = (
         conf["slide_height"],
@@ -151,54 +237,15 @@ def create(output_path, output_pptx_name, json_path, title="Flashcards"):
     )
     slide_layout = output_pptx.slide_layouts[5]  # Assuming layout index 5 is "Blank"
 
-    add_header_slide(title, conf, slide_layout, output_pptx)
+    images = SlideImages(output_pptx, conf, quality)
 
-    json_files = []
-    if not isinstance(json_path, list):
-        if os.path.isfile(json_path):
-            json_files.append(json_path)
-        elif os.path.isdir(json_path):
-            for file in os.listdir(json_path):
-                if file.endswith(".json"):
-                    json_files.append(os.path.join(json_path, file))
-    else:
-        json_files = json_path
-
-    for json_file in tqdm(json_files, desc="Processing JSON files"):
-        with open(json_file, "r") as f:
-            data = json.load(f)
-            flashcards = data["flashcards"]
-
-        for flashcard in flashcards:
-            if "question" in flashcard and "answer" in flashcard:
-                add_flashcard(
-                    flashcard["question"],
-                    flashcard["answer"],
-                    output_pptx,
-                    slide_layout,
-                    conf,
-                )
-            elif (
-                "question" in flashcard
-                and "options" in flashcard
-                and "correct_answer" in flashcard
-            ):
-                add_flashcard(
-                    flashcard["question"],
-                    {
-                        "options": flashcard["options"],
-                        "correct_answer": flashcard["correct_answer"],
-                    },
-                    output_pptx,
-                    slide_layout,
-                    conf,
-                )
-            else:
-                print(
-                    "Each dictionary in the JSON file must contain 'question' and 'answer' keys."
-                )
+    add_header_slide(title, conf, slide_layout, output_pptx, images)
 
-    add_footer_slide(conf, slide_layout, output_pptx)
+    for flashcard in tqdm(flashcards, desc="Adding flashcards", disable=not progress):
+        with metrics.timer("render_slide_seconds"):
+            add_card(flashcard, output_pptx, slide_layout, conf, images)
+
+    add_footer_slide(conf, slide_layout, output_pptx, images)
 
     if not output_path:
         output_path = "."
@@ -211,5 +258,221 @@ def create(output_path, output_pptx_name, json_path, title="Flashcards"):
     if os.path.exists(output_file_path):
         os.remove(output_file_path)
 
-    output_pptx.save(output_file_path)
+    with metrics.timer("render_save_seconds"):
+        output_pptx.save(output_file_path)
     print(f"Flashcards created: {output_file_path}")
+    return output_file_path
+
+
+def _render_shard(output_path, output_pptx_name, flashcards, title, quality):
+    return create_from_flashcards(
+        output_path, output_pptx_name, flashcards, title, quality, progress=False
+    )
+
+
+def _render_shard_in_worker(*args):
+    # Worker processes report their render metrics back to the parent
+    metrics.reset()
+    return _render_shard(*args), metrics.snapshot()
+
+
+def _worker_result(future):
+    path, snapshot = future.result()
+    metrics.merge(snapshot)
+    return path
+
+
+def _copy_slide(slide, output_pptx, slide_layout, image_parts):
+    """
+    Appends a copy of a slide, with its background, shapes and pictures, to
+    another presentation.
+
+    Args:
+        image_parts (dict): The image parts of the merged deck by partname of
+            the slide's presentation, filled in as new images are copied.
+    """
+    new_slide = output_pptx.slides.add_slide(slide_layout)
+    for shape in list(new_slide.shapes):
+        shape._element.getparent().remove(shape._element)
+
+    background = slide._element.cSld.bg
+    if background is not None:
+        new_slide._element.cSld.insert(0, copy.deepcopy(background))
+
+    # Image parts are deduplicated by hash, so every shard's copy of a
+    # background maps to a single part of the merged deck. Each part of a
+    # shard is only hashed the first time one of its slides shows it.
+    rIds = {}
+    for rId, rel in slide.part.rels.items():
+        if rel.reltype == RT.IMAGE:
+            partname = rel.target_part.partname
+            image_part = image_parts.get(partname)
+            if image_part is None:
+                image_part = output_pptx.part.package.get_or_add_image_part(
+                    io.BytesIO(rel.target_part.blob)
+                )
+                image_parts[partname] = image_part
+            rIds[rId] = new_slide.part.relate_to(image_part, RT.IMAGE)
+    embed = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+    for element in slide.shapes._spTree.iter_shape_elms():
+        element = copy.deepcopy(element)
+        for node in element.iter():
+            if node.get(embed) in rIds:
+                node.set(embed, rIds[node.get(embed)])
+        new_slide.shapes._spTree.append(element)
+
+
+def merge_presentations(pptx_paths, output_file_path):
+    """
+    Merges shard presentations into a single deck, keeping the header slide
+    of the first shard and the footer slide of the last one.
+
+    Args:
+        pptx_paths (List[str]): The shard presentations, in deck order.
+        output_file_path (str): The path of the merged presentation.
+
+    Returns:
+        str: The path of the merged presentation.
+    """
+    conf = load_conf()
+    output_pptx = Presentation()
+    output_pptx.slide_height, output_pptx.slide_width = (
+        conf["slide_height"],
+        conf["slide_width"],
+    )
+    slide_layout = output_pptx.slide_layouts[5]
+
+    for index, pptx_path in enumerate(tqdm(pptx_paths, desc="Merging shards")):
+        slides = list(Presentation(pptx_path).slides)
+        start = 0 if index == 0 else 1
+        stop = len(slides) if index == len(pptx_paths) - 1 else len(slides) - 1
+        image_parts = {}
+        for slide in slides[start:stop]:
+            _copy_slide(slide, output_pptx, slide_layout, image_parts)
+
+    output_pptx.save(output_file_path)
+    print(f"Flashcards merged: {output_file_path}")
+    return output_file_path
+
+
+def create_sharded(
+    output_path,
+    output_pptx_name,
+    flashcards,
+    title="Flashcards",
+    quality=DEFAULT_PROFILE,
+    shard_size=1000,
+    workers=1,
+    merge=False,
+):
+    """
+    Renders a flashcard stream as several presentations of at most
+    `shard_size` cards, in parallel processes.
+
+    Each shard is a complete deck with its own header and footer slides, named
+    `<name>_part<N>.pptx` and titled "<title> - Part N". Only `workers` + 1
+    shards are held in memory at a time, so peak memory is bounded by the shard
+    size rather than by the number of cards.
+
+    Args:
+        output_path (str): The path where the output presentations will be saved.
+        output_pptx_name (str): The name of the output PowerPoint presentation file.
+        flashcards (Iterable[dict]): The flashcards, in deck order.
+        title (str, optional): The title of the presentation. Defaults to "Flashcards".
+        quality (str, optional): The image quality profile, one of `assets.PROFILES`.
+        shard_size (int, optional): The number of flashcards per shard. Defaults to 1000.
+        workers (int, optional): The number of rendering processes. Defaults to 1.
+        merge (bool, optional): Merge the shards into a single presentation named
+            `output_pptx_name` and remove them. Defaults to False.
+
+    Returns:
+        List[str]: The paths of the saved presentations, in deck order.
+    """
+    # Derive the images once, before the workers would each do it
+    optimize_assets(load_conf(), quality)
+
+    stem, ext = os.path.splitext(output_pptx_name)
+    flashcards = iter(flashcards)
+    shards = iter(lambda: list(itertools.islice(flashcards, shard_size)), [])
+
+    def render_args(number, shard):
+        name = f"{stem}_part{number}{ext}"
+        shard_title = title if merge else f"{title} - Part {number}"
+        return output_path, name, shard, shard_title, quality
+
+    paths = []
+    progress = tqdm(desc="Rendering shards", unit="shard")
+    if workers <= 1:
+        for number, shard in enumerate(shards, start=1):
+            paths.append(_render_shard(*render_args(number, shard)))
+            progress.update()
+    else:
+        # random.seed gives each worker its own background sequence
+        with ProcessPoolExecutor(workers, initializer=random.seed) as executor:
+            pending = []
+            for number, shard in enumerate(shards, start=1):
+                pending.append(
+                    executor.submit(_render_shard_in_worker, *render_args(number, shard))
+                )
+                while len(pending) > workers:
+                    paths.append(_worker_result(pending.pop(0)))
+                    progress.update()
+            for future in pending:
+                paths.append(_worker_result(future))
+                progress.update()
+    progress.close()
+
+    if merge and paths:
+        merged = merge_presentations(paths, os.path.join(os.path.dirname(paths[0]), output_pptx_name))
+        for path in paths:
+            os.remove(path)
+        return [merged]
+    return paths
+
+
+def create(
+    output_path,
+    output_pptx_name,
+    json_path,
+    title="Flashcards",
+    quality=DEFAULT_PROFILE,
+    shard_size=None,
+    workers=1,
+    merge=False,
+):
+    """
+    Creates a PowerPoint presentation with flashcards based on the provided JSON data.
+
+    Args:
+        output_path (str): The path where the output presentation will be saved.
+        output_pptx_name (str): The name of the output PowerPoint presentation file.
+        json_path (str or list): The path(s) to the JSON file(s) containing flashcard data.
+            If a single string is provided, it is treated as the path to a single JSON file.
+            If a list of strings is provided, each string is treated as the path to a JSON file.
+        title (str, optional): The title of the presentation. Defaults to "Flashcards".
+        quality (str, optional): The image quality profile, one of `assets.PROFILES`.
+            Defaults to "original".
+        shard_size (int, optional): If set, render shards of this many flashcards in
+            parallel with `create_sharded()`.
+        workers (int, optional): The number of shard rendering processes. Defaults to 1.
+        merge (bool, optional): Merge the shards into a single presentation.
+
+    Returns:
+        None
+    """
+    json_files = list_json_files(json_path)
+    if shard_size:
+        create_sharded(
+            output_path,
+            output_pptx_name,
+            load_flashcards(json_files),
+            title,
+            quality,
+            shard_size,
+            workers,
+            merge,
+        )
+        return
+    create_from_flashcards(
+        output_path, output_pptx_name, load_flashcards(json_files), title, quality
+    )
@@ -0,0 +1,325 @@
+import csv
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import time
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from scripts.flashcards import card_fields
+
+# Export format name -> (file extension, exporter)
+EXPORTERS: Dict[str, Tuple[str, Callable]] = {}
+DEFAULT_FORMAT = "pptx"
+# Number of rows written per executemany() call
+BATCH_SIZE = 1000
+
+
+def exporter(name: str, extension: str):
+    """
+    Registers an exporter: a function taking the output file path, an iterable
+    of flashcards, the deck title and format-specific keyword options, and
+    returning the path of the written file.
+    """
+    def register(function):
+        EXPORTERS[name] = (extension, function)
+        return function
+    return register
+
+
+def output_file_name(name: str, export_format: str = DEFAULT_FORMAT) -> str:
+    return name + EXPORTERS[export_format][0]
+
+
+def export(export_format, output_file_path, flashcards, title="Flashcards", **options):
+    """
+    Writes flashcards in one of the registered formats.
+
+    Args:
+        export_format (str): The format name, one of EXPORTERS.
+        output_file_path (str): The path of the output file.
+        flashcards (Iterable[dict]): The flashcards, in deck order. Consumed lazily.
+        title (str, optional): The title of the deck. Defaults to "Flashcards".
+        **options: Format-specific options.
+
+    Returns:
+        The path(s) of the written file(s).
+    """
+    output_dir = os.path.dirname(output_file_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return EXPORTERS[export_format][1](output_file_path, flashcards, title, **options)
+
+
+def iter_fields(flashcards: Iterable[dict]) -> Iterator[Tuple[str, str]]:
+    for flashcard in flashcards:
+        fields = card_fields(flashcard)
+        if fields:
+            yield fields
+
+
+def _html(text: str) -> str:
+    return html.escape(text).replace("\n", "<br>")
+
+
+@exporter("pptx", ".pptx")
+def export_pptx(output_file_path, flashcards, title, shard_size=None, workers=1, merge=False, **options):
+    """
+    Renders a PowerPoint presentation, see `create_presentation`.
+    """
+    # Imported here so the other formats do not load python-pptx
+    from scripts.create_presentation import create_from_flashcards, create_sharded
+
+    output_path, output_pptx_name = os.path.split(output_file_path)
+    if shard_size:
+        return create_sharded(
+            output_path,
+            output_pptx_name,
+            flashcards,
+            title,
+            shard_size=shard_size,
+            workers=workers,
+            merge=merge,
+            **options,
+        )
+    return create_from_flashcards(output_path, output_pptx_name, flashcards, title, **options)
+
+
+def _export_delimited(output_file_path, flashcards, delimiter):
+    with open(output_file_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(["question", "answer"])
+        writer.writerows(iter_fields(flashcards))
+    print(f"Flashcards exported: {output_file_path}")
+    return output_file_path
+
+
+@exporter("csv", ".csv")
+def export_csv(output_file_path, flashcards, title):
+    """
+    Writes a CSV file with a header row and one (question, answer) row per card.
+    """
+    return _export_delimited(output_file_path, flashcards, ",")
+
+
+@exporter("tsv", ".tsv")
+def export_tsv(output_file_path, flashcards, title):
+    """
+    Writes a tab-separated file, which Anki and most spreadsheet and flashcard
+    apps can import directly.
+    """
+    return _export_delimited(output_file_path, flashcards, "\t")
+
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; background: #dfdfdf; margin: 0 auto; max-width: 48em; padding: 1em; }}
+h1 {{ text-align: center; }}
+details {{ background: #fff; border-radius: 8px; margin: 1em 0; padding: 1em 1.5em; box-shadow: 0 1px 3px #0003; }}
+summary {{ cursor: pointer; font-size: 1.2em; font-weight: bold; }}
+details > div {{ border-top: 1px solid #ddd; margin-top: 1em; padding-top: 1em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+HTML_CARD = "<details><summary>{question}</summary><div>{answer}</div></details>\n"
+HTML_TAIL = "</body>\n</html>\n"
+
+
+@exporter("html", ".html")
+def export_html(output_file_path, flashcards, title):
+    """
+    Writes a self-contained HTML page where clicking a question reveals its answer.
+    """
+    with open(output_file_path, "w", encoding="utf-8") as f:
+        f.write(HTML_HEAD.format(title=html.escape(title)))
+        for question, answer in iter_fields(flashcards):
+            f.write(HTML_CARD.format(question=_html(question), answer=_html(answer)))
+        f.write(HTML_TAIL)
+    print(f"Flashcards exported: {output_file_path}")
+    return output_file_path
+
+
+# Anki collection schema version 11, as read by every Anki release
+ANKI_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    time integer not null, ivl integer not null, ease integer not null,
+    factor integer not null, reps integer not null, lastIvl integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+ANKI_MODEL_ID = 1716595200000
+ANKI_CSS = (
+    ".card { font-family: sans-serif; font-size: 24px; text-align: center; "
+    "color: black; background-color: #dfdfdf; }"
+)
+
+
+def _anki_id(text: str) -> int:
+    # Stable, positive 53-bit ids
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:13], 16)
+
+
+def _anki_collection(title: str, deck_id: int, now: int) -> tuple:
+    model = {
+        "id": ANKI_MODEL_ID,
+        "name": "Flashcard Generator",
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [{
+            "name": "Card 1",
+            "ord": 0,
+            "qfmt": "{{Question}}",
+            "afmt": "{{FrontSide}}<hr id=answer>{{Answer}}",
+            "did": None,
+            "bqfmt": "",
+            "bafmt": "",
+        }],
+        "flds": [
+            {"name": name, "ord": ord, "sticky": False, "rtl": False,
+             "font": "Arial", "size": 20, "media": []}
+            for ord, name in enumerate(["Question", "Answer"])
+        ],
+        "css": ANKI_CSS,
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+        "\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "req": [[0, "any", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+
+    def deck(id, name):
+        return {
+            "id": id, "name": name, "conf": 1, "desc": "", "dyn": 0,
+            "collapsed": False, "extendNew": 10, "extendRev": 50,
+            "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0],
+            "timeToday": [0, 0], "mod": now, "usn": -1,
+        }
+
+    decks = {"1": deck(1, "Default"), str(deck_id): deck(deck_id, title)}
+    dconf = {"1": {
+        "id": 1, "name": "Default", "mod": 0, "usn": 0, "dyn": False,
+        "maxTaken": 60, "timer": 0, "autoplay": True, "replayq": True,
+        "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500,
+                "order": 1, "perDay": 20, "bury": True, "separate": True},
+        "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1,
+                "maxIvl": 36500, "minSpace": 1, "bury": True},
+        "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8,
+                  "leechAction": 0},
+    }}
+    conf = {
+        "activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200,
+        "timeLim": 0, "estTimes": True, "dueCounts": True, "curModel": None,
+        "nextPos": 1, "sortType": "noteFld", "sortBackwards": False, "addToCur": True,
+    }
+    return (
+        1, now, now * 1000, now * 1000, 11, 0, 0, 0, json.dumps(conf),
+        json.dumps({str(ANKI_MODEL_ID): model}), json.dumps(decks),
+        json.dumps(dconf), "{}",
+    )
+
+
+@exporter("apkg", ".apkg")
+def export_apkg(output_file_path, flashcards, title):
+    """
+    Writes an Anki deck package: a zipped collection database holding one
+    note of a Question/Answer note type per flashcard, in a deck named after
+    the title. Notes are written in batches, so memory use does not depend
+    on the number of cards.
+    """
+    now = int(time.time())
+    deck_id = _anki_id("deck\x1f" + title)
+    db_path = output_file_path + ".anki2.tmp"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    # A scratch file until it is zipped: no need for crash safety
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(ANKI_SCHEMA)
+    conn.execute(
+        "INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        _anki_collection(title, deck_id, now),
+    )
+    notes, cards = [], []
+
+    def flush():
+        conn.executemany(
+            "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes
+        )
+        conn.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            cards,
+        )
+        notes.clear()
+        cards.clear()
+
+    for position, (question, answer) in enumerate(iter_fields(flashcards), start=1):
+        fields = _html(question) + "\x1f" + _html(answer)
+        # Anki matches imported notes by guid, so re-importing an updated deck
+        # updates its notes instead of duplicating them
+        guid = format(_anki_id(f"{deck_id}\x1f{fields}"), "x")
+        note_id = now * 1000 + position
+        checksum = int(hashlib.sha1(question.encode("utf-8")).hexdigest()[:8], 16)
+        notes.append((
+            note_id, guid, ANKI_MODEL_ID, now, -1, "", fields,
+            question, checksum, 0, "",
+        ))
+        cards.append((
+            note_id, note_id, deck_id, 0, now, -1, 0, 0, position, 0, 0, 0, 0, 0,
+            0, 0, 0, "",
+        ))
+        if len(notes) >= BATCH_SIZE:
+            flush()
+    flush()
+    conn.commit()
+    conn.close()
+
+    with zipfile.ZipFile(output_file_path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.write(db_path, "collection.anki2")
+        package.writestr("media", "{}")
+    os.remove(db_path)
+    print(f"Flashcards exported: {output_file_path}")
+    return output_file_path
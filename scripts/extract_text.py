@@ -1,64 +1,389 @@
 #!/usr/bin/env python3
+import collections
+import contextlib
+import itertools
+import mmap
 import os
 import re
-from typing import List
-from pptx import Presentation
-from pypdf import PdfReader
-import docx2txt
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from scripts import chunking
+from scripts.manifest import Manifest
+from scripts.normalize import iter_without_repeated_lines, normalize_text
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
+SUPPORTED_EXTENSIONS = (".pptx", ".pdf", ".txt", ".docx")
+# Documents whose pages may repeat running headers and footers
+PAGED_EXTENSIONS = (".pptx", ".pdf")
+# PDFs with more pages than this are split into page ranges across workers
+PDF_PAGES_PER_TASK = 50
+# Text files larger than this are memory-mapped and read in blocks of about this size
+TXT_BLOCK_SIZE = 1 << 20
+# Blocks of a large text file read by each worker task
+TXT_BLOCKS_PER_TASK = 8
 
-# Function to clean up extracted text
+# Function to clean up extracted text, see `normalize.normalize_text()`
 def clean_text(text: str) -> str:
-    text = re.sub(r"\s+", " ", text)
-    text = "".join([char if ord(char) < 128 else " " for char in text])
-    return text.strip()
-
-# Function to process and split text into chunks
-def process_text(extracted_text: List[str], character_limit: int) -> List[str]:
-    cleaned_text_chunks: List[str] = []
-    for text in extracted_text:
-        cleaned_text = clean_text(text)
-        chunks = [
-            cleaned_text[i : i + character_limit]
-            for i in range(0, len(cleaned_text), character_limit)
-        ]
-        cleaned_text_chunks.extend(chunks)
-    return cleaned_text_chunks
+    return normalize_text(text)
 
-# Extraction functions for different file types
+# Extraction functions for different file types. Each one imports its parser
+# library itself, so only the libraries of the file types at hand are loaded.
 def extract_text_from_txt(txt_file_path: str) -> str:
     with open(txt_file_path, "r", encoding="utf-8") as file:
         return file.read()
 
 def extract_text_from_docx(docx_file_path: str) -> str:
+    import docx2txt
+
     return docx2txt.process(docx_file_path)
 
+def _release_pages(mapped: mmap.mmap, start: int, stop: int):
+    # The pages of a decoded block are dropped from the process; they stay in
+    # the page cache, so RSS does not grow with the size of the file
+    if hasattr(mmap, "MADV_DONTNEED"):
+        start -= start % mmap.PAGESIZE
+        mapped.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+def _iter_blocks(mapped: mmap.mmap, start: int, end: int, block_size: int) -> Iterator[Tuple[int, int]]:
+    # Cuts a byte range into blocks at paragraph, or else line, boundaries.
+    # The cuts only depend on where the range starts, so a range that starts
+    # and ends at cuts is cut exactly as it is when the whole file is read.
+    while start < end:
+        stop = min(start + block_size, end)
+        if stop < end:
+            cut = mapped.rfind(b"\n\n", start, stop)
+            if cut <= start:
+                cut = mapped.rfind(b"\n", start, stop)
+            if cut > start:
+                stop = cut
+            else:
+                # Never cut through a UTF-8 sequence
+                while stop > start + 1 and mapped[stop] & 0xC0 == 0x80:
+                    stop -= 1
+        yield start, stop
+        start = stop
+
+def iter_text_from_txt(
+    txt_file_path: str,
+    block_size: int = TXT_BLOCK_SIZE,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Yields the text of a text file in blocks of about `block_size` bytes, cut
+    at paragraph, or else line, boundaries. Larger files are memory-mapped, so
+    the memory used does not depend on the size of the file. `start` and
+    `stop` restrict the reading to a byte range, which must start and end at
+    block boundaries.
+    """
+    size = os.path.getsize(txt_file_path)
+    if size <= block_size:
+        yield extract_text_from_txt(txt_file_path)
+        return
+    with open(txt_file_path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        for block_start, block_stop in _iter_blocks(
+            mapped, start, size if stop is None else stop, block_size
+        ):
+            yield mapped[block_start:block_stop].decode("utf-8").replace("\r\n", "\n")
+            _release_pages(mapped, block_start, block_stop)
+
+def iter_text_from_pdf(pdf_file_path: str) -> Iterator[str]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_file_path)
+    for page in reader.pages:
+        yield page.extract_text()
+
 def extract_text_from_pdf(pdf_file_path: str) -> List[str]:
+    return list(iter_text_from_pdf(pdf_file_path))
+
+def extract_text_from_pdf_pages(pdf_file_path: str, start: int, stop: int) -> List[str]:
+    from pypdf import PdfReader
+
     reader = PdfReader(pdf_file_path)
-    return [page.extract_text() for page in reader.pages]
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+def iter_text_from_pptx(pptx_file_path: str) -> Iterator[str]:
+    from pptx import Presentation
 
-def extract_text_from_pptx(pptx_file_path: str) -> List[str]:
     presentation = Presentation(pptx_file_path)
-    extracted_text = []
     for slide in presentation.slides:
         slide_text = ""
         for shape in slide.shapes:
             if shape.has_text_frame:
                 slide_text += shape.text.strip() + "\n"
-        extracted_text.append(slide_text)
-    return extracted_text
+        yield slide_text
+
+def extract_text_from_pptx(pptx_file_path: str) -> List[str]:
+    return list(iter_text_from_pptx(pptx_file_path))
+
+def iter_text_from_file(file_path: str) -> Iterator[str]:
+    """
+    Yields the texts of a document one page, slide or block at a time.
+    """
+    if file_path.endswith(".pptx"):
+        yield from iter_text_from_pptx(file_path)
+    elif file_path.endswith(".pdf"):
+        yield from iter_text_from_pdf(file_path)
+    elif file_path.endswith(".txt"):
+        yield from iter_text_from_txt(file_path)
+    elif file_path.endswith(".docx"):
+        yield extract_text_from_docx(file_path)
+
+def extract_text_from_file(file_path: str) -> List[str]:
+    return list(iter_text_from_file(file_path))
+
+
+def list_input_files(input_path: str) -> List[str]:
+    """
+    Lists the supported files at the input path in a deterministic order.
+
+    Args:
+        input_path (str): The path to the input file or directory.
+
+    Raises:
+        ValueError: If the input path is invalid.
+
+    Returns:
+        List[str]: The supported file paths, sorted by name.
+    """
+    if os.path.isfile(input_path):
+        return [input_path] if input_path.endswith(SUPPORTED_EXTENSIONS) else []
+    elif os.path.isdir(input_path):
+        return [
+            os.path.join(input_path, file)
+            for file in sorted(os.listdir(input_path))
+            if file.endswith(SUPPORTED_EXTENSIONS)
+        ]
+    raise ValueError("Invalid input path.")
+
+
+def _run_extraction_task(task: Tuple[str, int, int]) -> List[str]:
+    file_path, start, stop = task
+    if start < 0:
+        return extract_text_from_file(file_path)
+    if file_path.endswith(".pdf"):
+        return extract_text_from_pdf_pages(file_path, start, stop)
+    return list(iter_text_from_txt(file_path, start=start, stop=stop))
+
+
+def _count_pdf_pages(pdf_file_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(pdf_file_path).pages)
+
+
+def _iter_txt_ranges(txt_file_path: str) -> Iterator[Tuple[int, int]]:
+    with open(txt_file_path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        blocks = _iter_blocks(mapped, 0, len(mapped), TXT_BLOCK_SIZE)
+        while True:
+            batch = list(itertools.islice(blocks, TXT_BLOCKS_PER_TASK))
+            if not batch:
+                return
+            yield batch[0][0], batch[-1][1]
+
+
+def _iter_extraction_tasks(
+    file_paths: List[str], executor: ProcessPoolExecutor
+) -> Iterator[Tuple[int, Tuple[str, int, int]]]:
+    # PDFs are split into page ranges and large text files into byte ranges,
+    # so that each task returns a batch of pages rather than a whole document.
+    # Pages are counted by the workers, the parent never opens a PDF.
+    page_counts = {
+        file_path: executor.submit(_count_pdf_pages, file_path)
+        for file_path in file_paths
+        if file_path.endswith(".pdf")
+    }
+    for index, file_path in enumerate(file_paths):
+        if file_path in page_counts:
+            page_count = page_counts.pop(file_path).result()
+            for start in range(0, page_count, PDF_PAGES_PER_TASK):
+                stop = min(start + PDF_PAGES_PER_TASK, page_count)
+                yield index, (file_path, start, stop)
+            if not page_count:
+                yield index, (file_path, 0, 0)
+        elif file_path.endswith(".txt") and os.path.getsize(file_path) > TXT_BLOCK_SIZE:
+            for start, stop in _iter_txt_ranges(file_path):
+                yield index, (file_path, start, stop)
+        else:
+            yield index, (file_path, -1, -1)
+
+
+def _iter_task_results(file_paths: List[str], workers: int) -> Iterator[Tuple[int, List[str]]]:
+    # Keeps at most two tasks per worker in flight, so finished results do not
+    # pile up ahead of the consumer
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for index, task in _iter_extraction_tasks(file_paths, executor):
+            pending.append((index, executor.submit(_run_extraction_task, task)))
+            if len(pending) >= 2 * workers:
+                index, future = pending.popleft()
+                yield index, future.result()
+        while pending:
+            index, future = pending.popleft()
+            yield index, future.result()
+
+
+def iter_extracted_files(file_paths: List[str], workers: int = 1) -> Iterator[Iterator[str]]:
+    """
+    Extracts the text of every file, optionally across a process pool.
+
+    With more than one worker, PDFs are split into page ranges and large text
+    files into byte ranges, and the other files are separate tasks. Only a
+    few tasks are in flight at a time, and their results are reassembled in
+    file and page order, so the output is identical to a serial run.
+
+    Args:
+        file_paths (List[str]): The files to extract text from.
+        workers (int): The number of worker processes. Defaults to 1.
+
+    Yields:
+        Iterator[str]: The page/slide/block texts of each file, in input order.
+            Each iterator must be consumed before the next one is requested.
+    """
+    if workers <= 1 or not file_paths:
+        for file_path in file_paths:
+            yield iter_text_from_file(file_path)
+        return
+
+    results = _iter_task_results(file_paths, workers)
+    for _, group in itertools.groupby(results, key=lambda result: result[0]):
+        yield itertools.chain.from_iterable(texts for _, texts in group)
+
+
+def extract_files(file_paths: List[str], workers: int = 1) -> List[List[str]]:
+    """
+    Extracts the text of every file, see `iter_extracted_files()`.
+
+    Returns:
+        List[List[str]]: The page/slide texts of each file, in input order.
+    """
+    return [list(texts) for texts in iter_extracted_files(file_paths, workers)]
+
+
+def iter_input_texts(
+    input_path: str,
+    workers: int = 1,
+    incremental: bool = True,
+    manifest_path: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Yields the texts of the documents at the input path, one page, slide or
+    block at a time, without the running headers and footers of their pages.
+
+    Changed documents are extracted as the texts are consumed and recorded in
+    the manifest on the way; unchanged ones are read back from the manifest.
+    Only a few pages are held in memory at a time, whatever the size of the
+    documents.
+
+    Args:
+        input_path (str): The path to the input file or directory.
+        workers (int): The number of processes used to extract text in parallel. Defaults to 1.
+        incremental (bool): If True, documents that are unchanged since a previous run are
+            served from the manifest instead of being parsed again. Defaults to True.
+        manifest_path (str, optional): The extraction manifest. Defaults to `manifest.db`.
+
+    Raises:
+        ValueError: If the input path is invalid.
+
+    Yields:
+        str: The texts, in document order.
+    """
+    file_paths = list_input_files(input_path)
+    manifest_path = manifest_path or os.path.join(PROJECT_ROOT, "manifest.db")
+    with Manifest(manifest_path) as manifest:
+        content_hashes = [
+            manifest.lookup(file_path) if incremental else None
+            for file_path in file_paths
+        ]
+        changed = [
+            file_path
+            for file_path, content_hash in zip(file_paths, content_hashes)
+            if content_hash is None
+        ]
+        print(
+            f"Extracting {len(changed)} changed documents, "
+            f"reusing {len(file_paths) - len(changed)} unchanged documents."
+        )
+
+        with contextlib.closing(iter_extracted_files(changed, workers)) as extracted:
+            for file_path, content_hash in zip(file_paths, content_hashes):
+                if content_hash is None:
+                    texts = manifest.stream(file_path, next(extracted))
+                else:
+                    texts = manifest.iter_texts(content_hash)
+                if file_path.endswith(PAGED_EXTENSIONS):
+                    texts = iter_without_repeated_lines(texts)
+                yield from texts
+        manifest.prune(file_paths)
+
+
+def iter_input_chunks(
+    input_path: str,
+    token_budget: int,
+    overlap_tokens: int = 0,
+    workers: int = 1,
+    incremental: bool = True,
+    manifest_path: Optional[str] = None,
+):
+    """
+    Extracts the documents at the input path and yields their text in chunks,
+    see `iter_input_texts()`.
+
+    Args:
+        input_path (str): The path to the input file or directory.
+        token_budget (int): The estimated number of tokens in each chunk,
+            see `chunking.token_budget_for()`.
+        overlap_tokens (int): The number of tokens repeated between consecutive chunks.
+            Defaults to 0.
+        workers (int): The number of processes used to extract text in parallel. Defaults to 1.
+        incremental (bool): If True, documents that are unchanged since a previous run are
+            served from the manifest instead of being parsed again. Defaults to True.
+        manifest_path (str, optional): The extraction manifest. Defaults to `manifest.db`.
+
+    Raises:
+        ValueError: If the input path is invalid.
+
+    Yields:
+        str: The chunks, in document order.
+    """
+    yield from chunking.iter_chunks(
+        iter_input_texts(input_path, workers, incremental, manifest_path),
+        token_budget,
+        overlap_tokens,
+        clean=clean_text,
+    )
 
 
 # Main function to process files and save the output
-def extract(input_path: str,  character_limit: int= 5000):
+def extract(
+    input_path: str,
+    character_limit: int = 5000,
+    workers: int = 1,
+    incremental: bool = True,
+    token_budget: Optional[int] = None,
+    overlap_tokens: int = 0,
+):
     """
     Extracts text from files in the specified input path and saves the extracted text
-    into multiple output files based on the character limit.
+    into multiple output files, split at paragraph and sentence boundaries.
+
+    Output files left over from a previous run that produced more chunks are removed.
 
     Args:
         input_path (str): The path to the input file or directory.
-        output_path (str): The path to the output directory where the extracted text files will be saved.
-        character_limit (int): The maximum number of characters allowed in each output file.
+        character_limit (int): The approximate maximum number of characters in each output
+            file, used when no token budget is given.
+        workers (int): The number of processes used to extract text in parallel. Defaults to 1.
+        incremental (bool): If True, documents that are unchanged since a previous run are
+            served from the manifest instead of being parsed again. Defaults to True.
+        token_budget (int, optional): The estimated number of tokens in each output file,
+            see `chunking.token_budget_for()`. Defaults to None.
+        overlap_tokens (int): The number of tokens repeated between consecutive output
+            files. Defaults to 0.
 
     Raises:
         ValueError: If the input path is invalid.
@@ -70,55 +395,26 @@ def extract(input_path: str,  character_limit: int= 5000):
 
     if not os.path.exists(output_path):
         os.makedirs(output_path)
-    
-    extracted_data = []
-    if os.path.isfile(input_path):
-        if input_path.endswith(".pptx"):
-            extracted_data.extend(extract_text_from_pptx(input_path))
-        elif input_path.endswith(".pdf"):
-            extracted_data.extend(extract_text_from_pdf(input_path))
-        elif input_path.endswith(".txt"):
-            extracted_data.append(extract_text_from_txt(input_path))
-        elif input_path.endswith(".docx"):
-            extracted_data.append(extract_text_from_docx(input_path))
-    elif os.path.isdir(input_path):
-        for file in os.listdir(input_path):
-            file_path = os.path.join(input_path, file)
-            if file.endswith(".pptx"):
-                extracted_data.extend(extract_text_from_pptx(file_path))
-            elif file.endswith(".pdf"):
-                extracted_data.extend(extract_text_from_pdf(file_path))
-            elif file.endswith(".txt"):
-                extracted_data.append(extract_text_from_txt(file_path))
-            elif file.endswith(".docx"):
-                extracted_data.append(extract_text_from_docx(file_path))
-    else:
-        raise ValueError("Invalid input path.")
-    
-    cleaned_text_chunks = process_text(extracted_data, character_limit)
-
-    buffer = ""
-    file_count = 0
-    for chunk in cleaned_text_chunks:
-        if len(buffer + chunk) > character_limit:
-            with open(
-                os.path.join(output_path, f"output_{file_count}.txt"),
-                "w",
-                encoding="utf-8",
-            ) as output_file:
-                output_file.write(buffer)
-            buffer = ""
-            file_count += 1
-        buffer += chunk
-    
-    if buffer:
+
+    if token_budget is None:
+        token_budget = character_limit // chunking.CHARS_PER_TOKEN
+
+    chunks = iter_input_chunks(
+        input_path, token_budget, overlap_tokens, workers, incremental
+    )
+    written = set()
+    for file_count, chunk in enumerate(chunks):
+        file_name = f"output_{file_count}.txt"
         with open(
-            os.path.join(output_path, f"output_{file_count}.txt"),
+            os.path.join(output_path, file_name),
             "w",
             encoding="utf-8",
         ) as output_file:
-            output_file.write(buffer)
-
-    print(f"Output files saved to {output_path}.")
+            output_file.write(chunk)
+        written.add(file_name)
 
+    for file_name in os.listdir(output_path):
+        if re.fullmatch(r"output_\d+\.txt", file_name) and file_name not in written:
+            os.remove(os.path.join(output_path, file_name))
 
+    print(f"Output files saved to {output_path}.")
@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+def is_flashcard(data) -> bool:
+    return (
+        isinstance(data, dict)
+        and "question" in data
+        and ("answer" in data or "correct_answer" in data)
+    )
+
+
+def find_flashcards(data) -> List[dict]:
+    """
+    Collects the flashcard objects nested anywhere in a decoded JSON document.
+    """
+    if is_flashcard(data):
+        return [data]
+    if isinstance(data, dict):
+        items = data.values()
+    elif isinstance(data, list):
+        items = data
+    else:
+        return []
+    found = []
+    for item in items:
+        found.extend(find_flashcards(item))
+    return found
+
+
+def flashcards_from_data(data) -> List[dict]:
+    """
+    Returns the flashcards of a generated JSON document: its "flashcards" list
+    if present, otherwise every flashcard object found in it.
+    """
+    if isinstance(data, dict) and isinstance(data.get("flashcards"), list):
+        return data["flashcards"]
+    return find_flashcards(data)
+
+
+def _text(value) -> str:
+    if isinstance(value, list):
+        return "\n".join(_text(item) for item in value)
+    if isinstance(value, dict):
+        return "\n".join(f"{key}) {_text(item)}" for key, item in value.items())
+    return str(value)
+
+
+def card_fields(flashcard: dict) -> Optional[Tuple[str, str]]:
+    """
+    Returns the question and answer of a flashcard as plain text. The options
+    of multiple-choice cards are listed before the correct answer.
+
+    Args:
+        flashcard (dict): A flashcard.
+
+    Returns:
+        tuple or None: (question, answer), or None if it is not a flashcard.
+    """
+    if not is_flashcard(flashcard):
+        return None
+    if "answer" in flashcard:
+        answer = _text(flashcard["answer"])
+    else:
+        answer = f"Answer: {_text(flashcard['correct_answer'])}"
+        if flashcard.get("options"):
+            answer = f"{_text(flashcard['options'])}\n\n{answer}"
+    return _text(flashcard["question"]), answer
+
+
+def list_json_files(json_path) -> List[str]:
+    """
+    Resolves a JSON file, a directory of JSON files or a list of JSON files.
+
+    Args:
+        json_path (str or list): The path(s) to the JSON file(s) containing flashcard data.
+
+    Returns:
+        List[str]: The JSON file paths.
+    """
+    if isinstance(json_path, list):
+        return json_path
+    if os.path.isfile(json_path):
+        return [json_path]
+    if os.path.isdir(json_path):
+        return [
+            os.path.join(json_path, file)
+            for file in os.listdir(json_path)
+            if file.endswith(".json")
+        ]
+    return []
+
+
+def load_flashcards(json_files: Iterable[str]) -> Iterator[dict]:
+    """
+    Streams the flashcards of generated JSON files, one file in memory at a time.
+
+    Args:
+        json_files (Iterable[str]): The JSON files, in deck order.
+
+    Yields:
+        dict: The flashcards, in deck order.
+    """
+    for json_file in json_files:
+        with open(json_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        yield from flashcards_from_data(data)
@@ -1,16 +1,29 @@
 import os
+import re
 import json
-from tqdm import tqdm
-import requests
-from scripts import caching
+import time
+import shutil
+import asyncio
+import collections
+import contextlib
+import httpx
+from scripts import caching, metrics, similarity, streams
+from scripts.ollama_client import (
+    CONNECT_TIMEOUT,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    RETRYABLE_STATUS,
+    OllamaClient,
+    backoff_delay,
+)
+from scripts.flashcards import flashcards_from_data, is_flashcard, load_flashcards
 
 # Define the base directory for API URL and other paths
-API_URL = "http://127.0.0.1:11434/api/generate"
+API_URL = os.environ.get("OLLAMA_API_URL", "http://127.0.0.1:11434/api/generate")
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 
 
-def get_prompt(data):
-    default_prompt = """Instructions:
+DEFAULT_PROMPT = """Instructions:
 1. Review the text carefully.
 2. Identify key concepts, important definitions, and significant facts.
 3. For each key point, generate a question that prompts recall or understanding.
@@ -19,7 +32,12 @@ def get_prompt(data):
 6. Format the flashcards into JSON, with each flashcard containing a question and its corresponding answer.
 7. Ensure that the JSON structure follows the format: [{"question": "Question text", "answer": "Answer text"}, ...]
 8. Aim for clarity and simplicity in both questions and answers."""
-    return f"{data}\n{default_prompt}"
+# Part of every cache key, so editing the prompt never serves stale flashcards
+PROMPT_VERSION = caching.generate_sha256(DEFAULT_PROMPT)[:16]
+
+
+def get_prompt(data):
+    return f"{data}\n{DEFAULT_PROMPT}"
 
 
 def extract_list(data):
@@ -35,40 +53,598 @@ def extract_list(data):
     return extracted
 
 
-def post(url, data):
-    try:
-        response = requests.post(url, json=data)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error during API request: {e}")
-        return None
+def post(url, data, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """
+    Legacy synchronous API: posts a JSON payload with retries. The pipeline
+    sends its requests through `ollama_client.OllamaClient`.
 
+    Returns:
+        dict: The decoded JSON response, or None if the request failed.
+    """
+    # The synchronous client is only loaded by the callers of this legacy API
+    import requests
 
-def get_flashcards_data(data, model="llama3"):
-    response = post(
-        API_URL,
-        {
-            "model": model,
-            "prompt": get_prompt(data),
-            "stream": False,
-            "format": "json",
-        },
+    for attempt in range(retries + 1):
+        try:
+            response = requests.post(url, json=data, timeout=(CONNECT_TIMEOUT, timeout))
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            if e.response is not None:
+                retryable = e.response.status_code in RETRYABLE_STATUS
+            else:
+                retryable = isinstance(e, (requests.ConnectionError, requests.Timeout))
+            if not retryable or attempt == retries:
+                print(f"Error during API request: {e}")
+                return None
+            time.sleep(backoff_delay(attempt))
+
+
+def get_payload(data, model="llama3", stream=False, options=None):
+    payload = {
+        "model": model,
+        "prompt": get_prompt(data),
+        "stream": stream,
+        "format": "json",
+    }
+    if options:
+        payload["options"] = options
+    return payload
+
+
+def get_cache_key(data, model="llama3", options=None):
+    """
+    Cache key of a chunk's flashcards: covers the chunk text, the model, the
+    prompt template and the generation options, so outputs of different
+    models or prompts can be cached side by side.
+    """
+    return caching.cache_key(
+        data,
+        model=model,
+        prompt=PROMPT_VERSION,
+        format="json",
+        options=options or {},
     )
+
+
+class FlashcardStreamParser:
+    """
+    Incrementally extracts flashcard objects from a JSON document that arrives
+    in arbitrary pieces, e.g. the tokens of a streamed model response.
+
+    Every `{...}` object is decoded as soon as its closing brace arrives, so
+    flashcards become available long before the surrounding document is
+    complete, and the ones already parsed survive a truncated response.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._starts = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text):
+        """
+        Consume the next piece of the document.
+
+        Args:
+            text (str): The next piece of the JSON document.
+
+        Returns:
+            list: The flashcards completed by this piece, in document order.
+        """
+        self._text += text
+        cards = []
+        for i in range(self._pos, len(self._text)):
+            char = self._text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(i)
+            elif char == "}" and self._starts:
+                start = self._starts.pop()
+                try:
+                    obj = json.loads(self._text[start : i + 1])
+                except ValueError:
+                    continue
+                if is_flashcard(obj):
+                    cards.append(obj)
+        self._pos = len(self._text)
+        return cards
+
+
+def generation_stats(message):
+    """
+    Extracts the token counts and timings (in seconds) that Ollama reports in
+    the final message of a /api/generate response.
+
+    Args:
+        message (dict): The response, or the last message of a streamed response.
+
+    Returns:
+        dict: prompt_tokens, eval_tokens, load_seconds, prompt_eval_seconds,
+            eval_seconds and request_seconds.
+    """
+    stats = {
+        "prompt_tokens": message.get("prompt_eval_count", 0),
+        "eval_tokens": message.get("eval_count", 0),
+    }
+    for field, duration in (
+        ("load", "load_duration"),
+        ("prompt_eval", "prompt_eval_duration"),
+        ("eval", "eval_duration"),
+        ("request", "total_duration"),
+    ):
+        stats[f"{field}_seconds"] = message.get(duration, 0) / 1e9
+    return stats
+
+
+def get_flashcards_data(data, model="llama3", options=None):
+    """
+    Legacy synchronous API, see `aget_flashcards_data()` for the one used by
+    the pipeline.
+
+    Returns:
+        str: The model's response text, or None if the request failed.
+    """
+    response = post(API_URL, get_payload(data, model, options=options))
+    if response and "response" in response:
+        return response["response"]
+    else:
+        print("Invalid response from API.")
+        return None
+
+
+async def aget_flashcards_data(client, data, model="llama3", options=None, stats=None):
+    try:
+        response = await client.generate(get_payload(data, model, options=options))
+    except httpx.HTTPError as e:
+        print(f"Error during API request: {str(e) or type(e).__name__}")
+        response = None
+    except ValueError as e:
+        print(f"Invalid JSON from API: {e}")
+        metrics.inc("decode_errors_total", part="response")
+        response = None
     if response and "response" in response:
+        if stats is not None:
+            stats.update(generation_stats(response))
         return response["response"]
     else:
         print("Invalid response from API.")
         return None
 
 
-def generate(debug=False, model=None):
+def stream_flashcards_data(data, model="llama3", options=None):
+    """
+    Stream a flashcard generation request and yield each flashcard as soon as
+    the model has finished writing it.
+
+    Legacy synchronous API, see `astream_flashcards_data()` for the one used by
+    the pipeline.
+
+    Args:
+        data (str): The text to generate flashcards from.
+        model (str, optional): The model to use. Defaults to "llama3".
+        options (dict, optional): Ollama generation options. Defaults to None.
+
+    Yields:
+        dict: Flashcards with at least "question" and "answer" keys.
+
+    Raises:
+        requests.RequestException: If the request fails or is aborted mid-stream.
+    """
+    import requests
+
+    parser = FlashcardStreamParser()
+    with requests.post(
+        API_URL,
+        json=get_payload(data, model, True, options),
+        stream=True,
+        timeout=(CONNECT_TIMEOUT, DEFAULT_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            yield from parser.feed(chunk.get("response", ""))
+            if chunk.get("done"):
+                break
+
+
+async def astream_flashcards_data(client, data, model="llama3", options=None, stats=None):
+    """
+    Asynchronous counterpart of `stream_flashcards_data()`.
+
+    Args:
+        client (ollama_client.OllamaClient): The client to send the request with.
+        data (str): The text to generate flashcards from.
+        model (str, optional): The model to use. Defaults to "llama3".
+        options (dict, optional): Ollama generation options. Defaults to None.
+        stats (dict, optional): Updated with the `generation_stats()` of the
+            response once it is complete.
+
+    Yields:
+        dict: Flashcards with at least "question" and "answer" keys.
+    """
+    parser = FlashcardStreamParser()
+    async for chunk in client.stream(get_payload(data, model, True, options)):
+        for card in parser.feed(chunk.get("response", "")):
+            yield card
+        if chunk.get("done") and stats is not None:
+            stats.update(generation_stats(chunk))
+
+
+async def acollect_flashcards(client, data, model="llama3", options=None, stats=None):
+    """
+    Collect the flashcards of a streamed request, keeping whatever was parsed
+    before the stream failed.
+
+    Returns:
+        tuple: (flashcards, complete) where `complete` is False if the stream
+            was aborted.
+    """
+    cards = []
+    try:
+        async for card in astream_flashcards_data(client, data, model, options, stats):
+            cards.append(card)
+        return cards, True
+    except (httpx.HTTPError, ValueError) as e:
+        if isinstance(e, ValueError):
+            metrics.inc("decode_errors_total", part="response")
+        print(f"Stream aborted after {len(cards)} flashcards: {e}")
+        return cards, False
+
+
+def natural_key(path):
+    """Sort key that orders output_2.txt before output_10.txt."""
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r"(\d+)", os.path.basename(path))
+    ]
+
+
+async def agenerate(
+    chunks,
+    output_path,
+    store,
+    model,
+    concurrency=1,
+    stream=False,
+    options=None,
+    index=None,
+    transport=None,
+    refresh=False,
+    adaptive=False,
+    timeout=DEFAULT_TIMEOUT,
+    retries=DEFAULT_RETRIES,
+    backends=None,
+    hedge=None,
+    client=None,
+):
+    """
+    Generate flashcards for a stream of chunks with at most `concurrency`
+    requests in flight against the API (per backend, with `backends`).
+
+    Chunks are pulled lazily from `chunks` (a blocking iterator is fine, it is
+    read off the event loop) and at most twice the total concurrency are held at
+    once. All cache lookups and inserts run on the event loop thread, so the
+    cache database is never touched concurrently. Chunks with identical text
+    are only sent to the API once per run.
+
+    Args:
+        chunks (Iterable[str]): The chunk texts, in deck order.
+        output_path (str): Directory where the flashcard JSON files are written.
+        store (caching.CacheStore): The flashcard cache.
+        model (str): The model to use for generating flashcards.
+        concurrency (int, optional): Maximum number of in-flight requests. Defaults to 1.
+        stream (bool, optional): If True, stream the responses and keep the flashcards
+            parsed before an aborted request. Partial results are written but not
+            cached. Defaults to False.
+        options (dict, optional): Ollama generation options. Defaults to None.
+        index (similarity.SimilarityIndex, optional): If given, a chunk that misses the
+            cache reuses the flashcards of a near-identical cached chunk instead of
+            being sent to the API. Defaults to None.
+        transport (httpx.AsyncBaseTransport, optional): The transport of the API client,
+            e.g. a `replay.RecordingTransport` or `replay.ReplayTransport`.
+        refresh (bool, optional): If True, send every chunk to the API instead of
+            serving it from the cache. Results are still cached. Defaults to False.
+        adaptive (bool, optional): If True, adapt the number of in-flight requests,
+            up to `concurrency`, to the latency and errors of the API (see
+            `ollama_client.AIMDLimiter`). Defaults to False.
+        timeout (float, optional): Seconds without data from the API before a
+            request is abandoned. Defaults to 300.
+        retries (int, optional): The number of retries of a request that timed out
+            or failed with a transient error. Defaults to 3.
+        backends (List[dict], optional): Ollama servers to balance the requests over,
+            as dicts with a "url" and optional "weight" and "concurrency" (see
+            `ollama_client.Backend`). Defaults to None, the single server at `API_URL`.
+        hedge (float or str, optional): Send a request that has not answered after
+            this many seconds to a second backend as well, or "auto" for the 95th
+            percentile of recent latencies. Defaults to None (no hedging).
+        client (ollama_client.OllamaClient, optional): An open client to send the
+            requests with, e.g. one kept alive across runs; the client options above
+            are then ignored and the client is left open. Defaults to None, a client
+            for this run.
+
+    Yields:
+        tuple: (output_file, data) for each chunk, in the same order as `chunks`. `data`
+            is the freshly generated JSON document, or None if the flashcards were
+            served from the cache (or could not be generated).
+    """
+    concurrency = max(1, concurrency)
+    in_flight = {}
+    namespace = get_cache_key("", model, options)
+
+    def remember(file_hash, output_file, signature):
+        store.add(file_hash, output_file)
+        if index is not None:
+            index.add(file_hash, namespace, signature)
+
+    def reuse_similar(output_file, signature):
+        match = index.find(namespace, signature)
+        file_path = store.get(match[0]) if match else None
+        if not file_path or not os.path.exists(file_path):
+            return False
+        shutil.copyfile(file_path, output_file)
+        return True
+
+    def record(file_hash, source, started, cards=None, stats=None):
+        seconds = time.perf_counter() - started
+        metrics.inc("chunks_total", source=source)
+        metrics.observe("chunk_seconds", seconds, source=source)
+        fields = {"chunk": file_hash[:12], "source": source, "seconds": round(seconds, 4)}
+        if cards is not None:
+            fields["flashcards"] = cards
+            metrics.inc("flashcards_generated_total", cards, model=model)
+        if stats:
+            for name, value in stats.items():
+                metrics.inc(f"{name}_total", value, model=model)
+            if stats["eval_seconds"]:
+                rate = stats["eval_tokens"] / stats["eval_seconds"]
+                metrics.observe("eval_tokens_per_second", rate, model=model)
+                fields["eval_tokens_per_second"] = round(rate, 1)
+            fields.update(stats)
+        metrics.event("chunks", **fields)
+
+    async def process(client, data):
+        started = time.perf_counter()
+        file_hash = get_cache_key(data, model, options)
+        output_file = os.path.join(output_path, file_hash + ".json")
+
+        # A repeat waits for the chunk's request; if that wrote no file, the
+        # repeat takes its place and tries again
+        while file_hash in in_flight:
+            if await in_flight[file_hash]:
+                record(file_hash, "duplicate", started)
+                return output_file, None
+
+        file_path = None if refresh else store.get(file_hash)
+        if file_path and os.path.exists(output_file):
+            store.update(file_hash, output_file)
+            record(file_hash, "cache", started)
+            return output_file, None
+
+        signature = similarity.minhash(data) if index is not None else None
+        if index is not None and not refresh and reuse_similar(output_file, signature):
+            remember(file_hash, output_file, signature)
+            record(file_hash, "similar", started)
+            return output_file, None
+
+        done = asyncio.get_running_loop().create_future()
+        in_flight[file_hash] = done
+        written = False
+        stats = {}
+        try:
+            if stream:
+                cards, complete = await acollect_flashcards(
+                    client, data, model, options, stats
+                )
+                if not cards:
+                    print(f"Failed to generate flashcards for chunk {file_hash[:12]}")
+                    record(file_hash, "failed", started)
+                    return output_file, None
+                flashcards_data = {"flashcards": cards}
+                with open(output_file, "w", encoding="utf-8") as f:
+                    json.dump(flashcards_data, f, indent=4)
+                written = True
+                if complete:
+                    remember(file_hash, output_file, signature)
+                record(
+                    file_hash, "generated" if complete else "partial", started, len(cards), stats
+                )
+                return output_file, flashcards_data
+
+            flashcards_data = await aget_flashcards_data(
+                client, data, model, options, stats
+            )
+            if not flashcards_data:
+                print(f"Failed to generate flashcards for chunk {file_hash[:12]}")
+                record(file_hash, "failed", started)
+                return output_file, None
+            try:
+                flashcards_data = json.loads(flashcards_data)
+            except ValueError as e:
+                print(f"Invalid flashcards JSON for chunk {file_hash[:12]}: {e}")
+                metrics.inc("decode_errors_total", part="flashcards")
+                record(file_hash, "failed", started)
+                return output_file, None
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(flashcards_data, f, indent=4)
+            written = True
+            remember(file_hash, output_file, signature)
+            record(
+                file_hash,
+                "generated",
+                started,
+                len(flashcards_from_data(flashcards_data)),
+                stats,
+            )
+            return output_file, flashcards_data
+        finally:
+            del in_flight[file_hash]
+            done.set_result(written)
+
+    iterator = iter(chunks)
+    pending = collections.deque()
+    exhausted = False
+    if client is None:
+        client = OllamaClient(
+            backends or API_URL, concurrency, adaptive, timeout, retries, transport, hedge
+        )
+    else:
+        client = contextlib.nullcontext(client)
+    async with client as client:
+        try:
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * client.capacity:
+                    data = await streams.anext_item(iterator)
+                    if data is streams.DONE:
+                        exhausted = True
+                    else:
+                        pending.append(asyncio.ensure_future(process(client, data)))
+                if pending:
+                    yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def iter_flashcards(
+    chunks,
+    model=None,
+    concurrency=1,
+    stream=False,
+    cache_max_bytes=caching.DEFAULT_MAX_BYTES,
+    cache_max_age=None,
+    options=None,
+    similarity_threshold=similarity.DEFAULT_THRESHOLD,
+    buffer_size=16,
+    output_path=None,
+    cache_db_path=None,
+    transport=None,
+    refresh=False,
+    adaptive=False,
+    timeout=DEFAULT_TIMEOUT,
+    retries=DEFAULT_RETRIES,
+    backends=None,
+    hedge=None,
+):
+    """
+    Generate flashcards for a stream of chunks and yield them in deck order,
+    without intermediate text files.
+
+    Generation runs on an event loop in a background thread; at most
+    `buffer_size` chunk results are buffered ahead of the consumer. Newly
+    generated flashcards are passed on from memory; only the cache is written.
+
+    Args:
+        chunks (Iterable[str]): The chunk texts, in deck order.
+        output_path (str, optional): The directory of the cached flashcard files.
+            Defaults to `extracted_json/`.
+        cache_db_path (str, optional): The cache database. Defaults to `cache.db`.
+        See `generate()` for the other arguments.
+
+    Yields:
+        dict: The flashcards, in deck order.
+    """
+    output_path = output_path or os.path.join(PROJECT_ROOT, "extracted_json")
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    store = caching.CacheStore(
+        cache_db_path or os.path.join(PROJECT_ROOT, "cache.db"),
+        cache_max_bytes,
+        cache_max_age,
+    )
+    index = None
+    if similarity_threshold and similarity_threshold > 0:
+        index = similarity.SimilarityIndex(store, similarity_threshold)
+    results = agenerate(
+        chunks,
+        output_path,
+        store,
+        model,
+        concurrency,
+        stream,
+        options,
+        index,
+        transport,
+        refresh,
+        adaptive,
+        timeout,
+        retries,
+        backends,
+        hedge,
+    )
+    try:
+        for output_file, data in streams.buffered(
+            streams.iterate_async(results), buffer_size
+        ):
+            if data is not None:
+                yield from flashcards_from_data(data)
+            elif os.path.exists(output_file):
+                yield from load_flashcards([output_file])
+        store.evict()
+    finally:
+        store.close()
+
+
+def generate(
+    debug=False,
+    model=None,
+    concurrency=1,
+    stream=False,
+    cache_max_bytes=caching.DEFAULT_MAX_BYTES,
+    cache_max_age=None,
+    options=None,
+    similarity_threshold=similarity.DEFAULT_THRESHOLD,
+    transport=None,
+    refresh=False,
+    adaptive=False,
+    timeout=DEFAULT_TIMEOUT,
+    retries=DEFAULT_RETRIES,
+    backends=None,
+    hedge=None,
+):
     """
     Generate flashcards from input files.
 
     Args:
         debug (bool, optional): If True, raise an exception when an error occurs. Defaults to False.
         model: The model to use for generating flashcards. Defaults to None.
+        concurrency (int, optional): Number of chunks sent to the API in parallel. Defaults to 1.
+        stream (bool, optional): If True, stream model responses and parse flashcards
+            incrementally. Defaults to False.
+        cache_max_bytes (int, optional): Size budget of the flashcard cache in bytes.
+        cache_max_age (int, optional): Evict cache entries unused for this many seconds.
+            Defaults to None (no age limit).
+        options (dict, optional): Ollama generation options, e.g. {"temperature": 0.2}.
+            Defaults to None.
+        similarity_threshold (float, optional): Reuse the flashcards of a cached chunk
+            whose estimated similarity to a new chunk is at least this value. Set to 0
+            to disable. Defaults to 0.9.
+        transport (httpx.AsyncBaseTransport, optional): The transport of the API client,
+            e.g. to record or replay responses (see `replay`). Defaults to None.
+        refresh (bool, optional): If True, regenerate every chunk instead of serving
+            it from the cache. Defaults to False.
+        adaptive (bool, optional): If True, adapt the number of in-flight requests,
+            up to `concurrency`, to the latency and errors of the API. Defaults to False.
+        timeout (float, optional): Seconds without data from the API before a
+            request is abandoned and retried. Defaults to 300.
+        retries (int, optional): The number of retries of a failed request. Defaults to 3.
+        backends (List[dict], optional): Ollama servers to balance the requests over
+            (see `agenerate()`). Defaults to None, the server at `API_URL`.
+        hedge (float or str, optional): The hedge delay in seconds, or "auto".
+            Defaults to None (no hedging).
 
     Returns:
         list: A list of file paths where the generated flashcards are saved.
@@ -83,49 +659,71 @@ def generate(debug=False, model=None):
         os.makedirs(output_path)
 
     cache_db_path = os.path.join(PROJECT_ROOT, "cache.db")
-    caching.init_cache_db(cache_db_path)
 
     input_files = []
     if os.path.isfile(input_path):
         input_files.append(input_path)
     elif os.path.isdir(input_path):
         input_files.extend(
-            [
-                os.path.join(input_path, file)
-                for file in os.listdir(input_path)
-                if file.endswith(".txt")
-            ]
+            sorted(
+                [
+                    os.path.join(input_path, file)
+                    for file in os.listdir(input_path)
+                    if file.endswith(".txt")
+                ],
+                key=natural_key,
+            )
         )
     else:
         print("Invalid input path.")
         return
 
-    try:
-        files = []
-        for file in tqdm(input_files, desc="Processing files"):
+    def read_chunks():
+        for file in input_files:
             with open(file, "r", encoding="utf-8") as f:
-                data = f.read()
-            file_hash = caching.generate_sha256(data)
-            output_file = os.path.join(output_path, file_hash + ".json")
-            file_path = caching.get_file_path_from_cache(cache_db_path, file_hash)
-            files.append(output_file)
-            if file_path:
-                caching.update_file_path_in_cache(cache_db_path, file_hash, output_file)
-            else:
-                flashcards_data = get_flashcards_data(data, model)
-                if flashcards_data:
-                    flashcards_data = json.loads(flashcards_data)
-                    with open(output_file, "w", encoding="utf-8") as f:
-                        json.dump(flashcards_data, f, indent=4)
-                        caching.add_file_path_to_cache(
-                            cache_db_path, file_hash, output_file
-                        )
-                else:
-                    print(f"Failed to generate flashcards for {file}")
+                yield f.read()
+
+    async def run(store, index):
+        results = agenerate(
+            read_chunks(),
+            output_path,
+            store,
+            model,
+            concurrency,
+            stream,
+            options,
+            index,
+            transport,
+            refresh,
+            adaptive,
+            timeout,
+            retries,
+            backends,
+            hedge,
+        )
+        from tqdm import tqdm
+
+        with tqdm(total=len(input_files), desc="Processing files") as progress:
+            files = []
+            async for output_file, _ in results:
+                if os.path.exists(output_file):
+                    files.append(output_file)
+                progress.update(1)
+            return files
+
+    store = caching.CacheStore(cache_db_path, cache_max_bytes, cache_max_age)
+    index = None
+    if similarity_threshold and similarity_threshold > 0:
+        index = similarity.SimilarityIndex(store, similarity_threshold)
+    try:
+        files = asyncio.run(run(store, index))
+        # entries used by this run are pinned, so only stale ones are evicted
+        store.evict()
         print(f"Flashcards generated for {len(files)} files.")
         return files
     except Exception as e:
         print(f"An error occurred: {e}")
         if debug:
             raise e
-
+    finally:
+        store.close()
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import sqlite3
+from typing import Iterable, Iterator, List, Optional
+
+# Number of texts read from the manifest at a time
+READ_BATCH_SIZE = 8
+
+
+def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Generate the SHA256 hash value of a file's contents, reading it in blocks.
+
+    Args:
+        file_path (str): The file to hash.
+        block_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The SHA256 hash value of the file.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Manifest:
+    """
+    Persistent index of extracted input documents.
+
+    Each document is recorded with its size, modification time and content
+    hash; the extracted page/slide texts are stored once per content hash. A
+    document whose size and mtime are unchanged is served from the manifest
+    without being opened, and one that was only touched (or renamed, or
+    copied) is recognised by its content hash, so only added or modified
+    files need to be extracted again.
+
+    Texts are written and read as streams (see `stream()` and `iter_texts()`),
+    so a document never has to be held in memory as a whole.
+    """
+
+    def __init__(self, manifest_db_path: str):
+        # Streams are advanced from executor threads, one call at a time
+        self.conn = sqlite3.connect(manifest_db_path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                content_hash TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS documents_content_hash
+                ON documents (content_hash);
+            CREATE TABLE IF NOT EXISTS segments (
+                content_hash TEXT,
+                idx INTEGER,
+                text TEXT,
+                PRIMARY KEY (content_hash, idx)
+            );
+            -- Texts of the document being streamed, private to this connection
+            CREATE TEMP TABLE IF NOT EXISTS staged_segments (
+                idx INTEGER PRIMARY KEY,
+                text TEXT
+            );
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _has_segments(self, content_hash: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM segments WHERE content_hash = ? LIMIT 1", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def lookup(self, file_path: str) -> Optional[str]:
+        """
+        Returns the content hash of an up-to-date document, or None if the
+        document has to be extracted.
+
+        Only a `stat()` is needed when size and mtime match the recorded ones.
+        Otherwise the file is hashed, and if its contents were extracted
+        before (under any path) the record is refreshed instead.
+
+        Args:
+            file_path (str): The path of the input document.
+
+        Returns:
+            str or None: The content hash under which the texts are stored.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, content_hash FROM documents WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        content_hash = hash_file(path)
+        if not self._has_segments(content_hash):
+            return None
+        self._record(path, stat, content_hash)
+        self.conn.commit()
+        return content_hash
+
+    def _record(self, path: str, stat: os.stat_result, content_hash: str):
+        self.conn.execute('''
+            INSERT OR REPLACE INTO documents (path, size, mtime_ns, content_hash)
+            VALUES (?, ?, ?, ?)
+        ''', (path, stat.st_size, stat.st_mtime_ns, content_hash))
+
+    def stream(self, file_path: str, texts: Iterable[str]) -> Iterator[str]:
+        """
+        Records a document while it is being extracted, passing its texts
+        through.
+
+        The texts are staged in a temporary table as they go by, and the
+        document is only recorded once all of them were seen, so a stream that
+        is closed early or fails leaves the manifest unchanged. Only the last
+        step takes the database's write lock.
+
+        Args:
+            file_path (str): The path of the input document.
+            texts (Iterable[str]): The extracted page/slide texts, in order.
+
+        Yields:
+            str: The texts.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        content_hash = hash_file(path)
+        self.conn.execute("DELETE FROM temp.staged_segments")
+        for i, text in enumerate(texts):
+            self.conn.execute(
+                "INSERT INTO temp.staged_segments (idx, text) VALUES (?, ?)", (i, text)
+            )
+            yield text
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM segments WHERE content_hash = ?", (content_hash,)
+            )
+            self.conn.execute('''
+                INSERT INTO segments (content_hash, idx, text)
+                SELECT ?, idx, text FROM temp.staged_segments
+            ''', (content_hash,))
+            self.conn.execute("DELETE FROM temp.staged_segments")
+            self._record(path, stat, content_hash)
+
+    def store(self, file_path: str, texts: List[str]) -> str:
+        """
+        Records a freshly extracted document and its texts.
+
+        Args:
+            file_path (str): The path of the input document.
+            texts (List[str]): The extracted page/slide texts, in order.
+
+        Returns:
+            str: The content hash of the document.
+        """
+        for _ in self.stream(file_path, texts):
+            pass
+        return self.lookup(file_path)
+
+    def iter_texts(self, content_hash: str, batch_size: int = READ_BATCH_SIZE) -> Iterator[str]:
+        """
+        Yields the stored texts of a document, in page/slide order.
+
+        The texts are read in batches, and no read transaction is held open
+        between two batches, so writers are not blocked by a slow consumer.
+        """
+        start = 0
+        while True:
+            rows = self.conn.execute('''
+                SELECT idx, text FROM segments
+                WHERE content_hash = ? AND idx >= ? ORDER BY idx LIMIT ?
+            ''', (content_hash, start, batch_size)).fetchall()
+            for _, text in rows:
+                yield text
+            if len(rows) < batch_size:
+                return
+            start = rows[-1][0] + 1
+
+    def texts(self, content_hash: str) -> List[str]:
+        """
+        Returns the stored texts of a document, in page/slide order.
+        """
+        return list(self.iter_texts(content_hash))
+
+    def prune(self, keep_paths: Iterable[str] = ()):
+        """
+        Forgets documents that no longer exist on disk and texts that are no
+        longer referenced by any document.
+
+        Args:
+            keep_paths (Iterable[str]): Paths known to exist, which are not stat'ed again.
+        """
+        keep = {os.path.abspath(path) for path in keep_paths}
+        missing = [
+            (path,)
+            for (path,) in self.conn.execute("SELECT path FROM documents")
+            if path not in keep and not os.path.exists(path)
+        ]
+        with self.conn:
+            self.conn.executemany("DELETE FROM documents WHERE path = ?", missing)
+            self.conn.execute('''
+                DELETE FROM segments WHERE content_hash NOT IN
+                    (SELECT content_hash FROM documents)
+            ''')
@@ -0,0 +1,377 @@
+import bisect
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Prefix of the metric names in the Prometheus exposition
+NAMESPACE = "flashcard_generator"
+
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Metric name -> (type, help text, histogram buckets)
+METRICS = {
+    "stage_seconds_total": ("counter", "Wall time spent in each stage.", None),
+    "chunks_total": (
+        "counter",
+        "Chunks processed, by where their flashcards came from "
+        "(cache, similar, duplicate, generated, partial or failed).",
+        None,
+    ),
+    "chunk_seconds": ("histogram", "Time to obtain the flashcards of a chunk.", TIME_BUCKETS),
+    "flashcards_generated_total": ("counter", "Flashcards returned by the model.", None),
+    "prompt_tokens_total": ("counter", "Prompt tokens evaluated by the model.", None),
+    "eval_tokens_total": ("counter", "Tokens generated by the model.", None),
+    "load_seconds_total": ("counter", "Time the model server spent loading models.", None),
+    "prompt_eval_seconds_total": ("counter", "Time the model spent evaluating prompts.", None),
+    "eval_seconds_total": ("counter", "Time the model spent generating tokens.", None),
+    "request_seconds_total": ("counter", "Total time reported by the model server.", None),
+    "eval_tokens_per_second": (
+        "histogram", "Generation speed of each model response.", RATE_BUCKETS,
+    ),
+    "cache_lookups_total": (
+        "counter", "Flashcard cache lookups, by result and tier (memory or db).", None,
+    ),
+    "cache_evictions_total": ("counter", "Entries evicted from the flashcard cache.", None),
+    "render_slide_seconds": ("histogram", "Time to render one flashcard slide.", TIME_BUCKETS),
+    "render_save_seconds": ("histogram", "Time to save a rendered presentation.", TIME_BUCKETS),
+    "request_retries_total": ("counter", "Model requests retried, by error.", None),
+    "request_failures_total": ("counter", "Model requests given up, by error.", None),
+    "decode_errors_total": (
+        "counter", "Model responses that could not be decoded, by part (response or flashcards).", None
+    ),
+    "concurrency_limit": ("gauge", "Current limit of in-flight model requests.", None),
+    "backend_requests_total": ("counter", "Model requests by backend and result.", None),
+    "backend_ejections_total": ("counter", "Backends ejected from the pool as failing or slow.", None),
+    "hedged_requests_total": ("counter", "Hedged model requests, by which request answered first.", None),
+    "deck_builds_total": ("counter", "Decks built in watch mode, by result.", None),
+    "deck_build_seconds": ("histogram", "Time to build a deck in watch or service mode.", TIME_BUCKETS),
+    "jobs_total": ("counter", "Service jobs, by status (queued, done or failed).", None),
+    "jobs_queued": ("gauge", "Service jobs waiting for a worker.", None),
+    "job_seconds": ("histogram", "Time from the upload of a job to its result.", TIME_BUCKETS),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """
+    Cumulative distribution of observed values over fixed buckets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, data: dict):
+        for i, count in enumerate(data["counts"]):
+            self.counts[i] += count
+        self.count += data["count"]
+        self.sum += data["sum"]
+        if data["count"]:
+            self.min = min(self.min, data["min"])
+            self.max = max(self.max, data["max"])
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile by linear interpolation within its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "counts": list(self.counts),
+        }
+
+
+class Registry:
+    """
+    Thread-safe collection of counters, gauges, histograms and per-item events.
+
+    Metrics are declared in `METRICS` and identified by their name and labels.
+    Each process has its own registry (`REGISTRY`); worker processes send a
+    `snapshot()` back to be `merge()`d into the parent's.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters: Dict[str, Dict[Labels, float]] = {}
+            self.gauges: Dict[str, Dict[Labels, float]] = {}
+            self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+            self.events: Dict[str, List[dict]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self.lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observes (histograms) or adds (counters) the duration of the block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if METRICS[name][0] == "histogram":
+                self.observe(name, elapsed, **labels)
+            else:
+                self.inc(name, elapsed, **labels)
+
+    def event(self, kind: str, **fields):
+        """
+        Records one item, e.g. a chunk, for the JSON report.
+        """
+        with self.lock:
+            self.events.setdefault(kind, []).append(fields)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": {
+                    name: [[list(key), value] for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "gauges": {
+                    name: [[list(key), value] for key, value in series.items()]
+                    for name, series in self.gauges.items()
+                },
+                "histograms": {
+                    name: [[list(key), histogram.to_dict()] for key, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+                "events": {kind: list(events) for kind, events in self.events.items()},
+            }
+
+    def merge(self, snapshot: dict):
+        """
+        Adds the metrics of another registry's snapshot to this one.
+        """
+        with self.lock:
+            for name, series in snapshot["counters"].items():
+                counters = self.counters.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(map(tuple, key))
+                    counters[key] = counters.get(key, 0) + value
+            for name, series in snapshot.get("gauges", {}).items():
+                gauges = self.gauges.setdefault(name, {})
+                for key, value in series:
+                    gauges[tuple(map(tuple, key))] = value
+            for name, series in snapshot["histograms"].items():
+                histograms = self.histograms.setdefault(name, {})
+                for key, data in series:
+                    key = tuple(map(tuple, key))
+                    if key not in histograms:
+                        histograms[key] = Histogram(METRICS[name][2])
+                    histograms[key].merge(data)
+            for kind, events in snapshot["events"].items():
+                self.events.setdefault(kind, []).extend(events)
+
+    def total(self, name: str, **labels) -> float:
+        """
+        Sums a counter (or a histogram's observations) over the series matching
+        the given labels.
+        """
+        wanted = set(_labels(labels))
+        with self.lock:
+            if name in self.histograms:
+                return sum(
+                    h.sum for key, h in self.histograms[name].items() if wanted <= set(key)
+                )
+            return sum(
+                value
+                for key, value in self.counters.get(name, {}).items()
+                if wanted <= set(key)
+            )
+
+    def summary(self) -> dict:
+        """
+        The headline figures: where the wall time went, the model's token
+        throughput and the cache hit ratio.
+        """
+        stages = {
+            dict(key)["stage"]: round(value, 3)
+            for key, value in self.counters.get("stage_seconds_total", {}).items()
+        }
+        chunks = {
+            dict(key)["source"]: int(value)
+            for key, value in self.counters.get("chunks_total", {}).items()
+        }
+        eval_seconds = self.total("eval_seconds_total")
+        prompt_seconds = self.total("prompt_eval_seconds_total")
+        hits = self.total("cache_lookups_total", result="hit")
+        lookups = self.total("cache_lookups_total")
+        slides = self.histograms.get("render_slide_seconds", {}).get((), Histogram(()))
+        return {
+            "stage_seconds": stages,
+            "chunks": chunks,
+            "prompt_tokens": int(self.total("prompt_tokens_total")),
+            "eval_tokens": int(self.total("eval_tokens_total")),
+            "prompt_tokens_per_second": round(
+                self.total("prompt_tokens_total") / prompt_seconds, 1
+            ) if prompt_seconds else None,
+            "eval_tokens_per_second": round(
+                self.total("eval_tokens_total") / eval_seconds, 1
+            ) if eval_seconds else None,
+            "cache_hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "cache_evictions": int(self.total("cache_evictions_total")),
+            "slides": slides.count,
+            "slide_seconds_p50": round(slides.quantile(0.5), 4),
+            "slide_seconds_p95": round(slides.quantile(0.95), 4),
+        }
+
+    def to_json(self) -> dict:
+        report = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration_seconds": round(time.time() - self.started, 3),
+            "summary": self.summary(),
+            "metrics": {},
+        }
+        with self.lock:
+            for name, series in itertools.chain(self.counters.items(), self.gauges.items()):
+                report["metrics"][name] = [
+                    {"labels": dict(key), "value": value} for key, value in series.items()
+                ]
+            for name, series in self.histograms.items():
+                report["metrics"][name] = [
+                    {
+                        "labels": dict(key),
+                        "count": h.count,
+                        "sum": h.sum,
+                        "min": h.min if h.count else 0.0,
+                        "max": h.max if h.count else 0.0,
+                        "p50": h.quantile(0.5),
+                        "p95": h.quantile(0.95),
+                        "p99": h.quantile(0.99),
+                    }
+                    for key, h in series.items()
+                ]
+            report.update({kind: list(events) for kind, events in self.events.items()})
+        return report
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+        """
+        def labels_text(key, extra=()):
+            pairs = list(key) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (
+                k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                for k, v in pairs
+            )
+            return "{" + ",".join(escaped) + "}"
+
+        lines = []
+        with self.lock:
+            for name, (kind, help, _) in METRICS.items():
+                series = {
+                    "counter": self.counters, "gauge": self.gauges, "histogram": self.histograms,
+                }[kind].get(name)
+                if not series:
+                    continue
+                full_name = f"{NAMESPACE}_{name}"
+                lines.append(f"# HELP {full_name} {help}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind != "histogram":
+                        lines.append(f"{full_name}{labels_text(key)} {value:g}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (math.inf,), value.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else f"{bound:g}"
+                        lines.append(
+                            f"{full_name}_bucket{labels_text(key, [('le', le)])} {cumulative}"
+                        )
+                    lines.append(f"{full_name}_sum{labels_text(key)} {value.sum:g}")
+                    lines.append(f"{full_name}_count{labels_text(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Writes a Prometheus text file if `path` ends with ".prom", otherwise a
+        JSON report.
+        """
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+
+
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+event = REGISTRY.event
+snapshot = REGISTRY.snapshot
+merge = REGISTRY.merge
+reset = REGISTRY.reset
+write = REGISTRY.write
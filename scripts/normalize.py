@@ -0,0 +1,183 @@
+import itertools
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Set
+
+# Unicode normalization form applied to extracted text. NFKC folds
+# compatibility characters (ligatures, full-width letters, non-breaking
+# spaces) into their plain equivalents while keeping accents and scripts.
+DEFAULT_FORM = "NFKC"
+# Number of non-empty lines at the top and bottom of a page that may be a
+# running header or footer
+EDGE_LINES = 2
+# A header or footer must appear on at least this many pages ...
+MIN_REPEATED_PAGES = 3
+# ... and on at least this fraction of the pages of the document
+REPEATED_RATIO = 0.5
+# Headers and footers are detected on this many pages at the start of a
+# document, so that long documents can be streamed
+REPEATED_WINDOW = 50
+
+# Replacements of the characters that PDF and Office text extraction leaves
+# behind: control characters become spaces and invisible characters are
+# removed. The ligatures are also covered by NFKC, but are listed so that they
+# are expanded whatever the normalization form.
+_REPLACEMENTS = {
+    **{chr(code): " " for code in range(0x20) if not chr(code).isspace()},
+    **{chr(code): " " for code in range(0x7F, 0xA0) if not chr(code).isspace()},
+    "\u00ad": "",  # soft hyphen
+    "\u200b": "",  # zero width space
+    "\u2060": "",  # word joiner
+    "\ufeff": "",  # byte order mark
+    "\ufffd": " ",  # replacement character of undecodable bytes
+    "\ufb00": "ff",
+    "\ufb01": "fi",
+    "\ufb02": "fl",
+    "\ufb03": "ffi",
+    "\ufb04": "ffl",
+    "\ufb05": "st",
+    "\ufb06": "st",
+}
+# These characters are rare, so a regex that only stops at them scans a page
+# much faster than `str.translate()` with a mapping
+_SPECIAL = re.compile("[" + "".join(map(re.escape, _REPLACEMENTS)) + "]")
+# A hyphen at the end of a line, followed by a letter. The regex starts with
+# the hyphen so that it only stops at hyphens; the letter before the hyphen is
+# checked by `_join_hyphenated()`.
+_HYPHENATED = re.compile(r"[-\u2010\u00ad][ \t]*\r?\n\s*(?=[^\W\d_])")
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _replace_special(match: re.Match) -> str:
+    return _REPLACEMENTS[match.group()]
+
+
+def _join_hyphenated(match: re.Match) -> str:
+    text, start = match.string, match.start()
+    if start == 0 or not text[start - 1].isalpha():
+        return match.group()
+    # A capital after the break is more likely a compound ("Jean-Paul")
+    return "" if text[match.end()].islower() else "-"
+
+
+def normalize_text(text: str, form: Optional[str] = DEFAULT_FORM) -> str:
+    """
+    Normalizes extracted text for prompting.
+
+    Words hyphenated at line breaks are joined, ligatures are expanded,
+    invisible and control characters are removed, the text is brought to the
+    Unicode normalization form and whitespace runs are collapsed into single
+    spaces. Every step runs in C (compiled regexes that only stop at the
+    characters they change, `unicodedata` and `str.split()`), and non-ASCII
+    text such as accents, math symbols or other scripts is kept. NFKC also
+    folds super- and subscripts ("x²" becomes "x2"); pass "NFC" to keep them.
+
+    Args:
+        text (str): The text to normalize.
+        form (str, optional): The Unicode normalization form ("NFC", "NFKC", ...),
+            or None to skip it. Defaults to "NFKC".
+
+    Returns:
+        str: The normalized text, without leading or trailing whitespace.
+    """
+    text = _HYPHENATED.sub(_join_hyphenated, text)
+    text = _SPECIAL.sub(_replace_special, text)
+    if form and not text.isascii() and not unicodedata.is_normalized(form, text):
+        text = unicodedata.normalize(form, text)
+    return " ".join(text.split())
+
+
+def _line_key(line: str) -> str:
+    # Page numbers differ from page to page, so digits are ignored
+    return _DIGITS.sub("#", _WHITESPACE.sub(" ", line).strip())
+
+
+def _edge_indices(lines: List[str], edge_lines: int) -> List[int]:
+    indices = [i for i, line in enumerate(lines) if line.strip()]
+    if len(indices) <= 2 * edge_lines:
+        return indices
+    return indices[:edge_lines] + indices[-edge_lines:]
+
+
+def _repeated_keys(
+    split_pages: List[List[str]], edges: List[List[int]], min_pages: int, ratio: float
+) -> Set[str]:
+    if len(split_pages) < min_pages:
+        return set()
+    counts = Counter()
+    for lines, indices in zip(split_pages, edges):
+        counts.update({_line_key(lines[i]) for i in indices})
+    threshold = max(min_pages, ratio * len(split_pages))
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def _strip_page(page: str, lines: List[str], indices: List[int], repeated: Set[str]) -> str:
+    drop = {i for i in indices if _line_key(lines[i]) in repeated}
+    if not drop:
+        return page
+    return "\n".join(line for i, line in enumerate(lines) if i not in drop)
+
+
+def iter_without_repeated_lines(
+    pages: Iterable[str],
+    window: Optional[int] = REPEATED_WINDOW,
+    edge_lines: int = EDGE_LINES,
+    min_pages: int = MIN_REPEATED_PAGES,
+    ratio: float = REPEATED_RATIO,
+) -> Iterator[str]:
+    """
+    Removes running headers and footers from the pages of a document.
+
+    A line at the top or bottom of a page is a header or footer if the same
+    line, ignoring digits such as page numbers, is at the top or bottom of
+    enough other pages of the document. The headers and footers are detected
+    on the first `window` pages, and only those are held in memory.
+
+    Args:
+        pages (Iterable[str]): The page or slide texts of one document.
+        window (int, optional): The number of pages the headers and footers are
+            detected on, or None for all of them. Defaults to 50.
+        edge_lines (int): The number of lines at the top and at the bottom of each
+            page that are considered. Defaults to 2.
+        min_pages (int): The minimum number of pages a line must be repeated on.
+            Defaults to 3.
+        ratio (float): The minimum fraction of the pages a line must be repeated on.
+            Defaults to 0.5.
+
+    Yields:
+        str: The pages without their headers and footers.
+    """
+    pages = iter(pages)
+    head = list(itertools.islice(pages, window)) if window else list(pages)
+    split_pages = [page.splitlines() for page in head]
+    edges = [_edge_indices(lines, edge_lines) for lines in split_pages]
+    repeated = _repeated_keys(split_pages, edges, min_pages, ratio)
+    if not repeated:
+        yield from head
+        yield from pages
+        return
+
+    for page, lines, indices in zip(head, split_pages, edges):
+        yield _strip_page(page, lines, indices, repeated)
+    del head, split_pages, edges
+    for page in pages:
+        lines = page.splitlines()
+        yield _strip_page(page, lines, _edge_indices(lines, edge_lines), repeated)
+
+
+def strip_repeated_lines(
+    pages: Iterable[str],
+    edge_lines: int = EDGE_LINES,
+    min_pages: int = MIN_REPEATED_PAGES,
+    ratio: float = REPEATED_RATIO,
+) -> List[str]:
+    """
+    Removes running headers and footers from all the pages of a document at
+    once, see `iter_without_repeated_lines()`.
+
+    Returns:
+        List[str]: The pages without their headers and footers.
+    """
+    return list(iter_without_repeated_lines(pages, None, edge_lines, min_pages, ratio))
@@ -0,0 +1,665 @@
+import asyncio
+import collections
+import itertools
+import json
+import math
+import random
+import time
+from typing import List
+
+import httpx
+
+from scripts import metrics
+
+# Seconds without any data from the server before a request is abandoned;
+# non-streamed responses only arrive once generation is complete
+DEFAULT_TIMEOUT = 300.0
+CONNECT_TIMEOUT = 10.0
+# Retries of a failed request, on top of the first attempt
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Statuses of an overloaded or temporarily failing server
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+# Retries allowed per request sent, the retries allowed before any request
+# was sent, and the number of recent requests whose retry credit is kept
+RETRY_RATIO = 0.5
+RETRY_RESERVE = 10
+RETRY_WINDOW = 100
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with full jitter: a random delay of up to
+    `base * 2 ** attempt` seconds, at most `cap`, so that requests which
+    failed together do not retry together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def error_reason(error: Exception) -> str:
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    return "connection"
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Timeouts, connection errors and overload or server error statuses are
+    retried; other errors (e.g. an unknown model) would fail again.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, httpx.TransportError)
+
+
+class RetryBudget:
+    """
+    Allows retries for at most `ratio` of the requests sent, plus `reserve`
+    retries, so that a server that is down gets about 1 + `ratio` times the
+    normal load instead of 1 + `retries` times. Only the credit of the last
+    `window` requests is kept, so a long healthy run does not build up a
+    retry storm.
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_RATIO,
+        reserve: int = RETRY_RESERVE,
+        window: int = RETRY_WINDOW,
+    ):
+        self.ratio = ratio
+        self.max_balance = reserve + ratio * window
+        self.balance = float(reserve)
+
+    def deposit(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class AIMDLimiter:
+    """
+    Bounds the number of in-flight requests.
+
+    With `adaptive`, the limit starts at `min_limit` and follows an AIMD
+    (additive increase, multiplicative decrease) scheme like TCP's congestion
+    window: it grows by one per successful request while no congestion has
+    been seen (slow start), then by one per `limit` successful requests; it is
+    multiplied by `decrease` when a request fails with an overload error or
+    when the smoothed latency exceeds `tolerance` times the lowest latency of
+    the last `window` requests, i.e. when requests start queueing on the
+    server. It is decreased at most once per round trip and never exceeds
+    `max_limit`. Without `adaptive`, the limit is `max_limit`.
+
+    The limiter must only be used from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        adaptive: bool = False,
+        min_limit: int = 1,
+        decrease: float = 0.7,
+        tolerance: float = 2.0,
+        window: int = 50,
+        name: str = "",
+    ):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.adaptive = adaptive
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.limit = float(self.min_limit if adaptive else self.max_limit)
+        self.in_flight = 0
+        self._latencies = collections.deque(maxlen=window)
+        self._smoothed = None
+        self._slow_start = True
+        self._saturated_at = -math.inf
+        self._last_decrease = 0.0
+        metrics.set_gauge("concurrency_limit", self.limit, backend=self.name)
+
+    def try_acquire(self):
+        """
+        Takes a slot if one is free.
+
+        Returns:
+            float: The time the slot was taken, to pass to `release()`, or None.
+        """
+        if self.in_flight >= int(self.limit):
+            return None
+        self.in_flight += 1
+        admitted = time.monotonic()
+        if self.in_flight >= int(self.limit):
+            self._saturated_at = admitted
+        return admitted
+
+    def release(self, admitted: float, latency: float = None, overloaded: bool = False):
+        """
+        Frees a slot and adapts the limit to the outcome of its request.
+
+        Args:
+            admitted (float): The time returned by `try_acquire()`.
+            latency (float, optional): The latency of a successful request.
+            overloaded (bool, optional): The request failed in a way that
+                suggests an overloaded server (timeout, 5xx, 429...).
+        """
+        self.in_flight -= 1
+        if self.adaptive and (overloaded or latency is not None):
+            self._update(admitted, latency, overloaded)
+
+    def _update(self, admitted, latency, overloaded):
+        congested = overloaded
+        if latency is not None:
+            self._latencies.append(latency)
+            self._smoothed = (
+                latency if self._smoothed is None else 0.7 * self._smoothed + 0.3 * latency
+            )
+            congested = congested or self._smoothed > self.tolerance * min(self._latencies)
+        now = time.monotonic()
+        if congested:
+            round_trip = min(self._latencies) if self._latencies else 0.0
+            if now - self._last_decrease < round_trip:
+                return
+            self._last_decrease = now
+            self._slow_start = False
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+        elif latency is not None and self._saturated_at >= admitted:
+            # Only grow a limit that was fully used while this request was in flight
+            step = 1.0 if self._slow_start else 1.0 / self.limit
+            self.limit = min(self.max_limit, self.limit + step)
+        metrics.set_gauge("concurrency_limit", self.limit, backend=self.name)
+
+
+def generate_url(url: str) -> str:
+    """
+    Returns the /api/generate endpoint of a server given by its base URL
+    (e.g. "http://gpu1:11434") or by the endpoint itself.
+    """
+    url = url.rstrip("/")
+    return url if url.endswith("/api/generate") else url + "/api/generate"
+
+
+class Backend:
+    """
+    One Ollama server of a `BackendPool`, with its own concurrency limit and
+    health state.
+
+    Args:
+        url (str): The server's base URL or /api/generate endpoint.
+        weight (float): The server's share of the requests, relative to the
+            other backends (e.g. 2 for a server twice as fast). Defaults to 1.
+        concurrency (int): The maximum number of requests in flight, e.g.
+            the server's OLLAMA_NUM_PARALLEL. Defaults to 1.
+        adaptive (bool): Adapt the limit below `concurrency` to the server's
+            latency and errors (see `AIMDLimiter`). Defaults to False.
+    """
+
+    def __init__(self, url: str, weight: float = 1.0, concurrency: int = 1, adaptive: bool = False):
+        self.url = generate_url(url)
+        self.base_url = self.url[: -len("/api/generate")] + "/"
+        self.weight = float(weight)
+        self.limiter = AIMDLimiter(concurrency, adaptive, name=self.url)
+        self.healthy = True
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latency = None
+        self.samples = 0
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, weight={self.weight:g}, concurrency={self.limiter.max_limit})"
+
+    def observe(self, latency: float):
+        self.samples += 1
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+
+def load_backends(path: str) -> dict:
+    """
+    Reads a backend pool configuration: a JSON file holding either a list of
+    backends or an object with a "backends" list and an optional "hedge"
+    setting. Each backend is a URL or an object with "url" and optional
+    "weight" and "concurrency" keys.
+
+    Returns:
+        dict: "backends", a list of dicts with at least a "url" key, and "hedge".
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        conf = json.load(f)
+    if isinstance(conf, list):
+        conf = {"backends": conf}
+    backends = [
+        {"url": backend} if isinstance(backend, str) else dict(backend)
+        for backend in conf.get("backends", [])
+    ]
+    if not backends:
+        raise ValueError(f"No backends configured in {path}")
+    return {"backends": backends, "hedge": conf.get("hedge")}
+
+
+class BackendPool:
+    """
+    Balances requests over backends by least outstanding requests: each
+    request goes to the healthy backend with a free slot and the fewest
+    requests in flight relative to its weight.
+
+    A backend is ejected after `EJECT_FAILURES` consecutive failed requests,
+    or when its smoothed latency grows past `SLOW_FACTOR` times the median of
+    the healthy backends. Ejected backends are probed every
+    `HEALTH_INTERVAL` seconds once their ejection time (`EJECT_SECONDS`,
+    doubling with each ejection) has passed, and return to the pool when a
+    probe succeeds. The last healthy backend is never ejected.
+    """
+
+    EJECT_FAILURES = 3
+    SLOW_FACTOR = 3.0
+    MIN_SAMPLES = 5
+    EJECT_SECONDS = 30.0
+    MAX_EJECT_SECONDS = 300.0
+    HEALTH_INTERVAL = 5.0
+
+    def __init__(self, backends: List[Backend]):
+        self.backends = backends
+        self.latencies = collections.deque(maxlen=100)
+        self._waiters = collections.deque()
+
+    @property
+    def capacity(self) -> int:
+        return sum(backend.limiter.max_limit for backend in self.backends)
+
+    def try_acquire(self, avoid: Backend = None, strict: bool = False):
+        """
+        Takes a slot on the least loaded healthy backend, preferring backends
+        other than `avoid` (and only those with `strict`).
+
+        Returns:
+            tuple: (backend, admitted) or None if no slot is free.
+        """
+        candidates = [
+            backend
+            for backend in self.backends
+            if backend.healthy and backend.limiter.in_flight < int(backend.limiter.limit)
+        ]
+        others = [backend for backend in candidates if backend is not avoid]
+        candidates = others if others or strict else candidates
+        if not candidates:
+            return None
+        backend = min(candidates, key=lambda b: (b.limiter.in_flight + 1) / b.weight)
+        return backend, backend.limiter.try_acquire()
+
+    async def acquire(self, avoid: Backend = None):
+        """
+        Waits for a slot, see `try_acquire()`.
+        """
+        while True:
+            slot = self.try_acquire(avoid)
+            if slot is not None:
+                return slot
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    self._wake()
+                raise
+
+    def release(self, backend, admitted, latency=None, overloaded=False, failed=False):
+        """
+        Frees a slot and updates the backend's concurrency limit and health.
+
+        Args:
+            backend (Backend): The backend the slot was taken on.
+            admitted (float): The time the slot was taken.
+            latency (float, optional): The latency of a successful request.
+            overloaded (bool, optional): The request failed with an overload error.
+            failed (bool, optional): The request failed.
+        """
+        backend.limiter.release(admitted, latency, overloaded)
+        if failed:
+            backend.failures += 1
+            metrics.inc("backend_requests_total", backend=backend.url, result="error")
+        elif latency is not None:
+            backend.failures = 0
+            backend.observe(latency)
+            self.latencies.append(latency)
+            metrics.inc("backend_requests_total", backend=backend.url, result="ok")
+        if backend.healthy and self._should_eject(backend):
+            self._eject(backend)
+        self._wake()
+
+    def _should_eject(self, backend) -> bool:
+        healthy = [b for b in self.backends if b.healthy]
+        if len(healthy) < 2:
+            return False
+        if backend.failures >= self.EJECT_FAILURES:
+            return True
+        measured = sorted(b.latency for b in healthy if b.samples >= self.MIN_SAMPLES)
+        if backend.samples < self.MIN_SAMPLES or len(measured) < 2:
+            return False
+        return backend.latency > self.SLOW_FACTOR * measured[(len(measured) - 1) // 2]
+
+    def _eject(self, backend):
+        duration = min(self.MAX_EJECT_SECONDS, self.EJECT_SECONDS * 2 ** backend.ejections)
+        backend.healthy = False
+        backend.ejections += 1
+        backend.ejected_until = time.monotonic() + duration
+        metrics.inc("backend_ejections_total", backend=backend.url)
+        print(f"Backend {backend.url} ejected for {duration:g}s")
+
+    def _reinstate(self, backend):
+        backend.healthy = True
+        backend.failures = 0
+        backend.latency = None
+        backend.samples = 0
+        print(f"Backend {backend.url} is back")
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def probe(self, client: httpx.AsyncClient):
+        """
+        Health-checks ejected backends until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.HEALTH_INTERVAL)
+            now = time.monotonic()
+            for backend in self.backends:
+                if backend.healthy or now < backend.ejected_until:
+                    continue
+                try:
+                    response = await client.get(backend.base_url, timeout=CONNECT_TIMEOUT)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    self._reinstate(backend)
+                else:
+                    backend.ejected_until = now + self.HEALTH_INTERVAL
+
+    def hedge_delay(self, hedge):
+        """
+        The time after which a request is duplicated on another backend:
+        `hedge` seconds, or with "auto" the 95th percentile of recent
+        latencies. None disables hedging.
+        """
+        if hedge is None or len(self.backends) < 2:
+            return None
+        if hedge != "auto":
+            return float(hedge)
+        if len(self.latencies) < 20:
+            return None
+        return sorted(self.latencies)[int(0.95 * (len(self.latencies) - 1))]
+
+
+class OllamaClient:
+    """
+    An Ollama /api/generate client for one server or a `BackendPool` of
+    several, with timeouts, retries with backoff and jitter under a
+    `RetryBudget`, per-backend `AIMDLimiter`s and optional hedged requests.
+    Connections are kept alive and shared by all requests.
+
+    Retries go to another backend when one has a free slot. With `hedge`, a
+    request that has not answered (streams: not sent its first message)
+    after the hedge delay is duplicated on another backend with a free slot;
+    the first answer is used and the other request is cancelled.
+
+    Use it as an async context manager.
+
+    Args:
+        backends (str or List[dict]): The URL of a single server, or backend
+            configurations: dicts of `Backend` arguments.
+        concurrency (int): The concurrency of backends that do not set one.
+        adaptive (bool): Adapt each backend's concurrency to its latency and errors.
+        timeout (float): Seconds without data before a request is abandoned.
+        retries (int): The number of retries of a failed request.
+        transport (httpx.AsyncBaseTransport, optional): The HTTP transport.
+        hedge (float or str, optional): The hedge delay in seconds, or "auto".
+    """
+
+    def __init__(
+        self,
+        backends,
+        concurrency: int = 1,
+        adaptive: bool = False,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        transport: httpx.AsyncBaseTransport = None,
+        hedge=None,
+    ):
+        if isinstance(backends, str):
+            backends = [{"url": backends}]
+        self.pool = BackendPool([
+            Backend(
+                backend["url"],
+                backend.get("weight", 1.0),
+                backend.get("concurrency", concurrency),
+                adaptive,
+            )
+            for backend in backends
+        ])
+        self.retries = retries
+        self.budget = RetryBudget()
+        self.hedge = hedge
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=self.pool.capacity + len(backends),
+                max_keepalive_connections=self.pool.capacity,
+            ),
+            transport=transport,
+        )
+        self._probe = None
+
+    @property
+    def capacity(self) -> int:
+        return self.pool.capacity
+
+    async def __aenter__(self):
+        if len(self.pool.backends) > 1:
+            self._probe = asyncio.ensure_future(self.pool.probe(self._client))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._probe is not None:
+            self._probe.cancel()
+        await self._client.aclose()
+
+    async def _retry(self, error: Exception, attempt: int) -> bool:
+        """
+        Waits before the next attempt, or returns False if the request must
+        not be retried.
+        """
+        if attempt >= self.retries or not is_retryable(error) or not self.budget.withdraw():
+            metrics.inc("request_failures_total", reason=error_reason(error))
+            return False
+        metrics.inc("request_retries_total", reason=error_reason(error))
+        delay = backoff_delay(attempt)
+        print(f"Request failed ({error_reason(error)}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        return True
+
+    async def _hedged(self, send, backend, admitted, payload, discard=None):
+        """
+        Runs `send(backend, admitted, payload)` and, if it takes longer than
+        the hedge delay, a second one on another backend. Returns the first
+        successful result; a late result of the other is passed to `discard`.
+        """
+        primary = asyncio.ensure_future(send(backend, admitted, payload))
+        tasks = {primary}
+        hedged = False
+        try:
+            delay = self.pool.hedge_delay(self.hedge)
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                slot = None if primary.done() else self.pool.try_acquire(backend, strict=True)
+                if slot is not None:
+                    tasks.add(asyncio.ensure_future(send(*slot, payload)))
+                    hedged = True
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                results = [task for task in done if not task.exception()]
+                if results:
+                    if hedged:
+                        metrics.inc(
+                            "hedged_requests_total",
+                            result="primary" if results[0] is primary else "hedge",
+                        )
+                    if discard is not None:
+                        for task in results[1:]:
+                            await discard(task.result())
+                    return results[0].result()
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if discard is not None:
+                for task in tasks:
+                    try:
+                        result = await task
+                    except BaseException:
+                        continue
+                    await discard(result)
+
+    async def _post(self, backend, admitted, payload):
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(backend.url, json=payload)
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPError as e:
+            self.pool.release(backend, admitted, overloaded=is_retryable(e), failed=True)
+            raise
+        except ValueError:
+            self.pool.release(backend, admitted, failed=True)
+            raise
+        except BaseException:
+            self.pool.release(backend, admitted)
+            raise
+        self.pool.release(backend, admitted, latency=time.perf_counter() - started)
+        return data
+
+    async def generate(self, payload: dict) -> dict:
+        """
+        Sends a non-streamed generation request.
+
+        Args:
+            payload (dict): The request payload.
+
+        Returns:
+            dict: The decoded response.
+
+        Raises:
+            httpx.HTTPError: If the last attempt failed.
+        """
+        self.budget.deposit()
+        avoid = None
+        for attempt in itertools.count():
+            backend, admitted = await self.pool.acquire(avoid)
+            try:
+                return await self._hedged(self._post, backend, admitted, payload)
+            except httpx.HTTPError as e:
+                if not await self._retry(e, attempt):
+                    raise
+                avoid = backend
+
+    async def _messages(self, backend, admitted, payload):
+        started = time.perf_counter()
+        latency = None
+        try:
+            async with self._client.stream("POST", backend.url, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    if latency is None:
+                        latency = time.perf_counter() - started
+                    yield message
+                    if message.get("done"):
+                        break
+        except httpx.HTTPError as e:
+            self.pool.release(backend, admitted, overloaded=is_retryable(e), failed=True)
+            raise
+        except ValueError:
+            self.pool.release(backend, admitted, failed=True)
+            raise
+        except BaseException:
+            self.pool.release(backend, admitted)
+            raise
+        self.pool.release(backend, admitted, latency=latency)
+
+    async def _open_stream(self, backend, admitted, payload):
+        messages = self._messages(backend, admitted, payload)
+        try:
+            return messages, await messages.__anext__()
+        except StopAsyncIteration:
+            return messages, None
+        except BaseException:
+            await messages.aclose()
+            raise
+
+    @staticmethod
+    async def _close_stream(opened):
+        await opened[0].aclose()
+
+    async def stream(self, payload: dict):
+        """
+        Sends a streamed generation request.
+
+        A request that fails before its first message is retried; once
+        messages have been yielded, a failure is raised to the caller.
+        The latency used to adapt the concurrency, balance the backends and
+        hedge is the time to the first message, which grows as soon as
+        requests queue on a server.
+
+        Args:
+            payload (dict): The request payload, with "stream" set.
+
+        Yields:
+            dict: The decoded messages, up to the one with "done" set.
+
+        Raises:
+            httpx.HTTPError: If the request failed.
+            ValueError: If a message is not valid JSON.
+        """
+        self.budget.deposit()
+        avoid = None
+        for attempt in itertools.count():
+            backend, admitted = await self.pool.acquire(avoid)
+            try:
+                messages, first = await self._hedged(
+                    self._open_stream, backend, admitted, payload, self._close_stream
+                )
+            except httpx.HTTPError as e:
+                if not await self._retry(e, attempt):
+                    raise
+                avoid = backend
+                continue
+            try:
+                if first is not None:
+                    yield first
+                    async for message in messages:
+                        yield message
+            finally:
+                await messages.aclose()
+            return
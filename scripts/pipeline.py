@@ -0,0 +1,264 @@
+import asyncio
+import functools
+import itertools
+import os
+import time
+from typing import Callable, NamedTuple, Optional
+
+from scripts import caching, metrics, similarity
+from scripts.assets import DEFAULT_PROFILE
+from scripts.exporters import DEFAULT_FORMAT, export
+from scripts.extract_text import PROJECT_ROOT, iter_input_chunks
+from scripts.flashcards import flashcards_from_data, load_flashcards
+from scripts.generate_flashcards import API_URL, agenerate, iter_flashcards
+from scripts.ollama_client import DEFAULT_RETRIES, DEFAULT_TIMEOUT, OllamaClient
+from scripts.streams import buffered
+
+# Number of chunks and chunk results buffered between two stages
+DEFAULT_BUFFER_SIZE = 16
+
+
+def run_pipeline(
+    input_path,
+    output_path,
+    output_pptx_name,
+    title,
+    token_budget,
+    overlap_tokens=0,
+    workers=1,
+    incremental=True,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    quality=DEFAULT_PROFILE,
+    shard_size=None,
+    merge=False,
+    export_format=DEFAULT_FORMAT,
+    manifest_path=None,
+    **generate_options,
+):
+    """
+    Runs extraction, generation and presentation creation as one streaming
+    pipeline: chunks and flashcards are passed between the stages in memory
+    through bounded buffers, so no intermediate text or JSON files are read
+    back and memory stays flat regardless of the corpus size.
+
+    Args:
+        input_path (str): The path to the input file or directory.
+        output_path (str): The path where the output presentation will be saved.
+        output_pptx_name (str): The name of the output file.
+        title (str): The title of the presentation.
+        token_budget (int): The estimated number of tokens in each chunk.
+        overlap_tokens (int, optional): The number of tokens repeated between chunks.
+        workers (int, optional): The number of extraction and shard rendering
+            processes. Defaults to 1.
+        incremental (bool, optional): If True, unchanged documents are served from the
+            manifest. Defaults to True.
+        buffer_size (int, optional): The number of items buffered between stages.
+        quality (str, optional): The image quality profile of the presentation.
+        shard_size (int, optional): If set, render shards of this many flashcards
+            in parallel with `create_presentation.create_sharded()`.
+        merge (bool, optional): Merge the shards into a single presentation.
+        export_format (str, optional): The output format, one of
+            `exporters.EXPORTERS`. Defaults to "pptx".
+        manifest_path (str, optional): The extraction manifest. Defaults to `manifest.db`.
+        **generate_options: Passed to `generate_flashcards.iter_flashcards()`.
+
+    Returns:
+        str or List[str]: The path of the saved file (the paths of the shards when
+            sharding), or None if no flashcards were generated.
+    """
+    chunks = buffered(
+        iter_input_chunks(
+            input_path, token_budget, overlap_tokens, workers, incremental, manifest_path
+        ),
+        buffer_size,
+    )
+    flashcards = iter_flashcards(chunks, buffer_size=buffer_size, **generate_options)
+
+    first = next(flashcards, None)
+    if first is None:
+        print("No flashcards generated.")
+        return None
+    flashcards = itertools.chain([first], flashcards)
+    render_options = {}
+    if export_format == "pptx":
+        render_options = dict(
+            quality=quality, shard_size=shard_size, workers=workers, merge=merge
+        )
+    return export(
+        export_format,
+        os.path.join(output_path, output_pptx_name),
+        flashcards,
+        title,
+        **render_options,
+    )
+
+
+class Deck(NamedTuple):
+    input_path: str
+    output_file_path: str
+    title: str
+
+
+class WarmPipeline:
+    """
+    Builds decks with state that stays resident between builds: the
+    flashcard cache, its similarity index and the generation client with its
+    connections and concurrency limits. Builds run on the event loop of the
+    caller and can run concurrently, sharing the client's concurrency limit.
+    Unchanged documents are served from the extraction manifest and unchanged
+    chunks from the in-memory cache, so a rebuild only extracts and generates
+    what changed. Rendering runs in a thread, which keeps the images loaded
+    once per process.
+
+    Use it as an async context manager.
+
+    Args:
+        token_budget (int): The estimated number of tokens in each chunk.
+        overlap_tokens (int, optional): The number of tokens repeated between chunks.
+        workers (int, optional): The number of extraction processes. Defaults to 1.
+        export_format (str, optional): The default output format. Defaults to "pptx".
+        render_options (dict, optional): Format-specific export options.
+        output_path (str, optional): The directory of the cached flashcard files.
+            Defaults to `extracted_json/`.
+        cache_db_path (str, optional): The cache database. Defaults to `cache.db`.
+        manifest_path (str, optional): The extraction manifest. Defaults to `manifest.db`.
+        See `generate_flashcards.generate()` for the other arguments.
+    """
+
+    def __init__(
+        self,
+        token_budget: int,
+        overlap_tokens: int = 0,
+        workers: int = 1,
+        export_format: str = DEFAULT_FORMAT,
+        render_options: dict = None,
+        output_path: str = None,
+        cache_db_path: str = None,
+        manifest_path: str = None,
+        model=None,
+        concurrency=1,
+        stream=False,
+        cache_max_bytes=caching.DEFAULT_MAX_BYTES,
+        cache_max_age=None,
+        options=None,
+        similarity_threshold=similarity.DEFAULT_THRESHOLD,
+        transport=None,
+        refresh=False,
+        adaptive=False,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backends=None,
+        hedge=None,
+    ):
+        self.token_budget = token_budget
+        self.overlap_tokens = overlap_tokens
+        self.workers = workers
+        self.export_format = export_format
+        self.render_options = render_options or {}
+        self.manifest_path = manifest_path
+        self.output_path = output_path or os.path.join(PROJECT_ROOT, "extracted_json")
+        os.makedirs(self.output_path, exist_ok=True)
+        self.generate_options = dict(
+            model=model, stream=stream, options=options, refresh=refresh
+        )
+        self.store = caching.CacheStore(
+            cache_db_path or os.path.join(PROJECT_ROOT, "cache.db"),
+            cache_max_bytes,
+            cache_max_age,
+        )
+        self.index = None
+        if similarity_threshold and similarity_threshold > 0:
+            self.index = similarity.SimilarityIndex(self.store, similarity_threshold)
+        self.client = OllamaClient(
+            backends or API_URL, concurrency, adaptive, timeout, retries, transport, hedge
+        )
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        try:
+            await self.client.aclose()
+        finally:
+            self.store.close()
+
+    async def build(
+        self,
+        deck: Deck,
+        export_format: str = None,
+        progress: Optional[Callable[[str, int, Optional[int]], None]] = None,
+    ):
+        """
+        Extracts, generates and exports one deck.
+
+        Args:
+            deck (Deck): The deck to build.
+            export_format (str, optional): The output format. Defaults to the
+                pipeline's format.
+            progress (Callable, optional): Called with the stage, the number of
+                chunks done and the number of chunks (None until extraction has
+                finished) as the build advances.
+
+        Returns:
+            The path(s) of the written file(s), or None if no flashcards were generated.
+        """
+        report = progress or (lambda stage, done, total: None)
+        started = time.perf_counter()
+        total = None
+
+        def counted(chunks):
+            nonlocal total
+            count = 0
+            for count, chunk in enumerate(chunks, 1):
+                yield chunk
+            total = count
+
+        # Entries stay pinned until this build ends, whatever other builds do
+        try:
+            with self.store.pins():
+                report("extract", 0, None)
+                chunks = iter_input_chunks(
+                    deck.input_path,
+                    self.token_budget,
+                    self.overlap_tokens,
+                    self.workers,
+                    manifest_path=self.manifest_path,
+                )
+                flashcards = []
+                results = agenerate(
+                    counted(chunks),
+                    self.output_path,
+                    self.store,
+                    index=self.index,
+                    client=self.client,
+                    **self.generate_options,
+                )
+                done = 0
+                async for output_file, data in results:
+                    if data is not None:
+                        flashcards.extend(flashcards_from_data(data))
+                    elif os.path.exists(output_file):
+                        flashcards.extend(load_flashcards([output_file]))
+                    done += 1
+                    report("generate", done, total)
+        finally:
+            self.store.evict()
+        if not flashcards:
+            print(f"No flashcards generated for {deck.input_path}.")
+            return None
+        report("export", done, total)
+        export_format = export_format or self.export_format
+        result = await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                export,
+                export_format,
+                deck.output_file_path,
+                flashcards,
+                deck.title,
+                **(self.render_options if export_format == self.export_format else {}),
+            ),
+        )
+        metrics.observe("deck_build_seconds", time.perf_counter() - started)
+        return result
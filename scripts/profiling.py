@@ -0,0 +1,196 @@
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Counter, Iterable, List, Tuple
+
+# Stages that can be profiled; "pipeline" covers the whole --pipeline run
+STAGES = ("extract", "generate", "export", "pipeline")
+# Seconds between two stack samples
+DEFAULT_INTERVAL = 0.005
+# Number of hotspots listed per table of the summary
+DEFAULT_TOP = 20
+# Frames kept per traced allocation
+TRACEMALLOC_FRAMES = 10
+# Helper threads that only ever sleep, e.g. tqdm's refresh monitor
+IGNORED_THREAD_TYPES = ("TMonitor",)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{module}.{name}:{code.co_firstlineno}"
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of every other thread of the process at a fixed
+    interval, from a background thread.
+
+    This is a wall-clock profile: threads waiting on the network or on a lock
+    are sampled too, so HTTP waits show up as time spent in `selectors` or
+    `ssl` frames. Stacks are counted by thread name and frame, in the
+    collapsed format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples: Counter[Tuple[str, ...]] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            threads = threading.enumerate()
+            names = {thread.ident: thread.name for thread in threads}
+            ignored = {threading.get_ident()} | {
+                thread.ident
+                for thread in threads
+                if type(thread).__name__ in IGNORED_THREAD_TYPES
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in ignored:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[tuple(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def hotspots(self, top: int = DEFAULT_TOP) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """
+        Returns the `top` functions by samples in the function itself (self)
+        and by samples anywhere below it on the stack (total).
+        """
+        own, total = collections.Counter(), collections.Counter()
+        for stack, count in self.samples.items():
+            if len(stack) > 1:
+                own[stack[-1]] += count
+            for label in set(stack[1:]):
+                total[label] += count
+        return own.most_common(top), total.most_common(top)
+
+
+def _allocation_filters() -> List[tracemalloc.Filter]:
+    return [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+
+
+class StageProfiler:
+    """
+    Profiles selected stages of a run, each into its own files in `output_dir`:
+
+    - `<stage>.collapsed`: the sampled stacks (see `StackSampler`).
+    - `<stage>.tracemalloc`: the memory still allocated at the end of the
+      stage, by allocation site; load it with `tracemalloc.Snapshot.load()`.
+    - `<stage>-hotspots.txt`: the top functions by self and total samples and
+      the top allocation sites.
+
+    Stages that were not selected run without any profiling overhead. Only
+    the current process is profiled, not the extraction or rendering worker
+    processes.
+    """
+
+    def __init__(
+        self,
+        stages: Iterable[str],
+        output_dir: str,
+        interval: float = DEFAULT_INTERVAL,
+        memory: bool = True,
+        top: int = DEFAULT_TOP,
+    ):
+        self.stages = set(stages)
+        self.output_dir = output_dir
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Profiles the block as stage `name` if that stage was selected.
+        """
+        if name not in self.stages:
+            yield
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        sampler = StackSampler(self.interval)
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            elapsed = time.perf_counter() - started
+            snapshot = peak = None
+            if self.memory:
+                snapshot = tracemalloc.take_snapshot().filter_traces(_allocation_filters())
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self._write(name, sampler, snapshot, peak, elapsed)
+
+    def _write(self, name, sampler, snapshot, peak, elapsed):
+        base = os.path.join(self.output_dir, name)
+        sampler.write_collapsed(base + ".collapsed")
+        own, total = sampler.hotspots(self.top)
+        samples = sum(sampler.samples.values())
+        share = max(samples, 1)
+
+        lines = [
+            f"Stage: {name}",
+            f"Wall time: {elapsed:.2f} s, {samples} samples every {self.interval * 1000:g} ms",
+            "",
+            "Samples by thread:",
+        ]
+        threads = collections.Counter()
+        for stack, count in sampler.samples.items():
+            threads[stack[0]] += count
+        lines.extend(f"{count:8d} {count / share:6.1%}  {name}" for name, count in threads.most_common())
+        lines.extend(["", f"Top {self.top} functions by self samples:"])
+        lines.extend(f"{count:8d} {count / share:6.1%}  {label}" for label, count in own)
+        lines.extend(["", f"Top {self.top} functions by total samples:"])
+        lines.extend(f"{count:8d} {count / share:6.1%}  {label}" for label, count in total)
+        if snapshot is not None:
+            snapshot.dump(base + ".tracemalloc")
+            lines.extend([
+                "",
+                f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB",
+                f"Top {self.top} allocation sites still allocated at the end of the stage:",
+            ])
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  "
+                    f"{frame.filename}:{frame.lineno}"
+                )
+
+        with open(base + "-hotspots.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"Profile of stage {name} saved to {base}.* ({samples} samples)")
+        for label, count in own[:5]:
+            print(f"  {count / share:6.1%}  {label}")
@@ -0,0 +1,191 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from scripts import caching
+
+
+def request_key(payload: dict) -> str:
+    """
+    Identifies a generation request by its prompt, model, options, format and
+    whether the response is streamed.
+    """
+    return caching.cache_key(
+        payload.get("prompt", ""),
+        model=payload.get("model"),
+        options=payload.get("options"),
+        format=payload.get("format"),
+        stream=bool(payload.get("stream")),
+    )
+
+
+def load_archive(archive_path: str) -> Dict[str, dict]:
+    """
+    Reads a recorded archive. Later records of a request replace earlier
+    ones; a record truncated by an interrupted run is ignored.
+
+    Args:
+        archive_path (str): The gzip-compressed JSON lines archive.
+
+    Returns:
+        Dict[str, dict]: The records, by request key.
+    """
+    records = {}
+    try:
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                records[record["key"]] = record
+    except (EOFError, gzip.BadGzipFile):
+        pass
+    return records
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """
+    Passes a response body through, noting when each line arrived.
+    """
+
+    def __init__(self, stream, started, on_complete):
+        self._stream = stream
+        self._started = started
+        self._on_complete = on_complete
+        self._events: List[Tuple[float, str]] = []
+        self._buffer = b""
+        self._finished = False
+
+    def _note(self, data: bytes):
+        self._events.append(
+            (round(time.perf_counter() - self._started, 3), data.decode("utf-8", "replace"))
+        )
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._buffer += chunk
+            cut = self._buffer.rfind(b"\n") + 1
+            if cut:
+                self._note(self._buffer[:cut])
+                self._buffer = self._buffer[cut:]
+            yield chunk
+        self._finished = True
+
+    async def aclose(self):
+        if self._buffer:
+            self._note(self._buffer)
+            self._buffer = b""
+        # Streamed responses are usually closed right after the "done" line
+        if self._finished or self._ends_with_done():
+            self._on_complete(self._events)
+        await self._stream.aclose()
+
+    def _ends_with_done(self) -> bool:
+        lines = "".join(text for _, text in self._events[-1:]).strip().splitlines()
+        try:
+            return bool(lines) and json.loads(lines[-1]).get("done") is True
+        except ValueError:
+            return False
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that forwards requests and appends each successful
+    /api/generate response, with the time each line of it arrived, to a
+    gzip-compressed JSON lines archive. Prompts are stored by hash only.
+    """
+
+    def __init__(self, archive_path: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.archive_path = archive_path
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        archive_dir = os.path.dirname(archive_path)
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+        self._archive = gzip.open(archive_path, "at", encoding="utf-8")
+        self.recorded = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        if response.status_code != 200 or not request.url.path.endswith("/api/generate"):
+            return response
+        payload = json.loads(request.content)
+
+        def on_complete(events):
+            self._archive.write(json.dumps({
+                "key": request_key(payload),
+                "model": payload.get("model"),
+                "options": payload.get("options"),
+                "stream": bool(payload.get("stream")),
+                "prompt_sha256": caching.generate_sha256(payload.get("prompt", "")),
+                "content_type": response.headers.get("content-type"),
+                "elapsed": round(time.perf_counter() - started, 3),
+                "events": events,
+            }) + "\n")
+            self.recorded += 1
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, started, on_complete),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        self._archive.close()
+        await self._transport.aclose()
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, events, speed):
+        self._events = events
+        self._speed = speed
+
+    async def __aiter__(self):
+        started = time.perf_counter()
+        for offset, text in self._events:
+            if self._speed:
+                delay = offset / self._speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield text.encode("utf-8")
+
+    async def aclose(self):
+        pass
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that serves /api/generate responses from an archive
+    written by RecordingTransport, without any network access.
+
+    Responses are replayed with their recorded timing divided by `speed`
+    (0 serves them instantly). Requests that were not recorded get a 404
+    response, which the generator reports as a failed chunk.
+    """
+
+    def __init__(self, archive_path: str, speed: float = 1.0):
+        self.records = load_archive(archive_path)
+        self.speed = speed
+        self.misses = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content or b"{}")
+        record = self.records.get(request_key(payload))
+        if record is None:
+            self.misses += 1
+            return httpx.Response(
+                404,
+                json={"error": f"no recorded response for model {payload.get('model')!r}"},
+            )
+        return httpx.Response(
+            200,
+            headers={"content-type": record.get("content_type") or "application/json"},
+            stream=_ReplayStream(record["events"], self.speed),
+        )
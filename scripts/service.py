@@ -0,0 +1,410 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from scripts import metrics
+from scripts.exporters import DEFAULT_FORMAT, EXPORTERS, output_file_name
+from scripts.extract_text import SUPPORTED_EXTENSIONS
+from scripts.pipeline import Deck, WarmPipeline
+
+DEFAULT_PORT = 8750
+# Jobs processed at once; they share the generation client's concurrency
+DEFAULT_JOB_WORKERS = 2
+# Queued jobs beyond which uploads are refused with 503
+MAX_QUEUED_JOBS = 100
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+# Bytes read from an upload at a time
+UPLOAD_BLOCK_SIZE = 1 << 20
+JOB_FIELDS = (
+    "id", "status", "title", "format", "filename", "stage", "chunks_done",
+    "chunks_total", "error", "created_at", "started_at", "finished_at",
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Persistent queue of generation jobs, in SQLite.
+
+    Jobs are claimed in submission order. Jobs that were running when the
+    service stopped are queued again when it restarts. The queue keeps a
+    single connection and is safe to share between threads.
+    """
+
+    def __init__(self, db_path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT,
+                title TEXT,
+                format TEXT,
+                filename TEXT,
+                input_path TEXT,
+                output_path TEXT,
+                stage TEXT,
+                chunks_done INTEGER DEFAULT 0,
+                chunks_total INTEGER,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+        ''')
+        self.conn.execute('''
+            UPDATE jobs SET status = 'queued', stage = NULL, chunks_done = 0
+            WHERE status = 'running'
+        ''')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def add(self, **fields) -> dict:
+        fields.update(status="queued", created_at=time.time())
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO jobs ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                tuple(fields.values()),
+            )
+        return self.get(fields["id"])
+
+    def claim(self) -> Optional[dict]:
+        """
+        Marks the oldest queued job as running.
+
+        Returns:
+            dict or None: The job, or None if no job is queued.
+        """
+        with self.lock:
+            row = self.conn.execute('''
+                SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid LIMIT 1
+            ''').fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+        return self.get(row["id"])
+
+    def update(self, job_id: str, **fields):
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def jobs(self, limit: int = 100) -> List[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, status: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+
+def job_document(job: dict) -> dict:
+    """
+    Returns the public fields of a job, with the URL of its result once done.
+    """
+    document = {field: job[field] for field in JOB_FIELDS}
+    if job["status"] == "done":
+        document["result"] = f"/jobs/{job['id']}/result"
+    return document
+
+
+class JobService:
+    """
+    Runs uploaded documents through one shared `WarmPipeline`.
+
+    Uploads are written to `jobs_dir` and queued in a persistent `JobQueue`;
+    `job_workers` jobs run at once on the service's event loop, sharing the
+    flashcard cache and the generation client, whose concurrency limit
+    applies across all of them. Uploads beyond `max_queued` waiting jobs are
+    refused, which pushes back on clients instead of growing the queue
+    without bound.
+
+    Args:
+        pipeline (WarmPipeline): The pipeline building the decks.
+        jobs_dir (str): The directory of the job queue, uploads and results.
+        job_workers (int, optional): The number of jobs processed at once.
+        max_queued (int, optional): The maximum number of queued jobs.
+        max_upload_bytes (int, optional): The maximum size of an upload.
+    """
+
+    def __init__(
+        self,
+        pipeline: WarmPipeline,
+        jobs_dir: str,
+        job_workers: int = DEFAULT_JOB_WORKERS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        max_upload_bytes: int = MAX_UPLOAD_BYTES,
+    ):
+        self.pipeline = pipeline
+        self.jobs_dir = jobs_dir
+        self.job_workers = max(1, job_workers)
+        self.max_queued = max_queued
+        self.max_upload_bytes = max_upload_bytes
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.queue = JobQueue(os.path.join(jobs_dir, "jobs.db"))
+        self.loop = None
+        self.server = None
+        self._wakeup = None
+
+    def submit(self, filename: str, body, length: int, title: str = None, export_format: str = None) -> dict:
+        """
+        Stores an upload and queues a job for it. Called from request threads.
+
+        Args:
+            filename (str): The name of the uploaded document.
+            body: A binary file object to read the document from.
+            length (int): The size of the document in bytes.
+            title (str, optional): The title of the deck. Defaults to the file name.
+            export_format (str, optional): The output format. Defaults to the
+                pipeline's format.
+
+        Raises:
+            ValueError: If the upload is invalid.
+            QueueFull: If too many jobs are waiting.
+
+        Returns:
+            dict: The queued job.
+        """
+        filename = os.path.basename(filename or "")
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Unsupported file {filename!r}, expected one of {', '.join(SUPPORTED_EXTENSIONS)}.")
+        export_format = export_format or self.pipeline.export_format or DEFAULT_FORMAT
+        if export_format not in EXPORTERS:
+            raise ValueError(f"Unknown format {export_format!r}, expected one of {', '.join(EXPORTERS)}.")
+        if length > self.max_upload_bytes:
+            raise ValueError(f"Upload of {length} bytes exceeds {self.max_upload_bytes} bytes.")
+        if self.queue.count("queued") >= self.max_queued:
+            raise QueueFull(f"{self.max_queued} jobs are already queued.")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        input_path = os.path.join(job_dir, "input")
+        os.makedirs(input_path)
+        safe_stem = re.sub(r"[^\w.-]+", "_", stem).strip("._") or "document"
+        try:
+            with open(os.path.join(input_path, safe_stem + extension.lower()), "wb") as f:
+                remaining = length
+                while remaining:
+                    block = body.read(min(UPLOAD_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise ValueError("Upload ended before Content-Length bytes.")
+                    f.write(block)
+                    remaining -= len(block)
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        job = self.queue.add(
+            id=job_id,
+            title=title or stem,
+            format=export_format,
+            filename=filename,
+            input_path=input_path,
+            output_path=os.path.join(job_dir, output_file_name(safe_stem, export_format)),
+        )
+        metrics.inc("jobs_total", status="queued")
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+        return job
+
+    async def _worker(self):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        print(f"Job {job_id}: building {job['filename']}")
+
+        def progress(stage, done, total):
+            self.queue.update(job_id, stage=stage, chunks_done=done, chunks_total=total)
+
+        deck = Deck(job["input_path"], job["output_path"], job["title"])
+        try:
+            result = await self.pipeline.build(deck, job["format"], progress)
+            if result is None:
+                raise ValueError("No flashcards generated.")
+            if isinstance(result, list):
+                result = self._zip(job["output_path"], result)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.queue.update(job_id, status="failed", error=str(e), finished_at=time.time())
+            metrics.inc("jobs_total", status="failed")
+            return
+        self.queue.update(
+            job_id, status="done", stage=None, output_path=result, finished_at=time.time()
+        )
+        metrics.inc("jobs_total", status="done")
+        metrics.observe("job_seconds", time.time() - job["created_at"])
+        print(f"Job {job_id}: done")
+
+    @staticmethod
+    def _zip(output_path: str, paths: List[str]) -> str:
+        zip_path = os.path.splitext(output_path)[0] + ".zip"
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+        return zip_path
+
+    async def run(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        """
+        Serves the HTTP API and processes jobs until cancelled, e.g. by SIGTERM.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            self.loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        server = self.server = ThreadingHTTPServer((host, port), JobRequestHandler)
+        server.daemon_threads = True
+        server.service = self
+        async with self.pipeline:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            print(f"Serving on http://{host}:{server.server_address[1]}/jobs")
+            workers = [asyncio.ensure_future(self._worker()) for _ in range(self.job_workers)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                server.shutdown()
+                server.server_close()
+                for worker in workers:
+                    worker.cancel()
+                self.queue.close()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of a `JobService`:
+
+    - `POST /jobs?filename=NAME[&title=TITLE][&format=FORMAT]` with the document
+      as the request body queues a job and answers 202 with the job.
+    - `GET /jobs` lists the latest jobs, `GET /jobs/ID` returns one with its
+      stage and progress, and `GET /jobs/ID/result` downloads the deck.
+    - `GET /health` and `GET /metrics` (Prometheus text format).
+    """
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status: int = 200, headers: dict = None):
+        self._send(status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            self._send_json({"error": "not found"}, 404)
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            self.close_connection = True
+            self._send_json({"error": "a non-negative integer Content-Length is required"}, 400)
+            return
+        if length > service.max_upload_bytes:
+            self.close_connection = True
+            self._send_json({"error": f"upload exceeds {service.max_upload_bytes} bytes"}, 413)
+            return
+        try:
+            job = service.submit(
+                params.get("filename") or self.headers.get("X-Filename"),
+                self.rfile,
+                length,
+                params.get("title"),
+                params.get("format"),
+            )
+        except QueueFull as e:
+            self.close_connection = True
+            self._send_json({"error": str(e)}, 503, {"Retry-After": "30"})
+            return
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json({"error": str(e)}, 400)
+            return
+        self._send_json(job_document(job), 202, {"Location": f"/jobs/{job['id']}"})
+
+    def do_GET(self):
+        service = self.server.service
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["health"]:
+            self._send_json({"status": "ok", "queued": service.queue.count("queued")})
+        elif parts == ["metrics"]:
+            metrics.set_gauge("jobs_queued", service.queue.count("queued"))
+            self._send(200, metrics.REGISTRY.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        elif parts == ["jobs"]:
+            self._send_json([job_document(job) for job in service.queue.jobs()])
+        elif len(parts) in (2, 3) and parts[0] == "jobs" and parts[2:] in ([], ["result"]):
+            job = service.queue.get(parts[1])
+            if job is None:
+                self._send_json({"error": "job not found"}, 404)
+            elif len(parts) == 2:
+                self._send_json(job_document(job))
+            elif job["status"] != "done":
+                self._send_json({"error": f"job is {job['status']}"}, 409)
+            else:
+                self._send_file(job["output_path"])
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _send_file(self, path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.send_header(
+                "Content-Disposition", f'attachment; filename="{os.path.basename(path)}"'
+            )
+            self.end_headers()
+            while True:
+                block = f.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                self.wfile.write(block)
@@ -0,0 +1,152 @@
+import random
+import re
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+from scripts.caching import CacheStore, generate_sha256
+
+# Default Jaccard similarity above which a cached chunk is reused
+DEFAULT_THRESHOLD = 0.9
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+# LSH banding: BANDS * ROWS must equal NUM_PERMUTATIONS
+BANDS = 16
+ROWS = 4
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240525)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+_WORD = re.compile(r"\w+")
+_SIGNATURE = struct.Struct(f"<{NUM_PERMUTATIONS}Q")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> List[int]:
+    """
+    Hashes the overlapping word n-grams of a text.
+
+    Args:
+        text (str): The text to shingle.
+        size (int): The number of words per shingle.
+
+    Returns:
+        List[int]: The distinct 32-bit shingle hashes.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    return list({
+        zlib.crc32(" ".join(words[i : i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    })
+
+
+def minhash(text: str) -> Tuple[int, ...]:
+    """
+    Computes the MinHash signature of a text's shingles. The fraction of equal
+    positions in two signatures estimates the Jaccard similarity of the texts.
+    """
+    hashes = shingles(text)
+    return tuple(
+        min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS
+    )
+
+
+def similarity(signature: Tuple[int, ...], other: Tuple[int, ...]) -> float:
+    return sum(x == y for x, y in zip(signature, other)) / NUM_PERMUTATIONS
+
+
+def band_buckets(signature: Tuple[int, ...]) -> List[str]:
+    return [
+        generate_sha256(repr(signature[band * ROWS : (band + 1) * ROWS]))[:16]
+        for band in range(BANDS)
+    ]
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index of the chunks in a CacheStore, used to find a cached
+    chunk that is near-identical to a new one, e.g. after a typo fix shifted
+    the chunk boundaries of a re-edited document.
+
+    Signatures are stored in the cache database next to the entries they
+    describe and are dropped when those entries are evicted. Chunks are only
+    compared within the same namespace (model, prompt and options).
+    """
+
+    def __init__(self, store: CacheStore, threshold: float = DEFAULT_THRESHOLD):
+        self.store = store
+        self.threshold = threshold
+        with store.lock:
+            store.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS signatures (
+                    hash TEXT PRIMARY KEY,
+                    namespace TEXT,
+                    signature BLOB
+                );
+                CREATE TABLE IF NOT EXISTS signature_bands (
+                    namespace TEXT,
+                    band INTEGER,
+                    bucket TEXT,
+                    hash TEXT
+                );
+                CREATE INDEX IF NOT EXISTS signature_bands_bucket
+                    ON signature_bands (namespace, band, bucket);
+                CREATE INDEX IF NOT EXISTS signature_bands_hash
+                    ON signature_bands (hash);
+            ''')
+        store.on_delete.append(self.remove)
+
+    def add(self, hash: str, namespace: str, signature: Tuple[int, ...]):
+        with self.store.lock, self.store.batch():
+            self.store.conn.execute('''
+                INSERT OR REPLACE INTO signatures (hash, namespace, signature) VALUES (?, ?, ?)
+            ''', (hash, namespace, _SIGNATURE.pack(*signature)))
+            self.store.conn.execute('DELETE FROM signature_bands WHERE hash = ?', (hash,))
+            self.store.conn.executemany('''
+                INSERT INTO signature_bands (namespace, band, bucket, hash) VALUES (?, ?, ?, ?)
+            ''', [
+                (namespace, band, bucket, hash)
+                for band, bucket in enumerate(band_buckets(signature))
+            ])
+
+    def remove(self, hashes: List[str]):
+        with self.store.lock, self.store.batch():
+            rows = [(hash,) for hash in hashes]
+            self.store.conn.executemany('DELETE FROM signatures WHERE hash = ?', rows)
+            self.store.conn.executemany('DELETE FROM signature_bands WHERE hash = ?', rows)
+
+    def find(self, namespace: str, signature: Tuple[int, ...]) -> Optional[Tuple[str, float]]:
+        """
+        Finds the most similar cached chunk at or above the threshold.
+
+        Args:
+            namespace (str): The namespace the chunk belongs to.
+            signature (Tuple[int, ...]): The MinHash signature of the chunk.
+
+        Returns:
+            tuple or None: (hash, estimated similarity) of the best match.
+        """
+        with self.store.lock:
+            candidates = set()
+            for band, bucket in enumerate(band_buckets(signature)):
+                candidates.update(
+                    hash for (hash,) in self.store.conn.execute('''
+                        SELECT hash FROM signature_bands
+                        WHERE namespace = ? AND band = ? AND bucket = ?
+                    ''', (namespace, band, bucket))
+                )
+            best = None
+            for hash in candidates:
+                row = self.store.conn.execute(
+                    'SELECT signature FROM signatures WHERE hash = ?', (hash,)
+                ).fetchone()
+                if not row:
+                    continue
+                score = similarity(signature, _SIGNATURE.unpack(row[0]))
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (hash, score)
+            return best
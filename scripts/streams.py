@@ -0,0 +1,93 @@
+import asyncio
+import queue
+import threading
+from typing import AsyncIterator, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def buffered(iterable: Iterable[T], maxsize: int = 16) -> Iterator[T]:
+    """
+    Runs an iterable in a background thread, keeping at most `maxsize` items
+    buffered ahead of the consumer. Exceptions raised by the producer are
+    re-raised in the consumer; closing the consumer stops the producer.
+
+    Args:
+        iterable (Iterable[T]): The producer.
+        maxsize (int): The maximum number of buffered items. Defaults to 16.
+
+    Yields:
+        T: The items of the iterable, in order.
+    """
+    items = queue.Queue(maxsize=max(1, maxsize))
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+        else:
+            put(DONE)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+def iterate_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Drives an async generator from synchronous code on a private event loop.
+    Usually wrapped in `buffered()` so the loop runs in a background thread.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def anext_item(iterator: Iterator[T], default=DONE):
+    """
+    Fetches the next item of a blocking iterator without blocking the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None, next, iterator, default
+    )
+
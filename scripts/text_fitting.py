@@ -0,0 +1,132 @@
+import functools
+from typing import Dict, List, Tuple
+
+from PIL import ImageFont
+
+
+def _emu(px: float) -> int:
+    # Same conversion (and rounding) as python-pptx's _rendered_size()
+    return int(px / 72.0 * 914400)
+
+
+class FontMetrics:
+    """
+    Glyph metrics of one font file at one point size. The font is loaded once
+    and the advance width and ink bounds of each glyph are cached, so the
+    rendered width of a line is a sum instead of a new rasterization.
+    """
+
+    def __init__(self, font_file: str, point_size: int):
+        self._font = ImageFont.truetype(font_file, point_size)
+        self._glyphs: Dict[str, Tuple[float, int, int]] = {}
+        self.space = self._font.getlength(" ")
+        # python-pptx measures the line height as the height of "Ty"
+        left, top, right, bottom = self._font.getbbox("Ty")
+        self.line_height = _emu(bottom - top)
+
+    def glyph(self, char: str) -> Tuple[float, int, int]:
+        """
+        Returns the (advance, ink left, ink right) of a character, in pixels.
+        """
+        metrics = self._glyphs.get(char)
+        if metrics is None:
+            left, _, right, _ = self._font.getbbox(char)
+            metrics = self._glyphs[char] = (self._font.getlength(char), left, right)
+        return metrics
+
+    def word(self, word: str) -> Tuple[float, float, float]:
+        """
+        Returns the (advance, left bearing, right overhang) of a word, in pixels.
+        Its inked width is advance - left bearing + right overhang.
+        """
+        first = self.glyph(word[0])
+        last = self.glyph(word[-1])
+        advance = sum(self.glyph(char)[0] for char in word)
+        return advance, first[1], last[2] - last[0]
+
+
+@functools.lru_cache(maxsize=None)
+def font_metrics(font_file: str, point_size: int) -> FontMetrics:
+    return FontMetrics(font_file, point_size)
+
+
+def _line_count(words: List[Tuple[float, float, float]], space: float, width: int) -> int:
+    """
+    Greedily wraps measured words into lines whose inked width in EMU is at
+    most `width`.
+
+    Returns:
+        int: The number of lines, or 0 if a single word is wider than a line.
+    """
+    def fits(advance, left, overhang):
+        return _emu(advance - left + overhang) <= width
+
+    lines = 0
+    current = None
+    for advance, left, overhang in words:
+        if current is not None and fits(current[0] + space + advance, current[1], overhang):
+            current = (current[0] + space + advance, current[1])
+        elif fits(advance, left, overhang):
+            lines += 1
+            current = (advance, left)
+        else:
+            return 0
+    return lines
+
+
+@functools.lru_cache(maxsize=16384)
+def best_fit_font_size(text: str, extents: Tuple[int, int], max_size: int, font_file: str) -> int:
+    """
+    Returns the largest whole-number point size up to `max_size` at which the
+    text, wrapped at word boundaries, fits within the extents.
+
+    Uses the same wrapping rules and measurements as python-pptx's
+    TextFitter, but sums cached glyph metrics instead of rendering every
+    candidate line, and memoizes the result per (text, extents, max_size, font_file).
+
+    Args:
+        text (str): The text to fit.
+        extents (Tuple[int, int]): The available (width, height) in EMU.
+        max_size (int): The largest allowed point size.
+        font_file (str): The path of the TrueType/OpenType font file.
+
+    Returns:
+        int: The best-fit point size, at least 1.
+    """
+    words = text.split()
+    width, height = extents
+
+    def fits(point_size: int) -> bool:
+        metrics = font_metrics(font_file, point_size)
+        lines = _line_count([metrics.word(word) for word in words], metrics.space, width)
+        return 0 < lines and lines * metrics.line_height <= height
+
+    low, high = 1, int(max_size)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def fit_text(text_frame, font_family: str, max_size: int, font_file: str):
+    """
+    Drop-in replacement for `TextFrame.fit_text()` backed by the memoized
+    `best_fit_font_size()`. Falls back to python-pptx if the font cannot be
+    measured or the text frame lacks the APIs below.
+    """
+    if text_frame.text == "":
+        return
+    try:
+        # `fit_text()` is built on these two; they are private python-pptx
+        # APIs: check them when upgrading from the version pinned in
+        # requirements.txt.
+        extents = tuple(text_frame._extents)
+        apply_fit = text_frame._apply_fit
+        font_size = best_fit_font_size(text_frame.text, extents, max_size, font_file)
+    except (AttributeError, OSError):
+        text_frame.fit_text(font_family=font_family, max_size=max_size, font_file=font_file)
+        return
+    apply_fit(font_family, font_size, False, False)
@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import os
+import signal
+import time
+from typing import Dict, List, Tuple
+
+from scripts import metrics
+from scripts.extract_text import list_input_files
+
+# Seconds between two scans of the inputs
+POLL_INTERVAL = 1.0
+# Seconds an input must stay unchanged before its deck is rebuilt
+DEBOUNCE_SECONDS = 2.0
+
+
+def scan(input_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the size and modification time of each supported document at the
+    input path, or nothing if the path does not exist (yet).
+    """
+    state = {}
+    try:
+        file_paths = list_input_files(input_path)
+    except ValueError:
+        return state
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        state[file_path] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
+class Watcher:
+    """
+    Polls input paths for added, modified and removed documents.
+
+    Polling needs no platform-specific file notification API and also works
+    on network shares. Changes are debounced: an input is only reported once
+    it has not changed for `debounce` seconds, so a document that is still
+    being copied, or a batch of documents dropped one after another, triggers
+    a single rebuild.
+    """
+
+    def __init__(self, input_paths: List[str], interval: float = POLL_INTERVAL, debounce: float = DEBOUNCE_SECONDS):
+        self.interval = interval
+        self.debounce = debounce
+        self.state = {input_path: scan(input_path) for input_path in input_paths}
+        self._changed_at = {}
+
+    def poll(self) -> List[str]:
+        """
+        Scans the inputs once.
+
+        Returns:
+            List[str]: The inputs whose changes have settled.
+        """
+        now = time.monotonic()
+        for input_path, state in self.state.items():
+            current = scan(input_path)
+            if current != state:
+                self.state[input_path] = current
+                self._changed_at[input_path] = now
+        settled = [
+            input_path
+            for input_path, changed_at in self._changed_at.items()
+            if now - changed_at >= self.debounce
+        ]
+        for input_path in settled:
+            del self._changed_at[input_path]
+        return settled
+
+    async def changes(self):
+        """
+        Yields the inputs whose changes have settled, forever.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            settled = await loop.run_in_executor(None, self.poll)
+            if settled:
+                yield settled
+
+
+class Daemon:
+    """
+    Keeps the pipeline warm between runs: builds every deck once, then
+    rebuilds the decks whose inputs changed (see `pipeline.WarmPipeline`).
+
+    Args:
+        decks (List[pipeline.Deck]): The decks, each built from one input path.
+        token_budget (int): The estimated number of tokens in each chunk.
+        interval (float, optional): Seconds between two scans of the inputs.
+        debounce (float, optional): Seconds an input must stay unchanged before
+            its deck is rebuilt.
+        **options: See `pipeline.WarmPipeline`.
+    """
+
+    def __init__(
+        self,
+        decks: list,
+        token_budget: int,
+        interval: float = POLL_INTERVAL,
+        debounce: float = DEBOUNCE_SECONDS,
+        **options,
+    ):
+        # Imported here so the CLI can read the defaults above without
+        # loading the generation and rendering stages
+        from scripts.pipeline import WarmPipeline
+
+        self.pipeline = WarmPipeline(token_budget, **options)
+        self.decks = decks
+        self.watcher = Watcher([deck.input_path for deck in decks], interval, debounce)
+
+    async def rebuild(self, decks: list):
+        for deck in decks:
+            print(f"Building {deck.output_file_path} from {deck.input_path}")
+            try:
+                await self.pipeline.build(deck)
+            except Exception as e:
+                metrics.inc("deck_builds_total", result="error")
+                print(f"Failed to build {deck.output_file_path}: {e}")
+            else:
+                metrics.inc("deck_builds_total", result="ok")
+
+    async def run(self):
+        """
+        Builds every deck, then watches the inputs until cancelled, e.g. by
+        SIGTERM.
+        """
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, asyncio.current_task().cancel
+            )
+        async with self.pipeline:
+            await self.rebuild(self.decks)
+            print(f"Watching {', '.join(deck.input_path for deck in self.decks)}")
+            async for changed in self.watcher.changes():
+                await self.rebuild(
+                    [deck for deck in self.decks if deck.input_path in changed]
+                )
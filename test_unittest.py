@@ -3,6 +3,10 @@ import time
 import os
 import scripts.caching as caching  # assuming the functions are in a file named testing.py
 import datetime
+import json
+from scripts.generate_flashcards import FlashcardStreamParser
+from scripts import assets, chunking, exporters, normalize, similarity, streams, text_fitting
+from scripts.flashcards import flashcards_from_data
 
 
 class TestCacheFunctions(unittest.TestCase):
@@ -10,9 +14,10 @@ class TestCacheFunctions(unittest.TestCase):
     def setUp(self):
         self.cache_db_path = 'test_cache.db'  # path to your test database
         caching.init_cache_db(self.cache_db_path)
-        self.test_data = None
-        with open('extracted_data/output_0.txt') as f:
-            self.test_data = f.read().strip()
+        self.test_data = (
+            'Photosynthesis converts light energy into chemical energy stored in glucose. '
+            'It takes place in the chloroplasts of plant cells.'
+        )
         
         with open("test_path", "w") as f:
             f.write("test")
@@ -59,23 +64,32 @@ class TestCacheFunctions(unittest.TestCase):
         size = caching.get_cache_size(self.cache_db_path)
         self.assertEqual(size, 10)
     
-    def test_cache_size_limit(self):
-        # Add entries until the cache size limit is reached
-        for i in range(10):
-            caching.add_file_path_to_cache(self.cache_db_path, caching.generate_sha256(f'test_hash_{i}'), 'test_path')
-        
-        # Check that the cache size is 10
-        result = caching.get_cache(self.cache_db_path)
-        self.assertEqual(len(result), 10)
-        
-        # Add another entry
-        caching.add_file_path_to_cache(self.cache_db_path, caching.generate_sha256('test_hash_10'), 'test_path')
-        
-        # Check that the cache size is still 10
-        result = caching.get_cache(self.cache_db_path)
-        self.assertEqual(len(result), 10)
+    def test_cache_byte_limit(self):
+        # Each entry refers to a 4 byte file; allow room for 10 of them
+        with caching.CacheStore(self.cache_db_path, max_bytes=40) as store:
+            for i in range(10):
+                store.add(caching.generate_sha256(f'test_hash_{i}'), 'test_path')
+            self.assertEqual(store.size(), 10)
+            self.assertEqual(store.total_bytes, 40)
+
+        # A new run does not pin the old entries, so the oldest one is evicted
+        with caching.CacheStore(self.cache_db_path, max_bytes=40) as store:
+            store.add(caching.generate_sha256('test_hash_10'), 'test_path')
+            self.assertEqual(store.size(), 10)
+            self.assertIsNone(store.get(caching.generate_sha256('test_hash_0')))
+        # the file is still referenced by other entries, so it is kept
+        self.assertTrue(os.path.exists('test_path'))
+
+    def test_pinned_entries_are_not_evicted(self):
+        with caching.CacheStore(self.cache_db_path, max_bytes=8) as store:
+            for i in range(5):
+                store.add(f'test_hash_{i}', 'test_path')
+            # every entry is used by the current run
+            self.assertEqual(store.size(), 5)
+            store.release()
+            store.evict()
+            self.assertEqual(store.size(), 2)
 
-    
     def test_delete_oldest_entry(self):
         # Add an entry with a known timestamp
         
@@ -123,5 +137,895 @@ class TestCacheFunctions(unittest.TestCase):
 
         self.assertEqual(result, 4)
 
+    def test_memory_tier(self):
+        with caching.CacheStore(self.cache_db_path, memory_size=2) as store:
+            for i in range(3):
+                store.add(f'test_hash_{i}', 'test_path')
+            self.assertEqual(len(store.memory), 2)
+            self.assertIsNone(store.memory.get('test_hash_0'))
+            # served from SQLite, then promoted to the memory tier
+            self.assertEqual(store.get('test_hash_0'), 'test_path')
+            self.assertEqual(store.memory.get('test_hash_0'), 'test_path')
+
+    def test_cache_key_covers_model_and_options(self):
+        key = caching.cache_key(self.test_data, model='llama3', options={})
+        self.assertEqual(key, caching.cache_key(self.test_data, options={}, model='llama3'))
+        self.assertNotEqual(key, caching.cache_key(self.test_data, model='mistral', options={}))
+        self.assertNotEqual(key, caching.cache_key(self.test_data, model='llama3', options={'temperature': 0}))
+
+    def test_similarity_index(self):
+        words = [f'word{i}' for i in range(800)]
+        text = ' '.join(words)
+        edited = ' '.join(words[:400] + ['typo'] + words[401:])
+        with caching.CacheStore(self.cache_db_path) as store:
+            index = similarity.SimilarityIndex(store, threshold=0.8)
+            store.add('original', 'test_path')
+            index.add('original', 'llama3', similarity.minhash(text))
+
+            match = index.find('llama3', similarity.minhash(edited))
+            self.assertEqual(match[0], 'original')
+            self.assertGreater(match[1], 0.8)
+            self.assertIsNone(index.find('mistral', similarity.minhash(edited)))
+            self.assertIsNone(index.find('llama3', similarity.minhash(' '.join(reversed(words)))))
+
+            # evicting the entry drops its signature
+            store.add('other', 'test_path')
+            store.delete_oldest()
+            self.assertIsNone(index.find('llama3', similarity.minhash(edited)))
+
+
+class TestFlashcardStreamParser(unittest.TestCase):
+
+    def test_cards_emitted_as_they_close(self):
+        parser = FlashcardStreamParser()
+        doc = json.dumps({"flashcards": [
+            {"question": "What is {x}?", "answer": "A \"quoted\" }"},
+            {"question": "Pick one", "options": {"a": 1}, "correct_answer": "a"},
+        ]})
+        emitted = []
+        for i in range(0, len(doc), 3):
+            emitted.append(parser.feed(doc[i:i + 3]))
+        cards = [card for batch in emitted for card in batch]
+        self.assertEqual(len(cards), 2)
+        self.assertEqual(cards[0]["answer"], 'A "quoted" }')
+        # the first card is available before the document is complete
+        self.assertTrue(any(emitted[:len(emitted) // 2]))
+
+    def test_truncated_stream_keeps_complete_cards(self):
+        parser = FlashcardStreamParser()
+        cards = parser.feed('{"flashcards": [{"question": "q1", "answer": "a1"}, {"question": "q2", "ans')
+        self.assertEqual(cards, [{"question": "q1", "answer": "a1"}])
+
+
+class TestChunking(unittest.TestCase):
+
+    def setUp(self):
+        self.pages = [
+            ' '.join(f'Sentence {p}.{i} is about topic {i}.' for i in range(40))
+            + '\n\nA short closing paragraph.'
+            for p in range(5)
+        ]
+
+    def test_chunks_respect_budget_and_sentences(self):
+        chunks = list(chunking.iter_chunks(self.pages, budget=100))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunking.estimate_tokens(chunk), 100)
+            self.assertTrue(chunk.endswith('.'))
+            self.assertTrue(chunk.startswith(('Sentence', 'A short')))
+        # nothing is lost or duplicated without overlap
+        self.assertEqual(
+            sum(chunk.count('Sentence') for chunk in chunks), 5 * 40
+        )
+
+    def test_overlap_repeats_trailing_sentences(self):
+        chunks = list(chunking.iter_chunks(self.pages, budget=100, overlap=20))
+        first_tail = chunks[0].split('. ')[-1]
+        self.assertIn(first_tail, chunks[1])
+
+    def test_overlap_never_exceeds_budget(self):
+        texts = self.pages + ['Short one here. ' * 10 + ' '.join(['Long'] * 70) + '.']
+        for overlap in (20, 50):
+            chunks = list(chunking.iter_chunks(texts, budget=100, overlap=overlap))
+            self.assertTrue(all(chunking.estimate_tokens(c) <= 100 for c in chunks))
+
+    def test_oversized_sentence_is_split_at_words(self):
+        chunks = list(chunking.iter_chunks(['word ' * 1000], budget=50))
+        self.assertTrue(all(chunking.estimate_tokens(c) <= 50 for c in chunks))
+        self.assertEqual(sum(c.count('word') for c in chunks), 1000)
+
+    def test_token_budget_for_model(self):
+        self.assertEqual(chunking.token_budget_for('llama3:8b'), chunking.MAX_CHUNK_TOKENS)
+        self.assertEqual(chunking.token_budget_for('unknown', num_ctx=1200), 500)
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_normalize_text_keeps_unicode(self):
+        text = 'The e\ufb03cient  cata-\nlyst of Jean-\nPaul,\x00 a caf\u00e9 in \u4e2d\u6587:\n\u0394G < 0 \u200b'
+        self.assertEqual(
+            normalize.normalize_text(text),
+            'The efficient catalyst of Jean-Paul, a caf\u00e9 in \u4e2d\u6587: \u0394G < 0',
+        )
+        self.assertEqual(normalize.normalize_text('x\u00b2', form='NFC'), 'x\u00b2')
+
+    def test_strip_repeated_lines(self):
+        pages = [
+            f'Cell Biology - Lecture 3\nPage text {i}: ' + 'mitochondria ' * i + f'\nSee figure {"abcd"[i]}.\n{i + 1}'
+            for i in range(4)
+        ]
+        stripped = normalize.strip_repeated_lines(pages)
+        self.assertEqual(stripped[2], 'Page text 2: mitochondria mitochondria \nSee figure c.')
+        # too few pages to tell headers from content
+        self.assertEqual(normalize.strip_repeated_lines(pages[:2]), pages[:2])
+
+
+class TestStreamingExtraction(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_large_text_files_are_read_in_blocks(self):
+        from scripts.extract_text import iter_text_from_txt
+        text = '\n\n'.join(f'Paragraph {i} about caf\u00e9s.' for i in range(50))
+        blocks = list(iter_text_from_txt(self.write('notes.txt', text), block_size=64))
+        self.assertGreater(len(blocks), 10)
+        self.assertEqual(''.join(blocks), text)
+        self.assertTrue(all(block.startswith('\n\n') for block in blocks[1:]))
+        # without line breaks, blocks are cut between characters
+        text = '\u00e9' * 100
+        self.assertEqual(''.join(iter_text_from_txt(self.write('line.txt', text), block_size=7)), text)
+
+    def test_parallel_extraction_splits_large_files(self):
+        import random
+        from benchmarks.corpus import page_texts, paragraph, write_pdf
+        from scripts import extract_text
+        rng = random.Random(0)
+        pdf_path = os.path.join(self.tmp.name, 'book.pdf')
+        write_pdf(pdf_path, page_texts(rng, extract_text.PDF_PAGES_PER_TASK + 10))
+        paragraphs = [paragraph(rng) for _ in range(100)]
+        txt_path = self.write('dump.txt', '\n\n'.join(paragraphs * (3 * 2**20 // len(''.join(paragraphs)))))
+        blocks_per_task = extract_text.TXT_BLOCKS_PER_TASK
+        extract_text.TXT_BLOCKS_PER_TASK = 1
+        try:
+            parallel = extract_text.extract_files([pdf_path, txt_path], workers=2)
+        finally:
+            extract_text.TXT_BLOCKS_PER_TASK = blocks_per_task
+        self.assertGreater(len(parallel[1]), 2)
+        self.assertEqual(parallel, extract_text.extract_files([pdf_path, txt_path]))
+
+    def test_manifest_records_streamed_documents_once_complete(self):
+        from scripts.manifest import Manifest
+        path = self.write('doc.txt', 'content')
+        with Manifest(os.path.join(self.tmp.name, 'manifest.db')) as manifest:
+            stream = manifest.stream(path, iter(['page 1', 'page 2']))
+            self.assertEqual(next(stream), 'page 1')
+            stream.close()
+            self.assertIsNone(manifest.lookup(path))
+            self.assertEqual(list(manifest.stream(path, iter(['page 1', 'page 2']))), ['page 1', 'page 2'])
+            content_hash = manifest.lookup(path)
+            self.assertEqual(list(manifest.iter_texts(content_hash, batch_size=1)), ['page 1', 'page 2'])
+
+
+class TestStreams(unittest.TestCase):
+
+    def test_buffered_preserves_order(self):
+        self.assertEqual(list(streams.buffered(iter(range(100)), maxsize=3)), list(range(100)))
+
+    def test_buffered_propagates_errors(self):
+        def failing():
+            yield 1
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            list(streams.buffered(failing()))
+
+    def test_iterate_async(self):
+        async def numbers():
+            for i in range(3):
+                yield i
+        self.assertEqual(list(streams.iterate_async(numbers())), [0, 1, 2])
+
+    def test_flashcards_from_data(self):
+        card = {'question': 'q', 'answer': 'a'}
+        self.assertEqual(flashcards_from_data({'flashcards': [card]}), [card])
+        self.assertEqual(flashcards_from_data({'cards': {'items': [card]}}), [card])
+
+
+class TestTextFitting(unittest.TestCase):
+
+    font_file = 'static/MoreSugar.otf'
+
+    def test_matches_python_pptx(self):
+        from pptx.text.layout import TextFitter
+        light = 'Light energy is converted into chemical energy stored in glucose. '
+        mitochondria = 'Mitochondria produce ATP through cellular respiration in eukaryotic cells.'
+        for text, extents, expected in [
+            ('Short', (1828800, 1828800), 44),
+            ('What is the powerhouse of the cell?', (6373385, 5038263), 44),
+            ('Light energy is converted into chemical energy stored in glucose.', (3657600, 1828800), 34),
+            (light * 3, (3657600, 1828800), 18),
+            (light * 3, (6373385, 5038263), 43),
+            (light * 3, (9144000, 1143000), 24),
+            (mitochondria, (3657600, 1828800), 29),
+            (mitochondria, (9144000, 1143000), 41),
+            ('A\nB\nC', (914400, 457200), 25),
+        ]:
+            with self.subTest(text=text[:20], extents=extents):
+                size = text_fitting.best_fit_font_size(text, extents, 44, self.font_file)
+                self.assertEqual(size, TextFitter.best_fit_font_size(text, extents, 44, self.font_file))
+                self.assertEqual(size, expected)
+
+    def test_word_wider_than_box(self):
+        from pptx.text.layout import TextFitter
+        text, extents = 'Pneumonoultramicroscopic', (91440, 914400)
+        # python-pptx cannot break a word that does not fit on a line
+        with self.assertRaises(TypeError):
+            TextFitter.best_fit_font_size(text, extents, 44, self.font_file)
+        self.assertEqual(text_fitting.best_fit_font_size(text, extents, 44, self.font_file), 1)
+
+    def test_falls_back_without_private_apis(self):
+        from unittest import mock
+        text_frame = mock.Mock(spec=['text', 'fit_text'], text='What is the powerhouse of the cell?')
+        text_fitting.fit_text(text_frame, 'More Sugar', 44, self.font_file)
+        text_frame.fit_text.assert_called_once_with(font_family='More Sugar', max_size=44, font_file=self.font_file)
+
+
+class TestAssets(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from PIL import Image
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = assets.ASSET_CACHE_DIR
+        assets.ASSET_CACHE_DIR = os.path.join(self.tmp.name, 'asset_cache')
+        self.img_path = os.path.join(self.tmp.name, 'bg.png')
+        image = Image.new('RGBA', (2000, 1000), (0, 0, 0, 0))
+        image.paste((200, 50, 50, 255), (500, 250, 1500, 750))
+        image.save(self.img_path)
+
+    def tearDown(self):
+        assets.ASSET_CACHE_DIR = self.cache_dir
+        self.tmp.cleanup()
+
+    def test_derived_image_is_sized_for_the_slide_and_cached(self):
+        from PIL import Image
+        slide_width = 18288000
+        path = assets.optimized_image_path(self.img_path, (slide_width // 2, slide_width // 4), slide_width, 'low')
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (640, 320))
+            self.assertEqual(image.format, 'PNG')
+        mtime = os.path.getmtime(path)
+        self.assertEqual(assets.optimized_image_path(self.img_path, (slide_width // 2, slide_width // 4), slide_width, 'low'), path)
+        self.assertEqual(os.path.getmtime(path), mtime)
+        self.assertEqual(assets.optimized_image_path(self.img_path, (slide_width, slide_width), slide_width, 'original'), self.img_path)
+
+
+class TestShardedRendering(unittest.TestCase):
+
+    def test_shards_and_merge(self):
+        import tempfile
+        from pptx import Presentation
+        from scripts.create_presentation import create_sharded
+        cards = [{'question': f'Question {i}?', 'answer': f'Answer {i}'} for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = create_sharded(tmp, 'deck.pptx', cards, quality='original', shard_size=2)
+            self.assertEqual([os.path.basename(path) for path in paths], ['deck_part1.pptx', 'deck_part2.pptx', 'deck_part3.pptx'])
+            self.assertEqual([len(Presentation(path).slides) for path in paths], [4, 4, 3])
+
+            (merged,) = create_sharded(tmp, 'merged.pptx', cards, quality='original', shard_size=2, merge=True)
+            slides = list(Presentation(merged).slides)
+            self.assertEqual(len(slides), 7)
+            texts = [shape.text for slide in slides for shape in slide.shapes if shape.has_text_frame and shape.text]
+            self.assertEqual([text for text in texts if text.startswith('Question')], [card['question'] for card in cards])
+            for slide in slides:
+                for shape in slide.shapes:
+                    if shape.shape_type == 13:
+                        self.assertTrue(shape.image.blob)
+            blobs = [part.blob for part in Presentation(merged).part.package.iter_parts() if part.partname.startswith('/ppt/media/')]
+            self.assertEqual(len(blobs), len(set(blobs)))
+
+    def test_cards_accepted_by_is_flashcard_are_rendered(self):
+        import tempfile
+        from pptx import Presentation
+        from scripts.create_presentation import create_from_flashcards
+        cards = [
+            {'question': 'Multiple choice?', 'options': ['A', 'B'], 'correct_answer': 'A'},
+            {'question': 'No options?', 'correct_answer': 'Yes'},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = create_from_flashcards(tmp, 'deck.pptx', cards, quality='original')
+            texts = [shape.text for slide in Presentation(path).slides for shape in slide.shapes if shape.has_text_frame]
+        self.assertIn('No options?', texts)
+        self.assertIn('Answer: Yes', texts)
+        self.assertIn('A\x0bB\x0b\x0bAnswer: A', texts)
+
+
+class TestExporters(unittest.TestCase):
+
+    cards = [
+        {'question': 'What is ATP?', 'answer': ['An energy carrier', 'made in mitochondria']},
+        {'question': 'Which gas do plants absorb?', 'options': ['O2', 'CO2'], 'correct_answer': 'CO2'},
+        {'title': 'not a flashcard'},
+    ]
+
+    def test_csv(self):
+        import csv
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = exporters.export('csv', os.path.join(tmp, 'deck.csv'), iter(self.cards))
+            with open(path, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(rows, [
+            ['question', 'answer'],
+            ['What is ATP?', 'An energy carrier\nmade in mitochondria'],
+            ['Which gas do plants absorb?', 'O2\nCO2\n\nAnswer: CO2'],
+        ])
+
+    def test_apkg(self):
+        import sqlite3
+        import tempfile
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = exporters.export('apkg', os.path.join(tmp, 'deck.apkg'), iter(self.cards), 'Biology')
+            with zipfile.ZipFile(path) as package:
+                self.assertEqual(sorted(package.namelist()), ['collection.anki2', 'media'])
+                package.extract('collection.anki2', tmp)
+            conn = sqlite3.connect(os.path.join(tmp, 'collection.anki2'))
+            ver, decks = conn.execute('SELECT ver, decks FROM col').fetchone()
+            notes = conn.execute('SELECT flds FROM notes ORDER BY id').fetchall()
+            cards = conn.execute('SELECT did, due FROM cards ORDER BY due').fetchall()
+            conn.close()
+        self.assertEqual(ver, 11)
+        self.assertIn('Biology', [deck['name'] for deck in json.loads(decks).values()])
+        self.assertEqual(notes[0][0], 'What is ATP?\x1fAn energy carrier<br>made in mitochondria')
+        self.assertEqual([due for _, due in cards], [1, 2])
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_corpus_formats_are_extractable(self):
+        import tempfile
+        from benchmarks.corpus import generate_corpus
+        from scripts.extract_text import extract_text_from_file
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = generate_corpus(tmp, documents=4, pages=2)
+            self.assertEqual(sorted(os.path.splitext(path)[1] for path in paths), ['.docx', '.pdf', '.pptx', '.txt'])
+            for path in paths:
+                self.assertGreater(len(''.join(extract_text_from_file(path))), 500)
+
+    def test_fake_ollama(self):
+        from benchmarks.fake_ollama import serve
+        from scripts import generate_flashcards
+        server = serve(latency=0, tokens_per_second=0, cards=3)
+        api_url = generate_flashcards.API_URL
+        generate_flashcards.API_URL = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+        try:
+            data = generate_flashcards.get_flashcards_data('Enzymes lower the activation energy of reactions.')
+            streamed = list(generate_flashcards.stream_flashcards_data('Enzymes lower the activation energy of reactions.'))
+        finally:
+            generate_flashcards.API_URL = api_url
+            server.shutdown()
+        self.assertEqual(len(flashcards_from_data(json.loads(data))), 3)
+        self.assertEqual(streamed, flashcards_from_data(json.loads(data)))
+
+    def test_cli_import_defers_stage_dependencies(self):
+        import subprocess
+        import sys
+        heavy = ['pptx', 'pypdf', 'docx2txt', 'httpx', 'requests', 'tqdm', 'PIL', 'asyncio']
+        code = (
+            'import json, sys, flashcard_generator, scripts.extract_text, scripts.assets; '
+            f'print(json.dumps([name for name in {heavy!r} if name in sys.modules]))'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(json.loads(output), [])
+
+
+class TestReplay(unittest.TestCase):
+
+    def generate(self, tmp, chunks, **options):
+        from scripts.generate_flashcards import iter_flashcards
+        return list(iter_flashcards(
+            chunks, model='llama3', similarity_threshold=0, refresh=True,
+            output_path=os.path.join(tmp, 'json'), cache_db_path=os.path.join(tmp, 'cache.db'), **options,
+        ))
+
+    def test_record_and_replay(self):
+        import tempfile
+        from benchmarks.fake_ollama import serve
+        from scripts import generate_flashcards, replay
+        chunks = ['Enzymes lower the activation energy of reactions.', 'Osmosis moves water across membranes.']
+        server = serve(latency=0, tokens_per_second=0, cards=2)
+        api_url = generate_flashcards.API_URL
+        generate_flashcards.API_URL = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, 'responses.jsonl.gz')
+            try:
+                recorded = {
+                    stream: self.generate(tmp, chunks, stream=stream, transport=replay.RecordingTransport(archive))
+                    for stream in (False, True)
+                }
+            finally:
+                generate_flashcards.API_URL = api_url
+                server.shutdown()
+            # The server is gone: every response must come from the archive
+            for stream in (False, True):
+                transport = replay.ReplayTransport(archive, speed=0)
+                self.assertEqual(self.generate(tmp, chunks, stream=stream, transport=transport), recorded[stream])
+                self.assertEqual(transport.misses, 0)
+            self.assertEqual(len(recorded[True]), 4)
+            transport = replay.ReplayTransport(archive, speed=0)
+            self.assertEqual(self.generate(tmp, ['An unrecorded chunk.'], transport=transport), [])
+            self.assertEqual(transport.misses, 1)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_registry(self):
+        from scripts.metrics import Registry
+        registry, worker = Registry(), Registry()
+        for value in (0.003, 0.004, 0.02, 0.2):
+            registry.observe('render_slide_seconds', value)
+        worker.observe('render_slide_seconds', 3.0)
+        worker.inc('cache_lookups_total', result='hit', tier='memory')
+        worker.inc('cache_lookups_total', result='miss', tier='db')
+        registry.merge(json.loads(json.dumps(worker.snapshot())))
+
+        histogram = registry.histograms['render_slide_seconds'][()]
+        self.assertEqual((histogram.count, histogram.min, histogram.max), (5, 0.003, 3.0))
+        self.assertTrue(0.0025 <= histogram.quantile(0.5) <= 0.025)
+        self.assertEqual(registry.summary()['cache_hit_ratio'], 0.5)
+        prometheus = registry.to_prometheus()
+        self.assertIn('flashcard_generator_render_slide_seconds_bucket{le="0.005"} 2\n', prometheus)
+        self.assertIn('flashcard_generator_render_slide_seconds_bucket{le="+Inf"} 5\n', prometheus)
+        self.assertIn('flashcard_generator_cache_lookups_total{result="miss",tier="db"} 1\n', prometheus)
+
+    def test_generation_records_ollama_stats(self):
+        import tempfile
+        from benchmarks.fake_ollama import serve
+        from scripts import generate_flashcards, metrics
+        from scripts.generate_flashcards import iter_flashcards
+        metrics.reset()
+        server = serve(latency=0, tokens_per_second=0, cards=2)
+        api_url = generate_flashcards.API_URL
+        generate_flashcards.API_URL = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                for _ in range(2):
+                    list(iter_flashcards(
+                        ['Enzymes lower the activation energy of reactions.'], model='llama3', stream=True,
+                        output_path=os.path.join(tmp, 'json'), cache_db_path=os.path.join(tmp, 'cache.db'),
+                    ))
+        finally:
+            generate_flashcards.API_URL = api_url
+            server.shutdown()
+        summary = metrics.REGISTRY.summary()
+        self.assertEqual(summary['chunks'], {'generated': 1, 'cache': 1})
+        self.assertGreater(summary['eval_tokens'], 0)
+        self.assertGreater(summary['prompt_tokens'], 0)
+        chunks = metrics.REGISTRY.to_json()['chunks']
+        self.assertEqual([chunk['source'] for chunk in chunks], ['generated', 'cache'])
+        self.assertEqual(chunks[0]['flashcards'], 2)
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_stage_profiles(self):
+        import tempfile
+        import time
+        import tracemalloc
+        from scripts.profiling import StageProfiler
+
+        def busy_loop():
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+            return [bytearray(1024) for _ in range(1000)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            profiler = StageProfiler(['export'], tmp, interval=0.001)
+            with profiler.stage('extract'):
+                busy_loop()
+            with profiler.stage('export'):
+                blocks = busy_loop()
+            self.assertEqual(sorted(os.listdir(tmp)), ['export-hotspots.txt', 'export.collapsed', 'export.tracemalloc'])
+            self.assertFalse(tracemalloc.is_tracing())
+            with open(os.path.join(tmp, 'export.collapsed')) as f:
+                stacks = f.read()
+            self.assertIn('test_unittest.TestProfiling.test_stage_profiles.<locals>.busy_loop', stacks)
+            snapshot = tracemalloc.Snapshot.load(os.path.join(tmp, 'export.tracemalloc'))
+            self.assertGreater(sum(stat.size for stat in snapshot.statistics('filename')), 1024 * len(blocks) // 2)
+
+
+class TestOllamaClient(unittest.TestCase):
+
+    def test_retries(self):
+        import asyncio
+        import httpx
+        from unittest import mock
+        from scripts.ollama_client import OllamaClient
+
+        statuses = [503, 500, 200, 404]
+
+        def handler(request):
+            status = statuses.pop(0)
+            return httpx.Response(status, json={'response': '{}', 'done': True})
+
+        async def run():
+            async with OllamaClient('http://ollama/api/generate', retries=3, transport=httpx.MockTransport(handler)) as client:
+                self.assertEqual((await client.generate({'prompt': 'a'}))['done'], True)
+                with self.assertRaises(httpx.HTTPStatusError):
+                    await client.generate({'prompt': 'b'})
+                return client
+
+        with mock.patch('scripts.ollama_client.backoff_delay', return_value=0):
+            client = asyncio.run(run())
+        self.assertEqual(statuses, [])
+        self.assertEqual(client.pool.backends[0].limiter.in_flight, 0)
+
+    def test_decode_errors_fail_only_their_chunk(self):
+        import tempfile
+        import httpx
+        from scripts import metrics
+        from scripts.generate_flashcards import iter_flashcards
+
+        def handler(request):
+            prompt = json.loads(request.content)['prompt']
+            if 'Broken' in prompt:
+                return httpx.Response(200, content=b'not json')
+            if 'Garbled' in prompt:
+                return httpx.Response(200, json={'response': '{"flashcards": [', 'done': True})
+            card = {'question': 'What is a cell?', 'answer': 'The unit of life.'}
+            return httpx.Response(200, json={'response': json.dumps({'flashcards': [card]}), 'done': True})
+
+        metrics.reset()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = list(iter_flashcards(
+                ['Broken response.', 'Cells are the unit of life.', 'Garbled flashcards.'],
+                model='llama3', concurrency=3, transport=httpx.MockTransport(handler),
+                output_path=os.path.join(tmp, 'json'), cache_db_path=os.path.join(tmp, 'cache.db'),
+            ))
+        self.assertEqual([card['question'] for card in cards], ['What is a cell?'])
+        self.assertEqual(metrics.REGISTRY.summary()['chunks'], {'failed': 2, 'generated': 1})
+        self.assertEqual(
+            metrics.REGISTRY.counters['decode_errors_total'],
+            {(('part', 'response'),): 1, (('part', 'flashcards'),): 1},
+        )
+
+    def test_repeat_of_a_failed_chunk_is_retried(self):
+        import tempfile
+        import httpx
+        from scripts import metrics
+        from scripts.generate_flashcards import iter_flashcards
+
+        sent = []
+
+        def handler(request):
+            sent.append(request)
+            if len(sent) == 1:
+                return httpx.Response(200, json={'response': '{"flashcards": [', 'done': True})
+            card = {'question': 'What is a cell?', 'answer': 'The unit of life.'}
+            return httpx.Response(200, json={'response': json.dumps({'flashcards': [card]}), 'done': True})
+
+        metrics.reset()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = list(iter_flashcards(
+                ['Cells are the unit of life.'] * 4,
+                model='llama3', concurrency=4, transport=httpx.MockTransport(handler),
+                output_path=os.path.join(tmp, 'json'), cache_db_path=os.path.join(tmp, 'cache.db'),
+            ))
+        # The first repeat retries the failed chunk, the others reuse its file
+        self.assertEqual(len(sent), 2)
+        self.assertEqual({card['question'] for card in cards}, {'What is a cell?'})
+        chunks = metrics.REGISTRY.summary()['chunks']
+        self.assertEqual((chunks['failed'], chunks['generated']), (1, 1))
+        self.assertEqual(sum(chunks.values()), 4)
+
+    def test_backend_pool(self):
+        import asyncio
+        import collections
+        import httpx
+        from unittest import mock
+        from scripts.ollama_client import OllamaClient
+
+        hosts = collections.Counter()
+
+        async def handler(request):
+            hosts[request.url.host] += 1
+            if request.url.host == 'down':
+                return httpx.Response(503)
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={'response': '{}', 'done': True})
+
+        backends = [
+            {'url': 'http://a:11434'},
+            {'url': 'http://b:11434', 'weight': 2, 'concurrency': 4},
+            {'url': 'http://down:11434'},
+        ]
+
+        async def run():
+            async with OllamaClient(backends, concurrency=2, transport=httpx.MockTransport(handler)) as client:
+                self.assertEqual(client.capacity, 8)
+                results = await asyncio.gather(*(client.generate({'prompt': str(i)}) for i in range(60)))
+                self.assertTrue(all(result['done'] for result in results))
+                return client
+
+        with mock.patch('scripts.ollama_client.backoff_delay', return_value=0):
+            client = asyncio.run(run())
+        a, b, down = client.pool.backends
+        self.assertEqual(a.url, 'http://a:11434/api/generate')
+        # The failing backend is ejected, the others share the load by weight
+        self.assertFalse(down.healthy)
+        self.assertLessEqual(hosts['down'], 3 + 1)  # plus a request already in flight
+        self.assertGreater(hosts['b'], 1.5 * hosts['a'])
+        self.assertTrue(all(backend.limiter.in_flight == 0 for backend in client.pool.backends))
+
+    def test_hedged_stream(self):
+        import asyncio
+        import httpx
+        from scripts.ollama_client import OllamaClient
+
+        async def handler(request):
+            if request.url.host == 'slow':
+                await asyncio.sleep(5)
+            lines = [{'response': 'a', 'done': False}, {'response': 'b', 'done': True}]
+            return httpx.Response(200, content=''.join(json.dumps(line) + '\n' for line in lines))
+
+        async def run():
+            backends = [{'url': 'http://slow:11434'}, {'url': 'http://fast:11434'}]
+            async with OllamaClient(backends, transport=httpx.MockTransport(handler), hedge=0.05) as client:
+                started = time.perf_counter()
+                messages = [message async for message in client.stream({'prompt': 'a', 'stream': True})]
+                return client, messages, time.perf_counter() - started
+
+        client, messages, elapsed = asyncio.run(run())
+        self.assertEqual([message['response'] for message in messages], ['a', 'b'])
+        self.assertLess(elapsed, 1)
+        self.assertTrue(all(backend.limiter.in_flight == 0 for backend in client.pool.backends))
+
+    def test_aimd_limiter(self):
+        from scripts.ollama_client import AIMDLimiter
+
+        limiter = AIMDLimiter(8, adaptive=True)
+        limits = []
+        for latency in [1.0] * 6 + [5.0]:
+            slots = int(limiter.limit)
+            admitted = [limiter.try_acquire() for _ in range(slots)]
+            self.assertIsNone(limiter.try_acquire())
+            for admitted_at in admitted:
+                limiter.release(admitted_at, latency=latency)
+            limits.append(limiter.limit)
+        # Slow start doubles the limit up to its maximum, queueing cuts it
+        self.assertEqual(limits[:4], [2, 4, 8, 8])
+        self.assertAlmostEqual(limits[-1], 8 * 0.7)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_watcher_debounces_changes(self):
+        import tempfile
+        from scripts.watch import Watcher
+
+        with tempfile.TemporaryDirectory() as tmp:
+            watcher = Watcher([tmp], debounce=0.2)
+            self.assertEqual(watcher.poll(), [])
+            for name in ['a.txt', 'b.txt', 'ignored.md']:
+                with open(os.path.join(tmp, name), 'w') as f:
+                    f.write(name)
+            self.assertEqual(watcher.poll(), [])
+            time.sleep(0.25)
+            self.assertEqual(watcher.poll(), [tmp])
+            self.assertEqual(watcher.poll(), [])
+            self.assertEqual(sorted(map(os.path.basename, watcher.state[tmp])), ['a.txt', 'b.txt'])
+
+    def test_daemon_reuses_client_and_cache(self):
+        import asyncio
+        import tempfile
+        import httpx
+        from scripts.manifest import Manifest
+        from scripts.pipeline import Deck
+        from scripts.watch import Daemon
+
+        requests, sent = [], []
+
+        def handler(request):
+            requests.append(request)
+            card = {'question': f'Q{len(requests)}', 'answer': 'A'}
+            return httpx.Response(200, json={'response': json.dumps({'flashcards': [card]}), 'done': True})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'in')
+            os.makedirs(input_path)
+            with open(os.path.join(input_path, 'a.txt'), 'w') as f:
+                f.write('Cells are the basic unit of life. ' * 20)
+            deck = Deck(input_path, os.path.join(tmp, 'out', 'deck.csv'), 'Deck')
+            daemon = Daemon(
+                [deck],
+                token_budget=1000,
+                export_format='csv',
+                output_path=os.path.join(tmp, 'json'),
+                cache_db_path=os.path.join(tmp, 'cache.db'),
+                manifest_path=os.path.join(tmp, 'manifest.db'),
+                similarity_threshold=0,
+                transport=httpx.MockTransport(handler),
+            )
+
+            async def run():
+                async with daemon.pipeline:
+                    await daemon.rebuild([deck])
+                    await daemon.rebuild([deck])
+                    sent.append(len(requests))
+                    with open(os.path.join(input_path, 'b.txt'), 'w') as f:
+                        f.write('Mitochondria produce most of the ATP of a cell. ' * 20)
+                    await daemon.rebuild([deck])
+
+            asyncio.run(run())
+            with open(deck.output_file_path) as f:
+                rows = f.read().splitlines()
+            with Manifest(os.path.join(tmp, 'manifest.db')) as manifest:
+                self.assertIsNotNone(manifest.lookup(os.path.join(input_path, 'b.txt')))
+        # An unchanged input is served from the cache, a changed one regenerated
+        self.assertEqual(sent, [1])
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(rows, ['question,answer', 'Q2,A'])
+
+    def test_overlapping_builds_release_their_pins(self):
+        import asyncio
+        import tempfile
+        import httpx
+        from scripts.pipeline import Deck, WarmPipeline
+
+        async def handler(request):
+            if 'Ribosomes' in json.loads(request.content)['prompt']:
+                await slow.wait()
+            card = {'question': 'Q', 'answer': 'A'}
+            return httpx.Response(200, json={'response': json.dumps({'flashcards': [card]}), 'done': True})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            decks = []
+            for name, text in (
+                ('a', 'Enzymes lower the activation energy of reactions.'),
+                ('b', 'Cells are the basic unit of life.\n\nRibosomes assemble proteins from amino acids.'),
+            ):
+                os.makedirs(os.path.join(tmp, name))
+                with open(os.path.join(tmp, name, 'notes.txt'), 'w') as f:
+                    f.write(text)
+                decks.append(Deck(os.path.join(tmp, name), os.path.join(tmp, f'{name}.csv'), name))
+            pipeline = WarmPipeline(
+                10,
+                export_format='csv',
+                output_path=os.path.join(tmp, 'json'),
+                cache_db_path=os.path.join(tmp, 'cache.db'),
+                manifest_path=os.path.join(tmp, 'manifest.db'),
+                concurrency=2,
+                cache_max_bytes=1,
+                transport=httpx.MockTransport(handler),
+            )
+
+            async def run():
+                async with pipeline:
+                    build_b = asyncio.ensure_future(pipeline.build(decks[1]))
+                    while pipeline.store.size() < 1:
+                        await asyncio.sleep(0.01)
+                    await pipeline.build(decks[0])
+                    # the entries b pinned survive a's eviction, a's own entry does not
+                    during = {row[0] for row in pipeline.store.entries()}
+                    pinned = set().union(*pipeline.store._scopes)
+                    slow.set()
+                    await build_b
+                    return during, pinned, pipeline.store.size(), pipeline.store._scopes
+
+            slow = asyncio.Event()
+            during, pinned, after, scopes = asyncio.run(run())
+        self.assertTrue(during)
+        self.assertEqual(during, pinned)
+        self.assertEqual((after, scopes), (0, []))
+
+
+
+class TestService(unittest.TestCase):
+
+    def test_job_queue_requeues_interrupted_jobs(self):
+        import tempfile
+        from scripts.service import JobQueue
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'jobs.db')
+            queue = JobQueue(db_path)
+            for job_id in ['a', 'b']:
+                queue.add(id=job_id, title=job_id)
+            self.assertEqual(queue.claim()['id'], 'a')
+            queue.close()
+
+            queue = JobQueue(db_path)
+            self.assertEqual([queue.claim()['id'], queue.claim()['id']], ['a', 'b'])
+            self.assertIsNone(queue.claim())
+            queue.close()
+
+    def test_upload_status_and_result(self):
+        import asyncio
+        import contextlib
+        import http.client
+        import tempfile
+        import threading
+        import urllib.error
+        import urllib.request
+        import httpx
+        from scripts.pipeline import WarmPipeline
+        from scripts.service import JobService
+
+        def handler(request):
+            card = {'question': 'What is a cell?', 'answer': 'The unit of life.'}
+            return httpx.Response(200, json={'response': json.dumps({'flashcards': [card]}), 'done': True})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pipeline = WarmPipeline(
+                1000,
+                export_format='csv',
+                output_path=os.path.join(tmp, 'json'),
+                cache_db_path=os.path.join(tmp, 'cache.db'),
+                manifest_path=os.path.join(tmp, 'jobs', 'manifest.db'),
+                transport=httpx.MockTransport(handler),
+            )
+            service = JobService(pipeline, os.path.join(tmp, 'jobs'), max_queued=1)
+            loop = asyncio.new_event_loop()
+            task = loop.create_task(service.run(port=0))
+
+            def serve():
+                with contextlib.suppress(asyncio.CancelledError):
+                    loop.run_until_complete(task)
+
+            thread = threading.Thread(target=serve)
+            thread.start()
+            try:
+                while service.server is None:
+                    time.sleep(0.01)
+                url = f'http://127.0.0.1:{service.server.server_address[1]}'
+
+                def post(query, body=b'Cells are the basic unit of life. ' * 10):
+                    request = urllib.request.Request(f'{url}/jobs?{query}', body, method='POST')
+                    return json.loads(urllib.request.urlopen(request).read())
+
+                with self.assertRaises(urllib.error.HTTPError) as raised:
+                    post('filename=notes.exe')
+                self.assertEqual(raised.exception.code, 400)
+                for length in (None, 'abc', '-1'):
+                    connection = http.client.HTTPConnection('127.0.0.1', service.server.server_address[1])
+                    connection.putrequest('POST', '/jobs?filename=notes.txt')
+                    if length is not None:
+                        connection.putheader('Content-Length', length)
+                    connection.endheaders()
+                    self.assertEqual(connection.getresponse().status, 400)
+                    connection.close()
+                job = post('filename=biology%20notes.txt&title=Biology')
+                self.assertEqual((job['status'], job['title']), ('queued', 'Biology'))
+                for _ in range(500):
+                    job = json.loads(urllib.request.urlopen(f"{url}/jobs/{job['id']}").read())
+                    if job['status'] in ('done', 'failed'):
+                        break
+                    time.sleep(0.01)
+                self.assertEqual((job['status'], job['chunks_done'], job['chunks_total']), ('done', 1, 1))
+                result = urllib.request.urlopen(url + job['result'])
+                self.assertIn('biology_notes.csv', result.headers['Content-Disposition'])
+                self.assertEqual(result.read().decode().splitlines()[1], 'What is a cell?,The unit of life.')
+            finally:
+                loop.call_soon_threadsafe(task.cancel)
+                thread.join()
+                loop.close()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file